@@ -5,13 +5,23 @@
 " Helper functions
 " ----------------------------------------------------------------------------
 
-" This function try to automatically spot the `ctags` program location
+" This function try to automatically spot the `ctags` program location.
+" The result of the discovery is cached on disk (see s:cached_ctags_prg).
+" The first line of `ctags --version` for the program found is stored in
+" g:_surfer_ctags_version, so that Surfer doesn't need to run it again
+" (see `surfer.generator.TagsGenerator._ctags_info`)
 fu! surfer#find_ctags_prg(prg)
+    let g:_surfer_ctags_version = ""
     let pathsep = has("win32") ? '\' : '/'
     if match(a:prg, pathsep) != -1
         return a:prg
     endif
-    " Try to automatically discover Exuberant Ctags
+    let cached = s:cached_ctags_prg(a:prg)
+    if !empty(cached)
+        let g:_surfer_ctags_version = cached[1]
+        return cached[0]
+    endif
+    " Try to automatically discover Exuberant Ctags or Universal Ctags
     if has("win32")
         " `globpath()` wants forward slashes even on Windows
         let places = split(substitute($PATH, '\', '/', 'g'), ";")
@@ -24,7 +34,9 @@ fu! surfer#find_ctags_prg(prg)
     for prg in prgs
         for ctags in split(globpath(join(places, ","), prg), "\n")
             let out = system(ctags . " --version")
-            if v:shell_error == 0 && match(out, "Exuberant Ctags") != -1
+            if v:shell_error == 0 && match(out, '\(Exuberant\|Universal\) Ctags') != -1
+                let g:_surfer_ctags_version = split(out, "\n")[0]
+                call s:cache_ctags_prg(a:prg, ctags, g:_surfer_ctags_version)
                 return ctags
             endif
         endfor
@@ -32,6 +44,45 @@ fu! surfer#find_ctags_prg(prg)
     return a:prg
 endfu
 
+" This function returns the path of the cache file used to remember where
+" the ctags program is located
+fu! s:ctags_cache_file()
+    return g:surfer_cache_dir . "/ctags_prg"
+endfu
+
+" This function returns the ctags program found by a previous call of
+" `surfer#find_ctags_prg(prg)` and its version, as a list [path, version],
+" provided that neither $PATH nor the program itself have changed since
+" then. An empty list is returned otherwise.
+fu! s:cached_ctags_prg(prg)
+    let file = s:ctags_cache_file()
+    if !filereadable(file)
+        return []
+    endif
+    " cache file format: $PATH, prg, ctags path, ctags mtime, ctags version
+    let cache = readfile(file)
+    if len(cache) < 5 || cache[0] != $PATH || cache[1] != a:prg
+        return []
+    endif
+    if getftime(cache[2]) == -1 || getftime(cache[2]) != str2nr(cache[3])
+        return []
+    endif
+    return [cache[2], cache[4]]
+endfu
+
+" This function writes to disk where the ctags program is located
+fu! s:cache_ctags_prg(prg, ctags, version)
+    try
+        if !isdirectory(g:surfer_cache_dir)
+            call mkdir(g:surfer_cache_dir, "p")
+        endif
+        call writefile([$PATH, a:prg, a:ctags, getftime(a:ctags), a:version],
+            \ s:ctags_cache_file())
+    catch
+        " caching is just an optimization
+    endtry
+endfu
+
 
 " Init
 " ----------------------------------------------------------------------------
@@ -41,7 +92,7 @@ let s:curr_folder = expand("<sfile>:p:h")
 " this variable MUST match the `version` constant in the extension module
 " `surfer.ext.search` so that we can tell the user when he needs to recompile
 " the search component.
-let s:latest_extension_version = 2
+let s:latest_extension_version = 7
 let s:extension_exists = filereadable(s:curr_folder."/surfer/ext/search.so")
 
 " On non-Windows plarforms, tell the user that faster searches can be possible
@@ -90,6 +141,14 @@ fu! surfer#Open()
     endif
 endfu
 
+fu! surfer#Profile(path)
+    py _surfer.Profile(vim.eval("a:path").decode(vim.eval("&enc")))
+endfu
+
+fu! surfer#Memory(path)
+    py _surfer.Memory(vim.eval("a:path").decode(vim.eval("&enc")))
+endfu
+
 
 " Autocommands
 " ----------------------------------------------------------------------------
@@ -97,12 +156,14 @@ endfu
 augroup surfer
     au!
 
-    au BufWritePost .vimrc py _surfer.ui.setup_colors()
-    au Colorscheme * py _surfer.ui.setup_colors()
+    au BufWritePost .vimrc py _surfer.ui.colors_outdated = True
+    au Colorscheme * py _surfer.ui.colors_outdated = True
     au VimLeave * py _surfer.close()
 
     au BufEnter * py _surfer.project.update_root()
-    au BufWritePost * py _surfer.generator.rebuild_tags = True
-    au BufDelete,BufNew * if empty(&buftype) | exec "py _surfer.generator.rebuild_tags = True" | endif
+    au BufEnter * exec "py _surfer.generator.buffer_entered(" . expand("<abuf>") . ")"
+    au BufWritePost * exec "py _surfer.generator.buffer_written(" . expand("<abuf>") . ")"
+    au TextChanged,InsertLeave * exec "py _surfer.generator.buffer_changed(" . expand("<abuf>") . ")"
+    au BufDelete,BufNew * if empty(&buftype) | exec "py _surfer.generator.invalidate()" | endif
 
 augroup END
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+surfer.coprocess
+~~~~~~~~~~~~~~~~
+
+This module defines the CtagsCoprocess class. This class keeps a Universal
+Ctags process running in interactive mode (see `ctags --_interactive`) so
+that tags for single files can be generated without paying the startup cost
+of a new ctags process every time.
+
+The co-process is not used on MS Windows, where reading from ctags can't
+be given a timeout (`select` doesn't work with pipes): a hung ctags would
+hang vim as well.
+"""
+
+import os
+import json
+import select
+import subprocess
+
+from surfer import exceptions as ex
+
+
+class CtagsCoprocess:
+
+    def __init__(self, cmd, timeout=5.0):
+        # `cmd` is the list of arguments used to start ctags
+        self.cmd = cmd
+        self.timeout = timeout
+        self.proc = None
+        self.buf = ""
+
+    def alive(self):
+        """To check if the ctags process is up and running."""
+        return self.proc is not None and self.proc.poll() is None
+
+    def start(self):
+        """To start a new ctags process. The current one, if any, is
+        stopped first."""
+        self.stop()
+        with open(os.devnull, "w") as devnull:
+            self.proc = subprocess.Popen(self.cmd, stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE, stderr=devnull)
+        self.buf = ""
+        # ctags greets with a line of the form:
+        # {"_type": "program", "name": "Universal Ctags", "version": "..."}
+        if self._read_message().get("_type") != "program":
+            raise ex.SurferException("Unexpected ctags greeting")
+
+    def stop(self):
+        """To stop the ctags process."""
+        if self.proc is None:
+            return
+        try:
+            self.proc.stdin.close()
+            if self.proc.poll() is None:
+                self.proc.terminate()
+            self.proc.wait()
+        except (IOError, OSError):
+            pass
+        self.proc = None
+
+    def generate(self, filename, content=None):
+        """To generate tags for the file `filename`.
+
+        If `content` is given, tags are generated for `content` (a byte
+        string) instead of the content of the file on disk.
+
+        Returns the ctags output, one JSON object per line. If the ctags
+        process is not healthy, it's restarted once before giving up.
+        """
+        for attempt in range(2):
+            try:
+                if not self.alive():
+                    self.start()
+                return self._request(filename, content)
+            except (IOError, OSError, ValueError, ex.SurferException) as e:
+                self.stop()
+                error = e
+        raise ex.SurferException(
+            "Error: ctags interactive mode failed: {}".format(error))
+
+    def _request(self, filename, content):
+        """To send a single `generate-tags` request."""
+        request = {"command": "generate-tags", "filename": filename}
+        if content is not None:
+            request["size"] = len(content)
+        self.proc.stdin.write(json.dumps(request) + "\n")
+        if content is not None:
+            self.proc.stdin.write(content)
+        self.proc.stdin.flush()
+
+        lines = []
+        while True:
+            line = self._readline()
+            if line.startswith('{"_type": "tag"'):
+                lines.append(line)
+                continue
+            msg = json.loads(line)
+            if msg.get("_type") == "completed":
+                return "\n".join(lines)
+            if msg.get("_type") == "error":
+                raise ex.SurferException(msg.get("message", "unknown error"))
+            if msg.get("_type") == "tag":
+                lines.append(line)
+
+    def _read_message(self):
+        """To read a single JSON message from ctags."""
+        return json.loads(self._readline())
+
+    def _readline(self):
+        """To read a single line from ctags. An exception is raised if
+        ctags doesn't answer within `self.timeout` seconds."""
+        fd = self.proc.stdout.fileno()
+        while "\n" not in self.buf:
+            ready, _, _ = select.select([fd], [], [], self.timeout)
+            if not ready:
+                raise ex.SurferException("ctags is not responding")
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                raise ex.SurferException("ctags exited unexpectedly")
+            self.buf += chunk
+        line, self.buf = self.buf.split("\n", 1)
+        return line
@@ -7,26 +7,114 @@ This module defines the Surfer class.
 """
 
 import os
+import codecs
 
 from surfer import ui
+from surfer import daemon
 from surfer import finder
 from surfer import project
 from surfer import generator
 from surfer.utils import v
+from surfer.utils import settings
+from surfer.utils import profiler
+from surfer.utils import memprof
 
 
 class Surfer:
 
     def __init__(self):
         self.project = project.Project(self)
+        self.daemon = daemon.DaemonClient(settings.get("daemon_socket"))
         self.generator = generator.TagsGenerator(self)
         self.finder = finder.TagsFinder(self, self.generator)
         self.ui = ui.UserInterface(self)
+        memprof.enabled = settings.get("memory_profiling", bool)
 
     def close(self):
         """To performs cleanup actions."""
         self.generator.close()
+        self.daemon.close()
 
     def Open(self):
         """To open the Tag Surfer user interface."""
+        memprof.enabled = settings.get("memory_profiling", bool)
         self.ui.open()
+
+    def Profile(self, path=u""):
+        """To display the timings collected in the current session, or
+        to write them to the file `path`."""
+        lines = profiler.report()
+        memory = self.generator.memory()
+        lines.extend([u"", u"{:,} tags in memory ({:.1f} MB, index {:.1f} MB), "
+            u"{:,} files in the project".format(memory["tags"],
+                memory["tags_memory"] / 1048576.0,
+                memory["index_memory"] / 1048576.0,
+                len(self.project.files_cache))])
+        if memory["spilled_files"]:
+            lines.append(u"{:,} files spilled to disk ({:,} tags, {:.1f} MB)"
+                .format(memory["spilled_files"], memory["spilled_tags"],
+                        memory["spill_size"] / 1048576.0))
+        if path:
+            path = os.path.expanduser(path)
+            with codecs.open(path, "w", encoding="utf-8") as f:
+                f.write(u"\n".join(lines) + u"\n")
+            v.echo(u"Profile written to {}".format(path))
+        else:
+            for line in lines:
+                v.echo(line, surfermsg=False)
+
+    def memory_stats(self):
+        """To return the memory taken by the main Surfer data structures, as
+        a list of tuples (name, count, bytes).
+
+        Sizes of tags are estimated from a sample of them. The memory that
+        sharing equal strings among tags would save is reported as well.
+        """
+        gen = self.generator
+        tags = gen.all_tags()
+        exts = [t["exts"] for t in tags]
+        exts_size = memprof.sample_size(exts)
+        strings = []
+        for t in tags:
+            strings.append(t["file"])
+            strings.extend(value for value in t["exts"].itervalues()
+                           if isinstance(value, basestring))
+
+        tagfiles = [f for f in gen.tagfiles() if os.path.exists(f)]
+        spilled_tags, spill_size = gen.spill.memory()
+        rows = [
+            (u"tags", len(tags), memprof.sample_size(tags) - exts_size),
+            (u"tags exts", len(exts), exts_size),
+            (u"interned savings", len(strings),
+                memprof.interning_savings(strings)),
+            (u"index", len(tags), gen.index.memory()),
+            (u"name index", len(gen.index.names.tags),
+                gen.index.names.memory()),
+            (u"project files", len(self.project.files_cache),
+                memprof.deep_size(self.project.files_cache)),
+            (u"display paths", len(self.project.short_paths),
+                self.project.short_paths.memory()),
+            (u"search results", len(self.ui.search_results_cache),
+                memprof.deep_size(self.ui.search_results_cache)),
+            (u"tagfiles (disk)", len(tagfiles),
+                sum(os.path.getsize(f) for f in tagfiles)),
+            (u"spill (disk)", spilled_tags, spill_size),
+        ]
+        if gen.mapped is not None:
+            rows.append((u"mapped index", len(gen.mapped), len(gen.mapped.map)))
+        rows.append((u"process rss", 0, memprof.rss()))
+        return rows
+
+    def Memory(self, path=u""):
+        """To display the memory taken by Surfer data structures and the
+        allocations measured in the current session (see
+        `g:surfer_memory_profiling`), or to write them to the file `path`."""
+        lines = memprof.report(self.memory_stats())
+        if path:
+            path = os.path.expanduser(path)
+            with codecs.open(path, "w", encoding="utf-8") as f:
+                f.write(u"\n".join(lines) + u"\n")
+            v.echo(u"Memory report written to {}".format(path))
+        else:
+            for line in lines:
+                v.echo(line, surfermsg=False)
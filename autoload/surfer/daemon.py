@@ -0,0 +1,380 @@
+# -*- coding: utf-8 -*-
+"""
+surfer.daemon
+~~~~~~~~~~~~~
+
+This module defines the TagsDaemon class and the DaemonClient class.
+
+A single daemon holds one tag index per project root and serves it over a
+Unix socket to all running Vim instances, so that tags for a project are
+generated and kept in memory only once. The first Vim instance that
+searches a project not yet known to the daemon generates tags as usual and
+uploads them; every other instance just sends queries. Instances notify the
+daemon whenever the tags for a file change.
+
+This module doesn't depend on vim. The daemon is started with:
+
+    $ python /path/to/surfer.vim/autoload/surfer/daemon.py [socket]
+
+Requests and responses are JSON objects, one per line. Requests have an
+`op` key (ping, status, put, update, drop, query), responses an `ok` key.
+The tags of a project are uploaded with many `put` requests, so that no
+single request holds all of them.
+"""
+
+import os
+import sys
+import json
+import time
+import errno
+import select
+import socket
+import threading
+import SocketServer
+
+if __name__ == "__main__":
+    # make the `surfer` package importable (and hide its modules, which
+    # would otherwise be importable as top-level modules)
+    sys.path[0] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+from surfer.index import TagIndex, filter_tags
+from surfer.search.ranking import rank_within
+from surfer import exceptions as ex
+
+
+# Incremented each time the protocol changes in an incompatible way
+PROTOCOL_VERSION = 3
+
+# Maximum memory (in bytes) each index can take, see `surfer.index.TagIndex`
+INDEX_BUDGET = 256 * 1048576
+
+
+def default_socket_path():
+    """To return the default path of the daemon socket."""
+    cache = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache, "surfer", "daemon.sock")
+
+
+def pack_tags(tags):
+    """To convert tags into a compact, JSON serializable, form."""
+    return [(t["name"], t["file"], t["cmd"], t["exts"]) for t in tags]
+
+
+def unpack_tags(packed):
+    """To convert tags packed with `pack_tags` back into dictionaries."""
+    return [{"name": name, "file": file, "cmd": cmd, "exts": exts}
+            for name, file, cmd, exts in packed]
+
+
+# Server
+# ----------------------------------------------------------------------------
+
+class TagsDaemon:
+    """To keep the tags and the index of many projects and answer queries
+    about them."""
+
+    def __init__(self):
+        # {root: (tags, index)}
+        self.projects = {}
+        # {root: (upload id, tags)} for the uploads not yet complete (see
+        # `op_put`)
+        self.uploads = {}
+        # Held only while looking at or changing `projects` and the indexes,
+        # never while ranking tags. Tag lists are never changed in place but
+        # replaced, so that queries can keep using the one they got.
+        self.lock = threading.Lock()
+        # Held while replacing a project, so that no update gets lost
+        self.update_lock = threading.Lock()
+
+    def handle(self, request):
+        """To handle a single request and return the response."""
+        op = request.get("op")
+        handler = getattr(self, "op_{}".format(op), None)
+        if handler is None:
+            return {"ok": False, "error": "unknown op: {}".format(op)}
+        try:
+            response = handler(request)
+        except (KeyError, TypeError, ValueError, AttributeError,
+                ex.SurferException) as e:
+            return {"ok": False, "error": str(e)}
+        response["ok"] = True
+        return response
+
+    def op_ping(self, request):
+        return {"version": PROTOCOL_VERSION}
+
+    def op_status(self, request):
+        with self.lock:
+            project = self.projects.get(request["root"])
+            if project is None:
+                return {"indexed": False}
+            return {"indexed": True, "tags": len(project[0])}
+
+    def op_put(self, request):
+        # Tags come in chunks, all with the same upload id: the project is
+        # replaced once the last one (without the `more` key) arrives. A new
+        # upload for the same project discards an unfinished one.
+        root = request["root"]
+        tags = unpack_tags(request["tags"])
+        upload = request.get("upload")
+        with self.lock:
+            pending = self.uploads.pop(root, (None, []))
+            if pending[0] == upload:
+                tags = pending[1] + tags
+            if request.get("more"):
+                self.uploads[root] = (upload, tags)
+                return {}
+        # The index is built without holding the lock so that queries for
+        # other projects are not blocked in the meantime
+        index = TagIndex(INDEX_BUDGET)
+        index.build(tags)
+        with self.update_lock:
+            with self.lock:
+                self.projects[root] = (tags, index)
+        return {}
+
+    def op_update(self, request):
+        file = request["file"]
+        new_tags = unpack_tags(request["tags"])
+        with self.update_lock:
+            with self.lock:
+                project = self.projects.get(request["root"])
+            if project is None:
+                return {"indexed": False}
+            tags, index = project
+            tags = [t for t in tags if t["file"] != file]
+            tags.extend(new_tags)
+            with self.lock:
+                index.replace_file(file, new_tags)
+                self.projects[request["root"]] = (tags, index)
+            return {"indexed": True}
+
+    def op_drop(self, request):
+        with self.lock:
+            self.projects.pop(request["root"], None)
+            self.uploads.pop(request["root"], None)
+        return {}
+
+    def op_query(self, request):
+        kinds = request.get("kinds", [])
+        paths = request.get("paths", [])
+        k = request.get("k", -1)
+        smart_case = request.get("smart_case", 1)
+        with self.lock:
+            project = self.projects.get(request["root"])
+            if project is None:
+                return {"indexed": False}
+            tags, index = project
+            # see `surfer.finder.TagsFinder.find_tags`
+            candidates = index.prefixed(request["query"], smart_case, kinds,
+                                        paths)
+            if not 0 <= k <= len(candidates):
+                candidates = index.candidates(request["query"], kinds, paths)
+                if candidates is None and paths:
+                    tags = index.scoped(paths)
+        if candidates is None:
+            candidates = filter_tags(tags, kinds, ())
+        results, partial = rank_within(request["query"], candidates, k,
+            smart_case, request.get("budget", 0))
+        return {"indexed": True, "results": results, "partial": partial}
+
+
+class _Handler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        for line in iter(self.rfile.readline, ""):
+            try:
+                request = json.loads(line)
+            except ValueError:
+                response = {"ok": False, "error": "invalid request"}
+            else:
+                response = self.server.daemon.handle(request)
+            try:
+                self.wfile.write(json.dumps(response) + "\n")
+                self.wfile.flush()
+            except socket.error:
+                # the client gave up waiting (see `DaemonClient.request`)
+                return
+
+    def finish(self):
+        try:
+            SocketServer.StreamRequestHandler.finish(self)
+        except socket.error:
+            pass
+
+
+class _Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(path):
+    """To run the daemon on the Unix socket `path` until interrupted."""
+    if os.path.exists(path):
+        if DaemonClient(path).ping():
+            sys.exit("surfer: a daemon is already listening on {}".format(path))
+    if os.path.exists(path):
+        # left behind by a daemon that is no longer running
+        os.remove(path)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    server = _Server(path, _Handler)
+    server.daemon = TagsDaemon()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(path)
+
+
+# Client
+# ----------------------------------------------------------------------------
+
+class DaemonClient:
+    """To talk to the daemon listening on the Unix socket `path`.
+
+    Every method returns None when the daemon is not available, so that
+    callers can fall back to doing the work themselves.
+    """
+
+    # seconds between two calls of the `interrupt` function while waiting
+    # for a response
+    poll_interval = 0.05
+
+    # number of tags sent with each request when uploading tags
+    chunk_size = 20000
+
+    def __init__(self, path, timeout=2.0):
+        self.path = path
+        self.timeout = timeout
+        self.sock = None
+        self.rfile = None
+
+    def available(self):
+        """To check whether a daemon can be reached. A socket left behind by
+        a daemon that is no longer running is removed the first time a
+        request fails to connect (see `_connect`)."""
+        return self.sock is not None or os.path.exists(self.path)
+
+    def close(self):
+        """To close the connection with the daemon."""
+        if self.sock is not None:
+            try:
+                self.rfile.close()
+                self.sock.close()
+            except socket.error:
+                pass
+        self.sock = self.rfile = None
+
+    def ping(self):
+        response = self.request({"op": "ping"})
+        return bool(response and response.get("version") == PROTOCOL_VERSION)
+
+    def status(self, root):
+        return self.request({"op": "status", "root": root})
+
+    def put(self, root, tags):
+        """To upload all the tags of the project `root`, `chunk_size` tags
+        at a time. Each chunk must arrive within the usual timeout."""
+        upload = os.urandom(8).encode("hex")
+        chunks = [tags[i:i+self.chunk_size]
+                  for i in xrange(0, len(tags), self.chunk_size)] or [[]]
+        for chunk in chunks[:-1]:
+            if self.request({"op": "put", "root": root, "upload": upload,
+                             "tags": pack_tags(chunk), "more": True}) is None:
+                return None
+        # indexing all the tags takes a while
+        return self.request({"op": "put", "root": root, "upload": upload,
+                             "tags": pack_tags(chunks[-1])}, timeout=60.0)
+
+    def update(self, root, file, tags):
+        return self.request({"op": "update", "root": root, "file": file,
+                             "tags": pack_tags(tags)})
+
+    def drop(self, root):
+        return self.request({"op": "drop", "root": root})
+
+    def query(self, root, query, k, smart_case, budget=0, kinds=(), paths=(),
+              interrupt=None):
+        """To search `query` among the tags of the project `root`.
+        Results are the same returned by `TagsFinder.find_tags`."""
+        response = self.request({"op": "query", "root": root, "query": query,
+            "k": k, "smart_case": smart_case, "budget": budget,
+            "kinds": list(kinds), "paths": list(paths)}, interrupt=interrupt)
+        if response and response.get("indexed"):
+            for result in response["results"]:
+                result["match_positions"] = tuple(result["match_positions"])
+        return response
+
+    def request(self, request, timeout=None, interrupt=None):
+        """To send a single request and wait for the response.
+
+        `interrupt` is an optional function called while waiting. When it
+        returns True the request is abandoned and the exception
+        `SearchInterrupted` is raised.
+        """
+        if not self.available():
+            return None
+        try:
+            if self.sock is None:
+                self._connect()
+            self.sock.settimeout(timeout or self.timeout)
+            self.sock.sendall(json.dumps(request) + "\n")
+            if interrupt is not None:
+                self._wait(timeout or self.timeout, interrupt)
+            line = self.rfile.readline()
+            if not line:
+                raise socket.error(errno.ECONNRESET, "connection closed")
+            response = json.loads(line)
+        except (socket.error, ValueError):
+            self.close()
+            return None
+        if not response.get("ok"):
+            return None
+        return response
+
+    def _wait(self, timeout, interrupt):
+        """To wait at most `timeout` seconds for a response, calling
+        `interrupt` every `poll_interval` seconds in the meantime."""
+        deadline = time.time() + timeout
+        while not select.select([self.sock], [], [], self.poll_interval)[0]:
+            if interrupt():
+                # the connection is closed so that the response is never
+                # read in place of the next one
+                self.close()
+                raise ex.SearchInterrupted("Search interrupted")
+            if time.time() > deadline:
+                raise socket.timeout("timed out")
+
+    def _connect(self):
+        """To open a connection with the daemon and make sure it speaks the
+        same protocol.
+
+        When nothing listens on the socket, the daemon died without removing
+        it: the socket is removed so that the daemon is no longer considered
+        available. `socket.error` is raised when the daemon can't be used.
+        """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except socket.error as e:
+            sock.close()
+            if e.errno == errno.ECONNREFUSED:
+                try:
+                    os.remove(self.path)
+                except OSError:
+                    pass
+            raise
+        self.sock = sock
+        self.rfile = sock.makefile("rb")
+        self.sock.sendall(json.dumps({"op": "ping"}) + "\n")
+        response = json.loads(self.rfile.readline() or "{}")
+        if response.get("version") != PROTOCOL_VERSION:
+            self.close()
+            raise socket.error(errno.EPROTO, "incompatible daemon")
+
+
+if __name__ == "__main__":
+    serve(sys.argv[1] if len(sys.argv) > 1 else default_socket_path())
@@ -9,3 +9,7 @@ This module defines custom exceptions for the Surfer plugin.
 
 class SurferException(Exception):
     pass
+
+
+class SearchInterrupted(SurferException):
+    pass
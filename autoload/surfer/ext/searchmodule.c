@@ -17,14 +17,54 @@
 #endif
 
 
-const long version = 2;
+const long version = 7;
+
+
+static char py_prepare_doc[] = "To compute once the data about `haystack` "
+    "needed by `match`.\n"
+    "Returns a tuple of three elements: `haystack` in lowercase, a byte "
+    "string where the i-th byte is 1 if the i-th character of `haystack` is "
+    "at a word boundary (0 otherwise), and whether `haystack` has only "
+    "uppercase characters.";
+
+static PyObject *
+py_prepare(PyObject *self, PyObject *args)
+{
+    const Py_UNICODE *haystack;
+    const int haystack_len;
+    int i;
+
+    if (!PyArg_ParseTuple(args, "u#", &haystack, &haystack_len))
+        return NULL;
+
+    PyObject *lower = PyUnicode_FromUnicode(NULL, haystack_len);  // new ref
+    PyObject *mask = PyBytes_FromStringAndSize(NULL, haystack_len);  // new ref
+    if (lower == NULL || mask == NULL) {
+        Py_XDECREF(lower);
+        Py_XDECREF(mask);
+        return NULL;
+    }
+
+    Py_UNICODE *lower_buf = PyUnicode_AS_UNICODE(lower);
+    char *mask_buf = PyBytes_AS_STRING(mask);
+    int isupper = _isupper(haystack, haystack_len);
+
+    for (i = 0; i < haystack_len; i++) {
+        lower_buf[i] = Py_UNICODE_TOLOWER(haystack[i]);
+        mask_buf[i] = _is_boundary(haystack, i, !isupper);
+    }
+
+    return Py_BuildValue("(N,N,N)", lower, mask, PyBool_FromLong(isupper));
+}
 
 
 static char py_match_doc[] = "To search for `needle` in `haystack`.\n"
     "Returns a tuple of two elements: a number and another tuple."
     "The number is a measure of the similarity between `needle` and "
     "`haystack`, whereas the other tuple contains the positions where "
-    "the match occurs in `haystack`.";
+    "the match occurs in `haystack`.\n"
+    "`meta` is the value returned by `prepare(haystack)`. It's computed on "
+    "the fly when not given.";
 
 static PyObject *
 py_match(PyObject *self, PyObject *args)
@@ -32,180 +72,408 @@ py_match(PyObject *self, PyObject *args)
     const Py_UNICODE *needle, *haystack;
     const int needle_len, haystack_len;
     const int smart_case;
-    int i, j, k;
+    PyObject *meta = Py_None;
+    int i;
 
-    if (!PyArg_ParseTuple(args, "u#u#i",
-            &needle, &needle_len, &haystack, &haystack_len, &smart_case))
+    if (!PyArg_ParseTuple(args, "u#u#i|O",
+            &needle, &needle_len, &haystack, &haystack_len, &smart_case, &meta))
         return NULL;
 
     if (needle_len == 0) {
         return Py_BuildValue("(i,())", -1);
     }
 
-    // If `haystack` has only uppercase characters then it makes no sense
-    // to treat an uppercase letter as a word-boundary character
-    int uppercase_is_word_boundary = !_isupper(haystack, haystack_len);
+    // Lowercase characters and word boundaries of `haystack` are either
+    // given or computed here once
+    if (meta == Py_None) {
+        PyObject *prepare_args = Py_BuildValue("(u#)", haystack, haystack_len);  // new ref
+        if (prepare_args == NULL)
+            return NULL;
+        meta = py_prepare(self, prepare_args);  // new ref
+        Py_DECREF(prepare_args);
+        if (meta == NULL)
+            return NULL;
+    } else {
+        Py_INCREF(meta);
+    }
+
+    const Py_UNICODE *lower_haystack;
+    const char *mask;
+    int lower_len, mask_len, meta_isupper;
+    if (!PyArg_ParseTuple(meta, "u#s#i", &lower_haystack, &lower_len,
+            &mask, &mask_len, &meta_isupper) ||
+            lower_len != haystack_len || mask_len != haystack_len) {
+        if (!PyErr_Occurred())
+            PyErr_SetString(PyExc_ValueError, "meta doesn't match haystack");
+        Py_DECREF(meta);
+        return NULL;
+    }
+
+    workspace_t ws = {0};
+    int *best_positions = malloc(needle_len * sizeof(int));
+    if (best_positions == NULL) {
+        Py_DECREF(meta);
+        return PyErr_NoMemory();
+    }
 
-    // Initialize return values
-    PyObject *best_positions = Py_BuildValue("()");
     float best_similarity = -1;
+    int found = _match(&ws, needle, needle_len, haystack, lower_haystack,
+        mask, haystack_len, smart_case, best_positions, &best_similarity);
+    Py_DECREF(meta);
+    _workspace_free(&ws);
+
+    if (found < 0) {
+        free(best_positions);
+        return PyErr_NoMemory();
+    }
 
-    int cond, cond1, cond2;
-    int needle_idx;
-    Py_UNICODE c, prev;
-    Py_UNICODE *_ch;
-    PyObject *ch;
-    PyObject *pos;
-    PyObject *fork, *matcher, *matchers;
-    PyObject *consumed, *positions, *boundaries;
-    PyObject *needle_obj = PyUnicode_FromUnicode(needle, needle_len);  // new ref XXX
-
-    // `matchers` keeps track of all possible matches of `needle` in `haystack`
-    matchers = PyList_New(1);  // new ref
-
-    // Add the first matcher
-    matcher = PyDict_New();  // new ref
-    PyDict_SetItemString(matcher, "needle_idx", Py_BuildValue("i", 0));
-    PyDict_SetItemString(matcher, "consumed", PyList_New(0));
-    PyDict_SetItemString(matcher, "boundaries", PyList_New(0));
-    PyDict_SetItemString(matcher, "positions", PyList_New(0));
-    PyList_SetItem(matchers, 0, matcher);  // PyList_SetItem don't increment the reference count
+    PyObject *positions = PyTuple_New(found ? needle_len : 0);  // new ref
+    if (positions == NULL) {
+        free(best_positions);
+        return NULL;
+    }
+    for (i = 0; found && i < needle_len; i++)
+        PyTuple_SET_ITEM(positions, i, PyInt_FromLong(best_positions[i]));
+    free(best_positions);
 
-    for (i = 0; i < haystack_len; i++) {
+    return Py_BuildValue("(f,N)", best_similarity, positions);
+}
 
-        // Create forks
 
-        /*assert(PyList_Check(matchers));*/
-        for (j = 0; j < PyList_Size(matchers); j++) {
+static char py_search_mapped_doc[] = "To search for `needle` in all the "
+    "names of a mapped index (see `surfer.mapped`).\n"
+    "`index` is any object supporting the buffer interface (e.g. a mmap "
+    "object). `k` is the maximum number of results (-1 means no limit). "
+    "`exclude`, if given, is a byte string with a byte for each file of the "
+    "index: tags of files whose byte is not 0 are skipped. `ids`, if given, "
+    "is a byte string of 32-bit little-endian tag ids, in increasing order: "
+    "only those tags are searched.\n"
+    "Returns a list of tuples (similarity, tag id, positions) sorted by "
+    "similarity. Tags with the same similarity keep the order they have in "
+    "the index.";
+
+static PyObject *
+py_search_mapped(PyObject *self, PyObject *args)
+{
+    const char *index;
+    const Py_UNICODE *needle;
+    const char *exclude = NULL, *ids = NULL;
+    int index_len, needle_len, smart_case, k, exclude_len = 0, ids_len = 0;
+    int i, j, t;
+
+    if (!PyArg_ParseTuple(args, "s#u#ii|z#z#", &index, &index_len,
+            &needle, &needle_len, &smart_case, &k, &exclude, &exclude_len,
+            &ids, &ids_len))
+        return NULL;
+
+    if (index_len < MAPPED_HEADER_SIZE ||
+            memcmp(index, MAPPED_MAGIC, 8) != 0 ||
+            _read_u32(index + 8) != MAPPED_VERSION) {
+        PyErr_SetString(PyExc_ValueError, "invalid index");
+        return NULL;
+    }
+
+    unsigned int ntags = _read_u32(index + 12);
+    unsigned int nfiles = _read_u32(index + 16);
+    unsigned int tags_off = _read_u32(index + 20);
+    if ((unsigned long)tags_off + (unsigned long)ntags * MAPPED_TAG_SIZE > (unsigned long)index_len) {
+        PyErr_SetString(PyExc_ValueError, "invalid index");
+        return NULL;
+    }
+
+    if (needle_len == 0)
+        return PyList_New(0);
+
+    // Best results found so far, sorted by (similarity, id). Positions of
+    // each result are kept in a slot of `positions`; `spare` is the slot
+    // not used by any result, where positions of the next match go.
+    int capacity = k >= 0 ? k : 64;
+    int count = 0, spare = 0;
+    result_t *results = malloc((capacity + 1) * sizeof(result_t));
+    int *positions = malloc((capacity + 1) * needle_len * sizeof(int));
+    Py_UNICODE *haystack = NULL, *lower = NULL;
+    int haystack_cap = 0;
+    workspace_t ws = {0};
+    int failed = 0;
+
+    if (results == NULL || positions == NULL)
+        failed = 1;
+
+    int n = ids != NULL ? ids_len / 4 : (int)ntags;
+    for (t = 0; !failed && t < n && k != 0; t++) {
+
+        i = ids != NULL ? (int)_read_u32(ids + 4 * t) : t;
+        if (i < 0 || i >= (int)ntags)
+            continue;
+
+        const char *rec = index + tags_off + (unsigned long)i * MAPPED_TAG_SIZE;
+        unsigned int name_off = _read_u32(rec);
+        unsigned int name_len = _read_u16(rec + 4);
+        unsigned int nchars = _read_u16(rec + 6);
+        unsigned int file_id = _read_u32(rec + 8);
+
+        if (exclude != NULL && file_id < (unsigned int)exclude_len && exclude[file_id])
+            continue;
+        if ((unsigned long)name_off + name_len + nchars > (unsigned long)index_len)
+            continue;
+
+        if ((int)nchars > haystack_cap) {
+            haystack_cap = nchars * 2;
+            free(haystack);
+            free(lower);
+            haystack = malloc(haystack_cap * sizeof(Py_UNICODE));
+            lower = malloc(haystack_cap * sizeof(Py_UNICODE));
+            if (haystack == NULL || lower == NULL) {
+                failed = 1;
+                break;
+            }
+        }
+
+        int haystack_len = _decode_utf8(index + name_off, name_len, haystack, nchars);
+        if (haystack_len != (int)nchars)
+            continue;
+        // the word boundaries mask is stored right after the name
+        const char *mask = index + name_off + name_len;
+        for (j = 0; j < haystack_len; j++)
+            lower[j] = Py_UNICODE_TOLOWER(haystack[j]);
+
+        if (!_is_subsequence(needle, needle_len, haystack, lower, haystack_len, smart_case))
+            continue;
+
+        float s;
+        int found = _match(&ws, needle, needle_len, haystack, lower, mask,
+            haystack_len, smart_case, positions + spare * needle_len, &s);
+        if (found < 0) {
+            failed = 1;
+            break;
+        }
+        if (!found)
+            continue;
+
+        if (k >= 0 && count == k && s >= results[count-1].similarity)
+            continue;
+
+        // the new result is put past the last one and then moved to its
+        // place: the result that ends up past the last one is dropped
+        results[count].similarity = s;
+        results[count].id = i;
+        results[count].positions = spare;
+        int pos = count;
+        while (pos > 0 && results[pos-1].similarity > s) {
+            result_t tmp = results[pos-1];
+            results[pos-1] = results[pos];
+            results[pos] = tmp;
+            pos--;
+        }
+
+        if (k < 0 || count < k) {
+            count++;
+            spare = count;
+        } else {
+            spare = results[count].positions;
+        }
+
+        if (k < 0 && count == capacity) {
+            capacity *= 2;
+            result_t *r = realloc(results, (capacity + 1) * sizeof(result_t));
+            int *p = realloc(positions, (capacity + 1) * needle_len * sizeof(int));
+            if (r != NULL)
+                results = r;
+            if (p != NULL)
+                positions = p;
+            if (r == NULL || p == NULL)
+                failed = 1;
+        }
+    }
+
+    free(haystack);
+    free(lower);
+    _workspace_free(&ws);
+
+    PyObject *list = NULL;
+    if (!failed) {
+        list = PyList_New(count);  // new ref
+        for (i = 0; list != NULL && i < count; i++) {
+            PyObject *pos = PyTuple_New(needle_len);  // new ref
+            if (pos == NULL) {
+                Py_DECREF(list);
+                list = NULL;
+                break;
+            }
+            for (j = 0; j < needle_len; j++) {
+                PyTuple_SET_ITEM(pos, j, PyInt_FromLong(
+                    positions[results[i].positions * needle_len + j]));
+            }
+            PyList_SET_ITEM(list, i, Py_BuildValue("(f,i,N)",
+                results[i].similarity, results[i].id, pos));
+        }
+    } else {
+        PyErr_NoMemory();
+    }
+
+    free(results);
+    free(positions);
+    (void)nfiles;
+    return list;
+}
+
+
+/* =============================== MATCHING ================================ */
+
 
-            // get matchers[j] and its values
-            matcher = PyList_GetItem(matchers, j);
-            /*assert(PyDict_Check(matcher));*/
-            consumed = PyDict_GetItemString(matcher, "consumed");
-            /*assert(PyList_Check(consumed));*/
-            positions = PyDict_GetItemString(matcher, "positions");
-            /*assert(PyList_Check(positions));*/
-            boundaries = PyDict_GetItemString(matcher, "boundaries");
-            /*assert(PyList_Check(boundaries));*/
+int
+_match(workspace_t *ws, const Py_UNICODE *needle, int needle_len,
+       const Py_UNICODE *haystack, const Py_UNICODE *lower, const char *mask,
+       int haystack_len, int smart_case, int *best_positions,
+       float *best_similarity)
+{
+    // This is the same algorithm of `surfer.search.search.alignments`, where
+    // matchers are kept in flat arrays. The i-th matcher uses the slots
+    // [i*needle_len, (i+1)*needle_len) of `ws->positions` and
+    // `ws->boundaries`. The characters consumed by a matcher are always the
+    // first `needle_idx` characters of `needle` (lowercase).
+    int i, j, k;
+    int found = 0;
+
+    if (_workspace_reserve(ws, 1, needle_len) < 0)
+        return -1;
+    ws->count = 1;
+    ws->needle_idx[0] = 0;
+
+    for (i = 0; i < haystack_len; i++) {
 
-            // Check if `haystack[i]` has been matched before by matchers[j].
-            // If this is the case we crate a fork of matcher[j].
+        // Create forks
+        int count = ws->count;
+        for (j = 0; j < count; j++) {
 
             int idx = -1;
-            for (k = 0; k < PyList_Size(consumed); k++) {
-                c = PyUnicode_AsUnicode(PyList_GetItem(consumed, k))[0]; // XXX
-                /*assert(PyUnicode_Check(c));*/
-                if (Py_UNICODE_TOLOWER(haystack[i]) == c) {
+            for (k = 0; k < ws->needle_idx[j]; k++) {
+                if (lower[i] == Py_UNICODE_TOLOWER(needle[k])) {
                     idx = k;
                     break;
                 }
             }
 
-            if (idx >= 0) {
-                PyObject *slice = PySequence_GetSlice(needle_obj, idx, needle_len);  // new ref
-                /*assert(PySequence_Check(slice));*/
-                // The slice contains all characters that remains to be matched
-                // by this possible fork in `haystack`. If there is room for
-                // this remaining characters to be matched in `haystack` then
-                // we create a fork, otherwise there is no need to since the
-                // match won't certainly succeed.
-                if (PySequence_Length(slice) <= haystack_len - i) {
-                    // create a new fork
-                    fork = PyDict_New();  // new ref
-                    PyDict_SetItemString(fork, "needle_idx", Py_BuildValue("i", idx));
-                    PyDict_SetItemString(fork, "consumed", PySequence_GetSlice(consumed, 0, idx));
-                    PyDict_SetItemString(fork, "boundaries", PySequence_GetSlice(boundaries, 0, idx));
-                    PyDict_SetItemString(fork, "positions", PySequence_GetSlice(positions, 0, idx));
-                    // append the new fork to matchers pool
-                    PyList_Append(matchers, fork);  // PyList_Append increment the ref counter
-                    Py_DECREF(fork);
-                }
-                Py_DECREF(slice);
+            // There is no need to fork if the remaining characters of
+            // `needle` can't be matched in `haystack` anyway
+            if (idx >= 0 && needle_len - idx <= haystack_len - i &&
+                    ws->count < MAX_MATCHERS) {
+                if (_workspace_reserve(ws, ws->count + 1, needle_len) < 0)
+                    return -1;
+                int f = ws->count++;
+                ws->needle_idx[f] = idx;
+                memcpy(ws->positions + f * needle_len,
+                       ws->positions + j * needle_len, idx * sizeof(int));
+                memcpy(ws->boundaries + f * needle_len,
+                       ws->boundaries + j * needle_len, idx);
             }
         }
 
         // Update each matcher
+        for (j = 0; j < ws->count; j++) {
 
-        /*assert(PyList_Check(matchers));*/
-        for (j = 0; j < PyList_Size(matchers); j++) {
-
-            matcher = PyList_GetItem(matchers, j);  // borrowed ref
-            /*assert(PyDict_Check(matcher));*/
-            consumed = PyDict_GetItemString(matcher, "consumed");
-            /*assert(PyList_Check(consumed));*/
-            positions = PyDict_GetItemString(matcher, "positions");
-            /*assert(PyList_Check(positions));*/
-            boundaries = PyDict_GetItemString(matcher, "boundaries");
-            /*assert(PyList_Check(boundaries));*/
-            needle_idx = PyLong_AsLong(PyDict_GetItemString(matcher, "needle_idx"));
-
+            int needle_idx = ws->needle_idx[j];
             if (needle_idx == needle_len)
                 continue;
 
+            int cond;
             if (smart_case && Py_UNICODE_ISUPPER(needle[needle_idx]))
                 cond = haystack[i] == needle[needle_idx];
             else
-                cond = Py_UNICODE_TOLOWER(haystack[i]) == Py_UNICODE_TOLOWER(needle[needle_idx]);
-
-            if (cond) {
-
-                prev = haystack[i-1];
-                cond1 = uppercase_is_word_boundary && Py_UNICODE_ISUPPER(prev);
-                cond2 = 0;
-                if (i > 0)
-                    cond2 = prev == (Py_UNICODE)('_') || prev == (Py_UNICODE)('-') || Py_UNICODE_ISSPACE(prev);
-
-                if (i == 0 || cond1 || cond2) {
-                    pos = Py_BuildValue("i", 1);  // new ref
-                    PyList_Append(boundaries, pos);
-                } else {
-                    pos = Py_BuildValue("i", 0);  // new ref
-                    PyList_Append(boundaries, pos);
-                }
-                Py_DECREF(pos);
-
-                pos = Py_BuildValue("i", i);  // new ref
-                PyList_Append(positions, pos);
-                Py_DECREF(pos);
-
-                ch = PyUnicode_FromString(" ");  // new ref
-                _ch = PyUnicode_AS_UNICODE(ch);
-                _ch[0] = Py_UNICODE_TOLOWER(needle[needle_idx]);
-                PyList_Append(consumed, ch);
-                Py_DECREF(ch);
-
-                needle_idx++;
-                PyDict_SetItemString(matcher, "needle_idx", Py_BuildValue("i", needle_idx));
-
-                if (needle_idx == needle_len) {
-                    int boundaries_count = 0;
-                    for (k = 0; k < PyList_Size(boundaries); k++) {
-                        if (PyLong_AsLong(PyList_GetItem(boundaries, k)))
-                            boundaries_count++;
-                    }
-                    float s = _similarity(haystack_len, positions, boundaries_count);
-                    if (best_similarity < 0 || s < best_similarity) {
-                        best_similarity = s;
-                        Py_DECREF(best_positions);
-                        best_positions = PySequence_Tuple(positions);
-                    }
+                cond = lower[i] == Py_UNICODE_TOLOWER(needle[needle_idx]);
+
+            if (!cond)
+                continue;
+
+            ws->boundaries[j * needle_len + needle_idx] = mask[i] ? 1 : 0;
+            ws->positions[j * needle_len + needle_idx] = i;
+            ws->needle_idx[j] = ++needle_idx;
+
+            if (needle_idx == needle_len) {
+                int boundaries_count = 0;
+                for (k = 0; k < needle_len; k++)
+                    boundaries_count += ws->boundaries[j * needle_len + k];
+                float s = _similarity_of(ws->positions + j * needle_len,
+                    needle_len, boundaries_count);
+                // NOTE: similarity values can be negative
+                if (!found || s < *best_similarity) {
+                    found = 1;
+                    *best_similarity = s;
+                    memcpy(best_positions, ws->positions + j * needle_len,
+                           needle_len * sizeof(int));
                 }
             }
         }
     }
 
-    Py_DECREF(needle_obj);
-    Py_DECREF(matchers);
-    return Py_BuildValue("(f,N)", best_similarity, best_positions);
+    return found;
 }
 
 
-float
-_similarity(int haystack_len, PyObject *positions, int boundaries_count)
+int
+_is_subsequence(const Py_UNICODE *needle, int needle_len,
+                const Py_UNICODE *haystack, const Py_UNICODE *lower,
+                int haystack_len, int smart_case)
+{
+    // `_match` finds a match if and only if this greedy scan succeeds
+    int i, n = 0;
+    for (i = 0; i < haystack_len && n < needle_len; i++) {
+        if (smart_case && Py_UNICODE_ISUPPER(needle[n])) {
+            if (haystack[i] == needle[n])
+                n++;
+        } else if (lower[i] == Py_UNICODE_TOLOWER(needle[n])) {
+            n++;
+        }
+    }
+    return n == needle_len;
+}
+
+
+int
+_workspace_reserve(workspace_t *ws, int matchers, int needle_len)
+{
+    if (matchers <= ws->capacity && needle_len <= ws->needle_len)
+        return 0;
+    int capacity = ws->capacity > 0 ? ws->capacity : 16;
+    while (capacity < matchers)
+        capacity *= 2;
+    if (needle_len > ws->needle_len) {
+        // slots are laid out according to the needle length
+        ws->count = 0;
+        ws->needle_len = needle_len;
+    }
+    int *needle_idx = realloc(ws->needle_idx, capacity * sizeof(int));
+    if (needle_idx == NULL)
+        return -1;
+    ws->needle_idx = needle_idx;
+    int *positions = realloc(ws->positions, capacity * ws->needle_len * sizeof(int));
+    if (positions == NULL)
+        return -1;
+    ws->positions = positions;
+    char *boundaries = realloc(ws->boundaries, capacity * ws->needle_len);
+    if (boundaries == NULL)
+        return -1;
+    ws->boundaries = boundaries;
+    ws->capacity = capacity;
+    return 0;
+}
+
+
+void
+_workspace_free(workspace_t *ws)
 {
-    /*assert(PyList_Check(positions));*/
+    free(ws->needle_idx);
+    free(ws->positions);
+    free(ws->boundaries);
+    ws->needle_idx = ws->positions = NULL;
+    ws->boundaries = NULL;
+    ws->capacity = ws->count = ws->needle_len = 0;
+}
+
 
-    Py_ssize_t positions_len = PyList_Size(positions);
+float
+_similarity_of(const int *positions, int positions_len, int boundaries_count)
+{
     if (positions_len == 0)
         return -1;
 
@@ -220,43 +488,132 @@ _similarity(int haystack_len, PyObject *positions, int boundaries_count)
     int i, j;
     for (i = 0; i < positions_len; i++) {
 
-        x1 = PyFloat_AsDouble(PyList_GetItem(positions, i));
+        x1 = positions[i];
 
         positions_sum += x1;
 
         if (i > 0) {
-            prev = PyFloat_AsDouble(PyList_GetItem(positions, i-1));
+            prev = positions[i-1];
             if (prev != x1 - 1)
                 contiguous_sets++;
         }
 
         for (j = i; j < positions_len; j++) {
             if (j != i) {
-                x2 = PyFloat_AsDouble(PyList_GetItem(positions, j));
+                x2 = positions[j];
                 diffs_sum += abs(x1-x2);
                 n += 1;
             }
         }
     }
 
-    float gravity = positions_sum/positions_len;
+    float gravity = (float)positions_sum/positions_len;
     float compactness = .0;
     if (n > 0)
         compactness = diffs_sum/n;
 
-    return gravity + compactness + contiguous_sets - boundaries_count*2.0;
+    return gravity + compactness + contiguous_sets - boundaries_count*1.5;
+}
+
+
+int
+_is_boundary(const Py_UNICODE *haystack, int i, int uppercase_is_word_boundary)
+{
+    if (i == 0)
+        return 1;
+    // If `haystack` has only uppercase characters then it makes no sense
+    // to treat an uppercase letter as a word-boundary character
+    if (uppercase_is_word_boundary && Py_UNICODE_ISUPPER(haystack[i]))
+        return 1;
+    return haystack[i-1] == (Py_UNICODE)('_') || haystack[i-1] == (Py_UNICODE)('-');
 }
 
 
 int
 _isupper(const Py_UNICODE *c, int len)
 {
-    int i;
+    // Same as `unicode.isupper`: there must be at least one uppercase
+    // character and no lowercase ones
+    int i, upper = 0;
     for (i = 0; i < len; i++) {
         if (Py_UNICODE_ISLOWER(c[i]))
             return 0;
+        if (Py_UNICODE_ISUPPER(c[i]) || Py_UNICODE_ISTITLE(c[i]))
+            upper = 1;
+    }
+    return upper;
+}
+
+
+/* ============================= MAPPED INDEX ============================== */
+
+
+unsigned int
+_read_u32(const char *p)
+{
+    const unsigned char *b = (const unsigned char *)p;
+    return b[0] | (b[1] << 8) | (b[2] << 16) | ((unsigned int)b[3] << 24);
+}
+
+
+unsigned int
+_read_u16(const char *p)
+{
+    const unsigned char *b = (const unsigned char *)p;
+    return b[0] | (b[1] << 8);
+}
+
+
+int
+_decode_utf8(const char *s, int len, Py_UNICODE *out, int out_len)
+{
+    // Returns the number of characters written to `out`, or -1 if `s` is
+    // not valid UTF-8 or doesn't fit in `out`. As with Python, characters
+    // outside the BMP are stored as surrogate pairs on narrow builds.
+    const unsigned char *b = (const unsigned char *)s;
+    int i = 0, n = 0;
+    while (i < len) {
+        unsigned long cp;
+        int extra;
+        if (b[i] < 0x80) {
+            cp = b[i];
+            extra = 0;
+        } else if ((b[i] & 0xE0) == 0xC0) {
+            cp = b[i] & 0x1F;
+            extra = 1;
+        } else if ((b[i] & 0xF0) == 0xE0) {
+            cp = b[i] & 0x0F;
+            extra = 2;
+        } else if ((b[i] & 0xF8) == 0xF0) {
+            cp = b[i] & 0x07;
+            extra = 3;
+        } else {
+            return -1;
+        }
+        if (extra > 0 && i + extra >= len)
+            return -1;
+        int e;
+        for (e = 1; e <= extra; e++) {
+            if ((b[i+e] & 0xC0) != 0x80)
+                return -1;
+            cp = (cp << 6) | (b[i+e] & 0x3F);
+        }
+        i += extra + 1;
+#ifndef Py_UNICODE_WIDE
+        if (cp > 0xFFFF) {
+            if (n + 2 > out_len)
+                return -1;
+            cp -= 0x10000;
+            out[n++] = (Py_UNICODE)(0xD800 + (cp >> 10));
+            out[n++] = (Py_UNICODE)(0xDC00 + (cp & 0x3FF));
+            continue;
+        }
+#endif
+        if (n + 1 > out_len)
+            return -1;
+        out[n++] = (Py_UNICODE)cp;
     }
-    return 1;
+    return n;
 }
 
 
@@ -265,6 +622,8 @@ _isupper(const Py_UNICODE *c, int len)
 
 static PyMethodDef searchmethods[] = {
     {"match", py_match, METH_VARARGS, py_match_doc},
+    {"prepare", py_prepare, METH_VARARGS, py_prepare_doc},
+    {"search_mapped", py_search_mapped, METH_VARARGS, py_search_mapped_doc},
     {NULL, NULL, 0, NULL}
 };
 
@@ -3,11 +3,59 @@
 
 #include <Python.h>
 #include <ctype.h>
+#include <stdlib.h>
+#include <string.h>
 
 
+// Layout of the index files written by `surfer.mapped`
+#define MAPPED_MAGIC "SRFIDX\0\0"
+#define MAPPED_VERSION 4
+#define MAPPED_HEADER_SIZE 44
+#define MAPPED_TAG_SIZE 24
+
+// Upper limit to the number of partial matches tracked at once, which can
+// grow exponentially for needles and haystacks with many repeated characters
+#define MAX_MATCHERS 65536
+
+
+// Memory reused across calls to `_match`
+typedef struct {
+    int capacity;
+    int count;
+    int needle_len;
+    int *needle_idx;
+    int *positions;
+    char *boundaries;
+} workspace_t;
+
+typedef struct {
+    float similarity;
+    int id;
+    int positions;
+} result_t;
+
+
+int _match(workspace_t *, const Py_UNICODE *, int, const Py_UNICODE *,
+           const Py_UNICODE *, const char *, int, int, int *, float *);
+
+int _is_subsequence(const Py_UNICODE *, int, const Py_UNICODE *,
+                    const Py_UNICODE *, int, int);
+
+int _workspace_reserve(workspace_t *, int, int);
+
+void _workspace_free(workspace_t *);
+
+float _similarity_of(const int *, int, int);
+
 int _isupper(const Py_UNICODE *c, int);
 
-float _similarity(int, PyObject*, int);
+int _is_boundary(const Py_UNICODE *, int, int);
+
+unsigned int _read_u32(const char *);
+
+unsigned int _read_u16(const char *);
+
+int _decode_utf8(const char *, int, Py_UNICODE *, int);
 
 
 #endif
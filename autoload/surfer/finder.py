@@ -7,60 +7,232 @@ This module defines the TagsFinder class. This class is responsible for
 searching tags.
 """
 
-from operator import itemgetter
+import os
 
+from surfer.utils import v
 from surfer.utils import settings
-
-try:
-    from surfer.ext.search import match
-    SURFER_SEARCH_EXT_LOADED = True
-except ImportError:
-    from surfer.search.search import match
-    SURFER_SEARCH_EXT_LOADED = False
+from surfer.utils.profiler import timed
+from surfer.utils.memprof import measured
+from surfer.search.ranking import rank, rank_within, result_key
+from surfer.index import filter_tags
 
 
 class TagsFinder:
 
+    # number of tags matched between two consecutive checks for
+    # interruptions and for the search time budget
+    chunk_size = 2000
+
     def __init__(self, plug, generator):
         self.plug = plug
         self.generator = generator
+        # whether the results of the last search have been cut short by
+        # `g:surfer_search_time_budget`, and the budget of the current one
+        self.partial = False
+        self.budget = 0
 
-    def find_tags(self, query, max_results=-1, curr_buf=""):
-        """To find all matching tags for the given `query`."""
+    def find_tags(self, query, max_results=-1, curr_buf="", interrupt=None,
+                  complete=False):
+        """To find all matching tags for the given `query`.
+
+        `interrupt` is an optional function called between chunks of tags.
+        When it returns True the search is abandoned and the exception
+        `SearchInterrupted` is raised. When `complete` is set, the search
+        is never cut short by `g:surfer_search_time_budget`. Otherwise
+        `partial` tells afterwards whether it has been.
+        """
+        self.partial = False
+        self.budget = 0 if complete else settings.get("search_time_budget",
+                                                      int)
         modifier, query = self._split_query(query.strip())
+        query, kinds, paths = self._split_filters(query)
+        if modifier == settings.get("directory_search_modifier"):
+            modifier, paths = self._directory_scope(curr_buf, paths)
+            if paths is None:
+                return []
         if query:
+            results = self._find_remote(modifier, query, max_results, curr_buf,
+                kinds, paths, interrupt)
+            if results is None:
+                results = self._find_mapped(modifier, query, max_results,
+                    curr_buf, kinds, paths)
+            if results is not None:
+                return results
             tags = self.generator.get_tags(modifier, curr_buf)
-            return self._find(query, tags, max_results)
+            return self._find_cached(query, tags, max_results, kinds, paths,
+                interrupt)
         return []
 
-    def _find(self, query, tags, max_results):
-        """To find all matching tags for the given `query`."""
-        matches = []
+    def _find_cached(self, query, tags, max_results, kinds=(), paths=(),
+                     interrupt=None):
+        """To find all matching tags for the given `query` among `tags`, the
+        tags kept in memory by the generator (see `find_tags`)."""
+        index = self.generator.index
+        with timed("candidates"):
+            # tags whose name starts with the query come first: when
+            # there are enough of them, other tags are not even scored
+            candidates = index.prefixed(query,
+                settings.get("smart_case", int), kinds, paths)
+            if not 0 <= max_results <= len(candidates):
+                candidates = index.candidates(query, kinds, paths)
+                if candidates is None:
+                    candidates = filter_tags(
+                        index.scoped(paths) if paths else tags, kinds, ())
+        results = self._find(query, candidates, max_results, interrupt)
+        if self.generator.spill:
+            # tags evicted from memory, see `TagsGenerator._enforce_budget`
+            spilled = self.generator.spill.search(query, max_results,
+                settings.get("smart_case", int), kinds, paths)
+            results = self._merge(results, spilled, max_results)
+        self.generator.touch(set(r["file"] for r in results))
+        return results
+
+    @measured("find")
+    def _find(self, query, tags, max_results, interrupt=None):
+        """To find all matching tags for the given `query`.
+
+        Tags are scanned in chunks. If the search takes longer than
+        `g:surfer_search_time_budget` milliseconds, only the tags scanned so
+        far are taken into account and the results are marked as partial.
+        """
+        results, partial = rank_within(query, tags, max_results,
+            settings.get("smart_case", int), self.budget, interrupt,
+            self.chunk_size)
+        self.partial = self.partial or partial
+        return results
+
+    def _find_remote(self, modifier, query, max_results, curr_buf, kinds=(),
+                     paths=(), interrupt=None):
+        """To find all matching tags for the given `query` with the tags
+        daemon (see `surfer.daemon`).
+
+        Only project searches are sent to the daemon. None is returned when
+        the search must be performed locally, as when the daemon doesn't
+        answer in time: the search then goes through the index file or the
+        tags of the project, never through tags of another scope.
+        """
+        if modifier != settings.get("project_search_modifier"):
+            return
         smart_case = settings.get("smart_case", int)
+        for attempt in range(2):
+            root = self.generator.sync_daemon(modifier, curr_buf)
+            if root is None:
+                return
+            with timed("daemon"):
+                response = self.plug.daemon.query(root, query, max_results,
+                    smart_case, self.budget, kinds, paths, interrupt)
+            if response is None:
+                self.generator.detach_daemon()
+                return
+            if response["indexed"]:
+                self.partial = response.get("partial", False)
+                return response["results"]
+            # The daemon has been restarted in the meantime: tags need to be
+            # uploaded again
+            self.generator.remote_root = None
 
-        for tag in tags:
-            similarity, positions = match(query, tag["name"], smart_case)
-            if positions:
-                matches.append({
-                    "match_positions": positions,
-                    "similarity": similarity,
-                    "name": tag["name"],
-                    "file": tag["file"],
-                    "cmd": tag["cmd"],
-                    "exts": tag["exts"]
-                })
+    def _find_mapped(self, modifier, query, max_results, curr_buf, kinds=(),
+                     paths=()):
+        """To find all matching tags for the given `query` with the
+        memory-mapped index of the project (see `surfer.mapped`).
 
-        l = len(matches)
-        if max_results < 0 or max_results > l:
-            max_results = l
+        Tags of files changed since the index file has been written are
+        searched separately and merged with the results. None is returned
+        when the search must be performed on the tags cache.
+        """
+        if modifier != settings.get("project_search_modifier"):
+            return
+        mapped = self.generator.get_mapped(modifier, curr_buf)
+        if mapped is None:
+            return
+        index, overlay = mapped
+        smart_case = settings.get("smart_case", int)
+        results = index.search(query, max_results, smart_case, overlay, kinds,
+                               paths)
+        tags = [tag for file_tags in overlay.values() for tag in file_tags]
+        tags = filter_tags(tags, kinds, paths)
+        if tags:
+            results = self._merge(results,
+                rank(query, tags, max_results, smart_case), max_results)
+        return results
 
-        return sorted(matches, key=itemgetter("similarity"))[:max_results]
+    def _merge(self, results, other_results, max_results):
+        """To merge two lists of results sorted by similarity (see
+        `surfer.search.ranking.result_key`). Results that compare equal keep
+        their order, with `results` first."""
+        results = sorted(results + other_results, key=result_key)
+        if max_results >= 0:
+            results = results[:max_results]
+        return results
 
     def _split_query(self, query):
         """To extract the search modifier from the query. The clean query is
         also returned."""
-        bmod = settings.get("buffer_search_modifier")
-        pmod = settings.get("project_search_modifier")
-        if query and query[0] in (pmod, bmod):
+        mods = settings.get_many("buffer_search_modifier",
+            "project_search_modifier", "workspace_search_modifier",
+            "directory_search_modifier")
+        bmod = mods["buffer_search_modifier"]
+        pmod = mods["project_search_modifier"]
+        wmod = mods["workspace_search_modifier"]
+        dmod = mods["directory_search_modifier"]
+        if query and query[0] in (pmod, bmod, wmod, dmod):
             return query[0], query[1:]
         return u"", query
+
+    def _directory_scope(self, curr_buf, paths):
+        """To return the search modifier and the path prefixes that restrict
+        a search to the directory of the current buffer, or to one of its
+        parents up to `g:surfer_directory_search_depth` levels above it.
+
+        Tags of the directory are searched among the tags of the whole
+        project (or of the open buffers, when there is no project), only
+        the tags below the directory are looked at. `paths` are the path
+        filters of the query: only those within the directory are kept.
+        None is returned in place of the path prefixes when no file can
+        match.
+        """
+        opts = settings.get_many("project_search_modifier",
+            "directory_search_depth", directory_search_depth=int)
+        root = self.plug.project.get_root()
+        directory = os.path.dirname(curr_buf) if curr_buf else v.cwd()
+        for _ in range(opts["directory_search_depth"]):
+            if directory == root or os.path.dirname(directory) == directory:
+                break
+            directory = os.path.dirname(directory)
+        scope = os.path.join(directory, u"")
+        modifier = opts["project_search_modifier"] if root else u""
+        if not paths:
+            return modifier, [scope]
+        inside = [p for p in paths if p.startswith(scope)]
+        if any(scope.startswith(p) for p in paths):
+            inside = [scope]
+        return modifier, inside or None
+
+    def _split_filters(self, query):
+        """To extract the kind and path filters from the query.
+
+        Filters are words of the query starting with
+        `g:surfer_kind_filter_prefix` or `g:surfer_path_filter_prefix`.
+        A kind filter matches all kinds it's a prefix of (case-insensitive),
+        a path filter all files below the given path, relative to the
+        project root. For example, with the default prefixes, the query
+
+            get :func :meth /src/ui
+
+        searches `get` among functions and methods of files in the `src/ui*`
+        directories. Filters of the same type are alternatives. The clean
+        query and the lists of kind filters and path prefixes are returned.
+        """
+        opts = settings.get_many("kind_filter_prefix", "path_filter_prefix")
+        kprefix = opts["kind_filter_prefix"]
+        pprefix = opts["path_filter_prefix"]
+        words, kinds, paths = [], [], []
+        for word in query.split():
+            if kprefix and word.startswith(kprefix):
+                kinds.append(word[len(kprefix):].lower())
+            elif pprefix and word.startswith(pprefix):
+                root = self.plug.project.get_root() or v.cwd()
+                paths.append(os.path.join(root, word[len(pprefix):]))
+            else:
+                words.append(word)
+        return u" ".join(words), kinds, paths
@@ -8,82 +8,802 @@ generating tags.
 """
 
 import os
+import re
+import json
+import time
 import shlex
+import shutil
+import hashlib
 import tempfile
 import subprocess
 from fnmatch import fnmatch
-from itertools import imap, ifilter
+from itertools import imap
 from collections import defaultdict
 from os.path import splitext, exists
 
 from surfer.utils import v
 from surfer.utils import misc
 from surfer.utils import settings
+from surfer.utils.profiler import timed
+from surfer.utils.memprof import measured
+from surfer.index import TagIndex, tag_memory
+from surfer.spill import TagSpill
+from surfer.tagcache import TagCache
+from surfer.coprocess import CtagsCoprocess
+from surfer import mapped
 from surfer import exceptions as ex
 
 
 class TagsGenerator:
 
+    # Placeholders of `g:surfer_line_format` whose values are always
+    # available, see `_universal_args`
+    base_placeholders = set(["name", "cmd", "file", "line", "kind", "language"])
+
+    # Share of `g:surfer_memory_budget` the tags in memory can take, the rest
+    # is left to their index (see `_enforce_budget`)
+    tags_share = 0.8
+
     def __init__(self, plug):
         self.plug = plug
+        # all the tags in memory, rebuilt from `file_tags` when they change
+        # (see `all_tags`)
         self.tags_cache = []
+        # {file: tags} for the files whose tags are in memory
+        self.file_tags = {}
+        self.tags_changed = False
+        self.index = TagIndex(background=True)
         self.rebuild_tags = True
+        # tagfiles written for the tags in `tags_cache` (see
+        # `_generate_tagfile`)
         self.old_tagfiles = []
+        self.ctags_info = {}
+        self.coprocess = None
+        # files whose tags are in `tags_cache`
+        self.cached_files = set()
+        # buffers whose content changed since their tags have been generated
+        self.dirty_buffers = set()
+        # {buffer: tagfiles} for the buffers tagged from their content
+        self.buffer_tagfiles = {}
+        self.scratch_dir = None
+        # tagfile for jumping to tags that are in no other tagfile, see
+        # `write_jump_tagfile`
+        self.jump_tagfile = None
+        self.tag_cache = None
+        # tags evicted from `tags_cache` (see `_enforce_budget`)
+        self.spill = TagSpill()
+        # {file: estimated memory taken by its tags in `tags_cache`}
+        self.file_memory = {}
+        self.tags_memory = 0
+        # {file: last time the file has been opened or matched}
+        self.last_used = {}
+        # {root: ({file: modification time}, tags)} for each project of the
+        # workspace (see `_workspace_tags`)
+        self.segments = {}
+        # whether `tags_cache` holds the tags of the whole workspace
+        self.workspace_cached = False
+        # project whose tags are kept by the tags daemon (see `sync_daemon`)
+        self.remote_root = None
+        self.remote_files = set()
+        # {file: modification time} for the files whose tags have been
+        # uploaded, so that files changed outside of vim are sent again
+        self.remote_mtimes = {}
+        # tagfiles written for the tags uploaded to the daemon
+        self.remote_tagfiles = []
+        self.resync_daemon = False
+        # memory-mapped index of the current project (see `get_mapped`)
+        self.mapped = None
+        self.mapped_root = None
+        self.mapped_files = set()
+        # {file: tags} for the project files whose tags in the index file
+        # are out of date
+        self.overlay = {}
+        # tagfiles written for the tags generated when the index file has
+        # been opened (see `_load_mapped`)
+        self.mapped_tagfiles = []
+        self.resync_mapped = False
 
     def close(self):
         """To perform cleanup actions."""
-        self._remove_tagfiles()
+        self._remove_tagfiles(self.tagfiles())
+        if self.jump_tagfile:
+            self._remove_tagfile(self.jump_tagfile)
+            self.jump_tagfile = None
+        self.spill.clear()
+        if self.mapped is not None:
+            self.mapped.close()
+        if self.coprocess:
+            self.coprocess.stop()
+        if self.scratch_dir:
+            shutil.rmtree(self.scratch_dir, ignore_errors=True)
+        if self.tag_cache is not None:
+            self.tag_cache.save()
+
+    def invalidate(self):
+        """To make sure the tags for the search scope are checked again on
+        the next search, wherever they are kept: in memory, in the index
+        file or in the tags daemon. Called when the search scope or the set
+        of files changes."""
+        self.rebuild_tags = True
+        self.resync_daemon = True
+        self.resync_mapped = True
 
     def get_tags(self, modifier, curr_bufname):
         """To return tags according to the current search scope."""
         if self.rebuild_tags:
-            files = self._files(modifier, curr_bufname)
-            self.tags_cache = self._build_tags(files)
+            workspace = modifier == settings.get("workspace_search_modifier")
+            if workspace:
+                tags, files, changed = self._workspace_tags()
+            else:
+                files = self._files(modifier, curr_bufname)
+                self._reset_tagfiles()
+                tags, self.old_tagfiles = self._build_tags(files)
+                changed = True
+            # nothing to do when the workspace is searched again and none
+            # of its files changed
+            if changed or not self.workspace_cached:
+                self._set_tags(tags, files)
+            self.workspace_cached = workspace
             self.rebuild_tags = False
+        self._retag_buffers()
+        return self.all_tags()
+
+    def all_tags(self):
+        """To return all the tags in memory as a single list. The list is
+        built again only when the tags of some file have been replaced."""
+        if self.tags_changed:
+            self.tags_cache = [t for tags in self.file_tags.itervalues()
+                               for t in tags]
+            self.tags_changed = False
         return self.tags_cache
 
+    def _set_tags(self, tags, files):
+        """To replace the tags cache with `tags`, the tags for `files`."""
+        # tags in the spill that are not read back are generated again the
+        # next time the workspace is searched
+        for mtimes, segment in self.segments.values():
+            for file in [f for f in mtimes if f in self.spill]:
+                del mtimes[file]
+        self.spill.clear()
+        self.tags_cache = tags
+        self.tags_changed = False
+        self.cached_files = set(files)
+        self.file_tags = defaultdict(list)
+        self.file_memory = defaultdict(int)
+        for tag in self.tags_cache:
+            self.file_tags[tag["file"]].append(tag)
+            self.file_memory[tag["file"]] += tag_memory(tag)
+        self.file_tags = dict(self.file_tags)
+        self.file_memory = dict(self.file_memory)
+        self.tags_memory = sum(self.file_memory.itervalues())
+        self.plug.project.set_tagged_files(self.cached_files)
+        # tags for files loaded in modified buffers must reflect what
+        # the user sees, not what is on disk
+        self.dirty_buffers = set(v.modified_buffers()) & self.cached_files
+        # tags evicted to keep within the memory budget are not indexed
+        self.index.clear()
+        self._enforce_budget()
+        self.index.build(self.all_tags())
+
+    def _workspace_tags(self):
+        """To return the tags for all the projects in the workspace (see
+        `surfer.project.Project.workspace_roots`).
+
+        Tags of each project are kept between searches in a segment of their
+        own, and only the tags of files added or modified since the last
+        search are generated again. Tags evicted from memory are not in the
+        segments but in the spill, and are read back from there when the
+        tags cache is replaced. Returns a tuple (tags, files, changed) where
+        `changed` tells whether any segment has been updated.
+        """
+        project = self.plug.project
+        tags, files = [], []
+        segments = {}
+        changed = False
+        rebuilt = set()
+        for root in project.workspace_roots():
+            # a file belongs to the first project it is found in, in case
+            # projects are nested
+            seen = set(files)
+            root_files = [f for f in self._exclude(project.get_files(root))
+                          if f not in seen]
+            mtimes = dict((f, self._mtime(f)) for f in root_files)
+            old_mtimes, segment = self.segments.get(root, (None, []))
+            stale = [f for f in root_files if old_mtimes is None or
+                     old_mtimes.get(f) != mtimes[f]]
+            if stale or old_mtimes is None or len(old_mtimes) != len(mtimes):
+                if not changed:
+                    self._reset_tagfiles()
+                changed = True
+                rebuilt.update(stale)
+                fresh = set(mtimes).difference(stale)
+                segment = [t for t in segment if t["file"] in fresh]
+                groups = self._group_files_by_filetype(stale)
+                for filetype, group in groups.items():
+                    group_tags, tagfiles = self._build_group(filetype, group)
+                    segment.extend(group_tags)
+                    self.old_tagfiles.extend(tagfiles)
+            segments[root] = (mtimes, segment)
+            files.extend(root_files)
+        changed |= set(segments) != set(self.segments)
+        if changed or not self.workspace_cached:
+            # the tags cache is about to be replaced (see `_set_tags`)
+            for root, (mtimes, segment) in segments.items():
+                spilled = [f for f in mtimes
+                           if f in self.spill and f not in rebuilt]
+                for file in spilled:
+                    file_tags = self.spill.load(file)
+                    self.spill.drop(file)
+                    if file_tags is None:
+                        file_tags, tagfiles = self._build_file_tags(file)
+                        self.old_tagfiles.extend(tagfiles)
+                    segment = segment + file_tags
+                segments[root] = (mtimes, segment)
+        for root in segments:
+            tags.extend(segments[root][1])
+        self.segments = segments
+        return tags, files, changed
+
+    def touch(self, files):
+        """To be notified that `files` have just been used, e.g. they have
+        some of the best matches for a search. Tags of the least recently
+        used files are the first to be evicted from memory."""
+        now = time.time()
+        for file in files:
+            self.last_used[file] = now
+
+    def buffer_entered(self, bufnr):
+        """To be notified that the buffer numbered `bufnr` has been entered.
+        Tags for the buffer file are loaded back in memory from the spill if
+        they have been evicted."""
+        bufname = v.bufname(bufnr)
+        if not bufname:
+            return
+        self.touch([bufname])
+        if bufname in self.spill and not self.rebuild_tags:
+            tags = self.spill.load(bufname)
+            if tags is None:
+                # lines for the file are still in the tagfiles of the tags
+                # cache
+                tags, tagfiles = self._build_file_tags(bufname)
+                self._remove_tagfiles(tagfiles)
+            self._replace_file_tags(bufname, tags)
+
+    def memory(self):
+        """To return a dictionary with the estimated memory, in bytes, taken
+        by the tags in memory and their index, and the number of tags and
+        the size of the spill on disk."""
+        spilled_tags, spill_size = self.spill.memory()
+        return {"tags": len(self.all_tags()),
+                "tags_memory": self.tags_memory,
+                "index_memory": self.index.memory(),
+                "spilled_files": len(self.spill),
+                "spilled_tags": spilled_tags,
+                "spill_size": spill_size}
+
+    def _enforce_budget(self):
+        """To keep the memory taken by the tags in memory and their index
+        within `g:surfer_memory_budget` megabytes.
+
+        Tags can take up to `tags_share` of the budget and the index what
+        is left (see `surfer.index.TagIndex`). When tags take more, tags of
+        the least recently used files (see `touch`) are moved to the spill
+        (see `surfer.spill`), until they take less than 80% of their share.
+        Files loaded in buffers are never evicted.
+        """
+        budget = settings.get("memory_budget", int) * 1048576
+        if budget <= 0:
+            self.index.budget = float("inf")
+            return
+        limit = budget * self.tags_share
+        used = self.tags_memory
+        if used > limit:
+            self._evict(limit * 0.8)
+        self.index.budget = budget - self.tags_memory
+
+    def _evict(self, target):
+        """To move tags of the least recently used files to the spill until
+        the tags in memory take less than `target` bytes."""
+        used = self.tags_memory
+        buffers = set(v.buffers())
+        candidates = sorted((f for f in self.file_memory if f not in buffers),
+                            key=lambda f: self.last_used.get(f, 0))
+        evicted = set()
+        for file in candidates:
+            if used <= target:
+                break
+            evicted.add(file)
+            used -= self.file_memory.pop(file)
+        self.tags_memory = used
+        self.spill.add([t for f in evicted for t in self.file_tags.pop(f, ())])
+        self.tags_changed = True
+        for file in evicted:
+            self.index.replace_file(file, [])
+        # workspace segments must not keep evicted tags in memory: they are
+        # read back from the spill when needed (see `_workspace_tags`)
+        for root, (mtimes, segment) in self.segments.items():
+            if evicted.intersection(mtimes):
+                segment = [t for t in segment if t["file"] not in evicted]
+                self.segments[root] = (mtimes, segment)
+
+    def sync_daemon(self, modifier, curr_bufname):
+        """To make sure the tags daemon has up-to-date tags for the current
+        project (see `surfer.daemon`).
+
+        If the daemon doesn't know the project yet, tags are generated here
+        and uploaded. Otherwise, only tags for files added to or removed from
+        the project, for files whose modification time changed, and for
+        modified buffers, are sent. Returns the project root, or None when
+        the daemon can't be used.
+
+        Tags kept locally for other search scopes are not affected, nor are
+        their tagfiles: tagfiles written for the uploaded tags are kept apart
+        in `remote_tagfiles`.
+        """
+        daemon = self.plug.daemon
+        root = self.plug.project.get_root()
+        if not root or not daemon.available():
+            self.detach_daemon()
+            return
+
+        if self.resync_daemon or root != self.remote_root:
+            status = daemon.status(root)
+            if status is None:
+                self.detach_daemon()
+                return
+            files = set(self._files(modifier, curr_bufname))
+            mtimes = dict((f, self._mtime(f)) for f in files)
+            if not status["indexed"] or root != self.remote_root:
+                self._remove_tagfiles(self.remote_tagfiles)
+                self.remote_tagfiles = []
+            if not status["indexed"]:
+                tags, self.remote_tagfiles = self._build_tags(files)
+                if daemon.put(root, tags) is None:
+                    self.detach_daemon()
+                    return
+            elif root == self.remote_root:
+                changed = [f for f in files
+                           if self.remote_mtimes.get(f) != mtimes[f]]
+                self._drop_tagfile_lines(self.remote_files.intersection(changed))
+                for file in changed:
+                    tags, tagfiles = self._build_file_tags(file)
+                    self.remote_tagfiles.extend(tagfiles)
+                    daemon.update(root, file, tags)
+                for file in self.remote_files - files:
+                    daemon.update(root, file, [])
+            self.remote_root = root
+            self.remote_files = files
+            self.remote_mtimes = mtimes
+            self.dirty_buffers |= set(v.modified_buffers()) & files
+            self.resync_daemon = False
+
+        self._retag_buffers()
+        return root
+
+    def detach_daemon(self):
+        """To stop relying on the tags daemon."""
+        self._remove_tagfiles(self.remote_tagfiles)
+        self.remote_tagfiles = []
+        if self.remote_root:
+            self.remote_root = None
+            self.remote_files = set()
+            self.remote_mtimes = {}
+            self.rebuild_tags = True
+
+    def get_mapped(self, modifier, curr_bufname):
+        """To return the memory-mapped index of the current project (see
+        `surfer.mapped`) along with the up-to-date tags of the files changed
+        since the index file has been written, as a dictionary {file: tags}.
+
+        The index file is written the first time a project is searched and
+        reused afterwards, even across Vim sessions. Returns None when the
+        index can't be used: it's disabled with `g:surfer_mapped_index` or
+        the C extension is not available.
+        """
+        if not settings.get("mapped_index", bool) or mapped.search_mapped is None:
+            return
+        root = self.plug.project.get_root()
+        if not root:
+            return
+        if self.resync_mapped or root != self.mapped_root:
+            self._load_mapped(root, modifier, curr_bufname)
+        self._retag_buffers()
+        return self.mapped, self.overlay
+
+    def _load_mapped(self, root, modifier, curr_bufname):
+        """To open the index file of the project `root`, writing it first
+        if needed.
+
+        Files changed, added or removed since the index file has been written
+        are detected through their modification time and tagged again. When
+        they are too many, a new index file is written. Tagfiles written for
+        these tags replace the ones written the previous time, while other
+        tagfiles are left alone.
+        """
+        digest = hashlib.sha1(root.encode("utf8")).hexdigest()
+        path = os.path.join(settings.get("cache_dir"), u"index", digest + u".idx")
+        files = self._files(modifier, curr_bufname)
+        mtimes = dict((f, self._mtime(f)) for f in files)
+
+        if self.mapped is not None:
+            self.mapped.close()
+            self.mapped = None
+        self._remove_tagfiles(self.mapped_tagfiles)
+        self.mapped_tagfiles = []
+        try:
+            index = mapped.MappedIndex(path)
+        except (IOError, ValueError):
+            index = None
+
+        overlay = {}
+        if index is not None:
+            overlay = dict((f, []) for f in index.files if f not in mtimes)
+            stale = [f for f in files if index.mtimes.get(f) != mtimes[f]]
+            if stale:
+                overlay.update(dict((f, []) for f in stale))
+                tags, self.mapped_tagfiles = self._build_tags(stale)
+                for tag in tags:
+                    overlay.setdefault(tag["file"], []).append(tag)
+
+        if index is None or len(overlay) > len(files) // 4:
+            if index is None:
+                tags, self.mapped_tagfiles = self._build_tags(files)
+            else:
+                tags = [t for t in imap(index.tag, xrange(len(index)))
+                        if t["file"] not in overlay]
+                for file_tags in overlay.values():
+                    tags.extend(file_tags)
+                index.close()
+            mapped.write(path, tags, mtimes)
+            index = mapped.MappedIndex(path)
+            overlay = {}
+
+        self.mapped = index
+        self.mapped_root = root
+        self.mapped_files = set(files)
+        self.overlay = overlay
+        self.dirty_buffers |= set(v.modified_buffers()) & self.mapped_files
+        self.resync_mapped = False
+
+    def _mtime(self, file):
+        """To return the modification time of `file`, or 0 if unknown."""
+        try:
+            return os.path.getmtime(file)
+        except OSError:
+            return 0
+
+    def buffer_written(self, bufnr):
+        """To be notified that the buffer numbered `bufnr` has been written.
+        Tags need to be rebuilt only if the file is not already known."""
+        bufname = v.bufname(bufnr)
+        if (bufname and bufname not in self.cached_files and
+                bufname not in self.remote_files and
+                bufname not in self.mapped_files):
+            self.invalidate()
+        else:
+            self.buffer_changed(bufnr, bufname)
+
+    def buffer_changed(self, bufnr, bufname=None):
+        """To be notified that the content of the buffer numbered `bufnr`
+        changed.
+
+        Tags for the buffer are generated again from its content the next
+        time tags are needed, without rebuilding tags for all the other
+        files. Nothing else is done here, so that editing is not slowed
+        down.
+        """
+        if not (self.cached_files or self.remote_files or self.mapped_files):
+            return
+        bufname = bufname or v.bufname(bufnr)
+        if bufname and self._tracked(bufname):
+            self.dirty_buffers.add(bufname)
+
+    def _retag_buffers(self):
+        """To update the tags cache with the current content of all the
+        buffers whose content changed.
+
+        Tags generated for a buffer are written to a tagfile of its own,
+        replaced every time the buffer is tagged again. Lines for the buffer
+        file are removed from all the other tagfiles, so that vim doesn't
+        find tags with outdated line numbers.
+        """
+        contents = {}
+        for bufname in list(self.dirty_buffers):
+            self.dirty_buffers.discard(bufname)
+            content = v.bufcontent(bufname)
+            if content is not None:
+                contents[bufname] = content
+        self._drop_tagfile_lines(
+            set(contents).difference(self.buffer_tagfiles))
+        for bufname, content in contents.items():
+            for tagfile in self.buffer_tagfiles.pop(bufname, ()):
+                self._remove_tagfile(tagfile)
+            tags, tagfiles = self._build_file_tags(bufname, content)
+            self.buffer_tagfiles[bufname] = tagfiles
+            self._replace_file_tags(bufname, tags)
+
+    def _tracked(self, file):
+        """To check whether tags for `file` are kept up-to-date, either
+        here or by the tags daemon."""
+        return ((file in self.cached_files and not self.rebuild_tags) or
+                (self.remote_root and file in self.remote_files) or
+                (self.mapped is not None and file in self.mapped_files))
+
+    def _replace_file_tags(self, file, tags):
+        """To replace in the tags cache all the tags for `file` with `tags`."""
+        if file in self.cached_files:
+            self.file_tags[file] = tags
+            self.tags_changed = True
+            self.index.replace_file(file, tags)
+            memory = sum(tag_memory(t) for t in tags)
+            self.tags_memory += memory - self.file_memory.get(file, 0)
+            self.file_memory[file] = memory
+            self.spill.drop(file)
+            self._enforce_budget()
+        if self.remote_root and file in self.remote_files:
+            self.plug.daemon.update(self.remote_root, file, tags)
+        if self.mapped is not None and file in self.mapped_files:
+            self.overlay[file] = tags
+
+    def _build_file_tags(self, file, content=None):
+        """To generate tags for a single file. When `content` (a byte string)
+        is given, it's used in place of the content of the file on disk.
+        Returns the same tuple as `_build_group`."""
+        filetype = self._group_files_by_filetype([file]).keys()[0]
+        return self._build_group(filetype, [file], content)
+
+    @measured("build_tags")
     def _build_tags(self, files):
         """To generate tags for the given `files`.
 
         If a filetype isn't supported by Exuberant Ctags, then use the custom
         ctags executable provided via the `surfer_custom_languages` option.
+        Returns the same tuple as `_build_group`: tagfiles written before
+        are left alone.
         """
-        self._remove_tagfiles()
-
-        tags = []
+        tags, tagfiles = [], []
         groups = self._group_files_by_filetype(files)
         for filetype, files in groups.items():
+            group_tags, group_tagfiles = self._build_group(filetype, files)
+            tags.extend(group_tags)
+            tagfiles.extend(group_tagfiles)
+
+        return tags, tagfiles
 
-            prg, args, kinds_map, exclude_kinds = self._filetype_data(filetype)
-            if not exists(prg):
-                raise ex.SurferException(
-                    "Error: The program '{}' does not exists or cannot be "
-                    "found in your $PATH".format(prg))
+    def _build_group(self, filetype, files, content=None):
+        """To generate tags for `files`, all of the same `filetype`.
 
+        When `content` is given, `files` must contain a single file and tags
+        are generated for `content` instead of the file content on disk.
+
+        Returns a tuple (tags, tagfiles) where `tagfiles` is the list of the
+        tagfiles written for the tags (see `_generate_tagfile`).
+        """
+        prg, args, kinds_map, exclude_kinds = self._filetype_data(filetype)
+        if not exists(prg):
+            raise ex.SurferException(
+                "Error: The program '{}' does not exists or cannot be "
+                "found in your $PATH".format(prg))
+
+        # With Universal Ctags, ask for JSON output with just the fields
+        # Surfer needs and let ctags itself skip the excluded kinds.
+        use_json = filetype == "*" and self._ctags_info(prg)["json"]
+        if use_json:
+            args = u"{} {}".format(args, self._universal_args(prg, exclude_kinds))
+
+        # Tags of file names (see the ctags option --extra) depend on the
+        # path of files, not only on their content.
+        cache = self._tag_cache()
+        if cache is None or "--extra" in args:
+            tags, tagfile = self._run_ctags(prg, args, kinds_map,
+                exclude_kinds, use_json, files, content)
+            return tags, [tagfile]
+
+        # Look up the tags for the content of each file, ctags runs only
+        # for the files whose content has never been seen. The language of
+        # a file depends on its extension.
+        params = json.dumps([prg, args, kinds_map, exclude_kinds])
+        tags, keys, missing, tagfiles = [], {}, [], []
+        with timed("cache"):
+            for file in files:
+                ext = splitext(file)[1].encode("utf-8")
+                file_params = "{}\0{}".format(params, ext)
+                if content is not None:
+                    key = cache.key(content, file_params)
+                else:
+                    key = cache.file_key(file, file_params)
+                if key is None:
+                    missing.append(file)
+                    continue
+                cached = cache.get(key, file)
+                if cached is None:
+                    keys[file] = key
+                    missing.append(file)
+                else:
+                    tags.extend(cached)
+            if len(missing) < len(files):
+                tagfiles.append(self._write_tagfile(tags))
+
+        if missing:
+            new_tags, tagfile = self._run_ctags(prg, args, kinds_map,
+                exclude_kinds, use_json, missing, content)
+            tagfiles.append(tagfile)
+            by_file = defaultdict(list)
+            for tag in new_tags:
+                by_file[tag["file"]].append(tag)
+            # tags are cached only when they can be told apart by file,
+            # otherwise a file could wrongly end up without tags
+            if set(by_file) <= set(missing):
+                for file, key in keys.items():
+                    cache.put(key, by_file.get(file, []))
+            tags.extend(new_tags)
+
+        if len(files) > 1:
+            cache.save()
+        return tags, tagfiles
+
+    def _run_ctags(self, prg, args, kinds_map, exclude_kinds, use_json, files,
+                   content=None):
+        """To run ctags on `files` and parse its output. See `_build_group`
+        for the meaning of the arguments. Returns the tags and the tagfile
+        written for them."""
+        # Tags for a single file are generated by a long-lived ctags
+        # process, when possible (see `surfer.coprocess` about MS Windows).
+        use_coprocess = (use_json and len(files) == 1 and os.name != 'nt' and
+            self._ctags_info(prg)["interactive"] and
+            settings.get("ctags_coprocess", bool))
+
+        if use_coprocess:
+            out, err = self._build_interactive(prg, args, files[0], content), ""
+        elif content is not None:
+            out, err = self._build_scratch(prg, args, files[0], content, use_json)
+        else:
             out, err = self._build(prg, args, files)
-            if err and "Warning" not in err:
-                raise ex.SurferException(
-                    "Error: '{}' failed to generate tags.\nCheck that it's an "
-                    "Exuberant Ctags compatible program or that the arguments "
-                    "provided are valid".format(prg))
+        if err and "Warning" not in err:
+            raise ex.SurferException(
+                "Error: '{}' failed to generate tags.\nCheck that it's an "
+                "Exuberant Ctags compatible program or that the arguments "
+                "provided are valid".format(prg))
 
-            fn = lambda tag: tag["exts"].get("kind") not in exclude_kinds
-            tags.extend(ifilter(fn, self._parse_ctags_output(out, kinds_map)))
+        with timed("parse"):
+            if use_json:
+                # tags generated for `content` are for `files[0]`, whatever
+                # the path ctags reports (see `_build_scratch`)
+                return self._parse_json_output(out,
+                    files[0] if content is not None else None)
+            else:
+                fn = lambda tag: tag["exts"].get("kind") not in exclude_kinds
+                tags, tagfile = self._parse_ctags_output(out, kinds_map)
+                return filter(fn, tags), tagfile
 
-        return tags
+    def _tag_cache(self):
+        """To return the cache of tags generated for the content of files
+        (see `surfer.tagcache`), or None when the cache is disabled."""
+        size = settings.get("tag_cache_size", int) * 1048576
+        if size <= 0:
+            return None
+        if self.tag_cache is None:
+            self.tag_cache = TagCache(
+                os.path.join(settings.get("cache_dir"), u"tags"), size)
+        self.tag_cache.max_size = size
+        return self.tag_cache
 
-    def _build(self, prg, args, files):
-        """To generate tags."""
+
+    def _ctags_info(self, prg):
+        """To return information about the ctags program `prg`.
+
+        Returns a dictionary with the following keys:
+
+            universal: whether `prg` is Universal Ctags
+            json: whether `prg` supports JSON output
+            interactive: whether `prg` supports the interactive mode
+            kinds: a list of tuples (language, long kind name)
+
+        Ctags is queried only the first time this function is called
+        for `prg`. The version of `g:surfer_ctags_prg` is known when the
+        plugin has located it (see `surfer#find_ctags_prg`), in which case
+        ctags doesn't even need to run for Exuberant Ctags.
+        """
+        if prg not in self.ctags_info:
+            info = {"universal": False, "json": False, "interactive": False,
+                    "kinds": []}
+            out = ""
+            if prg == settings.get("ctags_prg"):
+                out = v.decode(v.eval("g:_surfer_ctags_version"))
+            if not out:
+                out, _ = self._run(prg, u"--version", [])
+            if "Universal Ctags" in out:
+                info["universal"] = True
+                out, _ = self._run(prg, u"--list-features", [])
+                features = set(ln.split()[0] for ln in out.split("\n")
+                               if ln.strip() and not ln.startswith("#"))
+                info["json"] = "json" in features
+                info["interactive"] = "interactive" in features
+                out, _ = self._run(prg, u"--list-kinds-full", [])
+                for ln in out.split("\n"):
+                    cols = ln.split()
+                    if len(cols) > 2 and not ln.startswith("#"):
+                        info["kinds"].append((cols[0], cols[2]))
+            self.ctags_info[prg] = info
+        return self.ctags_info[prg]
+
+    def _universal_args(self, prg, exclude_kinds):
+        """To return the Universal Ctags arguments needed for generating
+        tags in JSON format.
+
+        Only the fields that Surfer displays are requested: scope, signature
+        and type fields are requested only if `g:surfer_line_format` has
+        placeholders other than the always available ones.
+        """
+        placeholders = set(re.findall(r"{(\w+)}",
+            u"".join(settings.get("line_format"))))
+        fields = u"nKl"
+        if placeholders - self.base_placeholders:
+            fields += u"sSt"
+        args = [u"--output-format=json", u"--fields={}".format(fields)]
+        for lang, kind in self._ctags_info(prg)["kinds"]:
+            if kind in exclude_kinds:
+                args.append(u"--kinds-{}=-{{{}}}".format(lang, kind))
+        return u" ".join(args)
+
+    @timed("ctags")
+    def _build_interactive(self, prg, args, file, content=None):
+        """To generate tags for a single file with the long-lived ctags
+        process. The process is (re)started when `prg` or `args` change.
+
+        When `content` is given, it's sent to ctags in place of the content
+        of `file`.
+        """
+        cmd = self._command(prg, u"{} --_interactive".format(args), [])
+        if self.coprocess is None or self.coprocess.cmd != cmd:
+            if self.coprocess:
+                self.coprocess.stop()
+            self.coprocess = CtagsCoprocess(cmd)
+        return self.coprocess.generate(file.encode("utf8"), content)
+
+    def _build_scratch(self, prg, args, file, content, use_json):
+        """To generate tags for `content` as if it were the content of
+        `file`. `content` is written to a scratch file that is reused across
+        calls (it keeps the name of `file` so that ctags can still detect
+        the language)."""
+        if not self.scratch_dir:
+            self.scratch_dir = tempfile.mkdtemp(prefix="surfer")
+        scratch = os.path.join(self.scratch_dir.decode("utf8"),
+                               os.path.basename(file))
+        with open(scratch, "wb") as f:
+            f.write(content)
+        out, err = self._build(prg, args, [scratch])
+        # make tags point to `file` rather than to the scratch file: in JSON
+        # output paths are fixed once parsed, since ctags may escape them
+        # differently than `json.dumps` (see `_parse_json_output`)
+        if not use_json:
+            out = out.replace(u"\t{}\t".format(scratch).encode("utf8"),
+                              u"\t{}\t".format(file).encode("utf8"))
+        return out, err
+
+    def _command(self, prg, args, files):
+        """To return the list of arguments needed to run `prg`."""
         files = imap(lambda f: u'"{}"'.format(f), files)
         cmd = u"{} {} {}".format(prg, args, u" ".join(files))
         cmd = cmd if os.name != 'nt' else cmd.replace(u"\\", u"\\\\")
+        return shlex.split(cmd.encode("utf8"))
+
+    @timed("ctags")
+    def _build(self, prg, args, files):
+        """To generate tags."""
+        return self._run(prg, args, files)
+
+    def _run(self, prg, args, files):
+        """To run `prg` and return its output and error output. Unlike
+        `_build`, the time taken is not reported as tag generation, e.g. for
+        querying ctags about its features."""
         startupinfo = None
         if os.name == 'nt':
             # On MS Windows hide the console window when launching a subprocess
             startupinfo = subprocess.STARTUPINFO()
             startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
         try:
-            ctags = subprocess.Popen(shlex.split(cmd.encode("utf8")), universal_newlines=True,
+            ctags = subprocess.Popen(self._command(prg, args, files), universal_newlines=True,
                     stdout=subprocess.PIPE, stderr=subprocess.PIPE,
                     startupinfo=startupinfo)
             return ctags.communicate()
@@ -97,18 +817,82 @@ class TagsGenerator:
         Why writing a copy of the output to a temporary file? We do this
         because the temporary file name is appendend to the `tags` vim
         option (set tags+=tempfile) so that the user can still use vim
-        commands for navigating tags (<C-T>, etc).
+        commands for navigating tags (<C-T>, etc). The tags are returned
+        along with the name of the tagfile.
         """
         tagfile = self._generate_tagfile()
         with tagfile:
+            tagfile.write(output if output.endswith("\n") else output + "\n")
+        return self._parse_tags(output, kinds_map), tagfile.name
+
+    def _parse_tags(self, output, kinds_map):
+        """To parse all the lines of the ctags output `output`.
+
+        The output is decoded as a whole rather than field by field: only
+        when it's not valid UTF-8 lines are decoded one at a time, so that
+        just the invalid ones are skipped.
+        """
+        kinds_map = dict((k.decode("utf-8"), val.decode("utf-8"))
+                         for k, val in kinds_map.iteritems())
+        parse = self._parse_tag_line
+        return [tag for tag in (parse(line, kinds_map)
+                                for line in self._decode_lines(output)) if tag]
+
+    def _decode_lines(self, output):
+        """To return the lines of the UTF-8 encoded `output`, decoded.
+        Lines that are not valid UTF-8 are left out."""
+        try:
+            return output.decode("utf-8").split(u"\n")
+        except UnicodeDecodeError:
+            lines = []
             for line in output.split("\n"):
-                tagfile.write(line + "\n")
-                tag = self._parse_tag_line(line, kinds_map)
-                if tag:
-                    yield tag
+                try:
+                    lines.append(line.decode("utf-8"))
+                except UnicodeDecodeError:
+                    pass
+            return lines
+
+    def _parse_json_output(self, output, file=None):
+        """To parse the JSON output of Universal Ctags.
+
+        Tags are built directly from the decoded JSON objects. As with
+        `_parse_ctags_output`, a copy of the tags is written to a temporary
+        tagfile in the classic format, so that vim can read it, and the tags
+        are returned along with the name of the tagfile. When `file` is
+        given, all tags are for `file` whatever path ctags reports.
+        """
+        tags = []
+        loads = json.loads
+        for line in self._decode_lines(output):
+            try:
+                raw = loads(line)
+            except ValueError:
+                continue
+            if raw.get("_type") != "tag":
+                continue
+            lnum = unicode(raw.get("line", u""))
+            exts = {"kind": raw.get("kind", u""), "line": lnum,
+                    "language": raw.get("language", u"")}
+            if "scope" in raw:
+                exts[raw.get("scopeKind", u"scope")] = raw["scope"]
+            if "signature" in raw:
+                exts["signature"] = raw["signature"]
+            if "typeref" in raw:
+                exts["typeref"] = raw["typeref"]
+            tags.append({"name": raw["name"], "file": file or raw["path"],
+                         "cmd": lnum, "exts": exts})
+        return tags, self._write_tagfile(tags)
+
+    def _format_tag_line(self, tag):
+        """To format a tag as a line of a tag file, in the same format
+        parsed by `_parse_tag_line`."""
+        exts = u"\t".join(u"{}:{}".format(k, val)
+                          for k, val in sorted(tag["exts"].items()) if val)
+        return u'{}\t{}\t{};"\t{}\n'.format(
+            tag["name"], tag["file"], tag["cmd"], exts)
 
     def _parse_tag_line(self, line, kinds_map):
-        """To parse a line from a tag file.
+        """To parse a line from a tag file, already decoded.
 
         Valid tag line format:
 
@@ -124,30 +908,37 @@ class TagsGenerator:
 
         NOTE: `kinds_map` is a dictionary of the form:
 
-            {"shortKindName": "longKindName", ...}
+            {u"shortKindName": u"longKindName", ...}
         """
         try:
-            fields, rawexts = line.strip(" \n").split(';"', 1)
-            name, file, cmd = (f.decode("utf-8") for f in fields.split("\t"))
+            fields, rawexts = line.strip(u" \n").split(u';"', 1)
+            name, file, cmd = fields.split(u"\t")
             exts = {}
-            for ext in rawexts.strip("\t").split("\t"):
-                if (len(ext) == 1 and ext.isalpha()) or ":" not in ext:
-                    exts["kind"] = kinds_map.get(ext, ext).decode("utf-8")
+            for ext in rawexts.strip(u"\t").split(u"\t"):
+                if (len(ext) == 1 and ext.isalpha()) or u":" not in ext:
+                    exts["kind"] = kinds_map.get(ext, ext)
                 else:
-                    t, val = ext.split(":", 1)
-                    exts[t] = val.decode("utf-8")
+                    t, val = ext.split(u":", 1)
+                    exts[t] = val
             return {'name': name, 'file': file, 'cmd': cmd, 'exts': exts}
         except ValueError:
             return
 
     def _files(self, modifier, curr_bufname):
         """To return all files for which tags need to be generated."""
-        if curr_bufname and modifier == settings.get("buffer_search_modifier"):
+        opts = settings.get_many("buffer_search_modifier",
+            "project_search_modifier")
+        if curr_bufname and modifier == opts["buffer_search_modifier"]:
             files = [curr_bufname]
-        elif modifier == settings.get("project_search_modifier"):
+        elif modifier == opts["project_search_modifier"]:
             files = self.plug.project.get_files()
         else:
             files = v.buffers()
+        return self._exclude(files)
+
+    def _exclude(self, files):
+        """To return `files` without the ones matching any of the patterns
+        in `g:surfer_exclude`."""
         exclude = settings.get("exclude")
         fn = lambda path: not any(fnmatch(path, patt) for patt in exclude)
         return filter(fn, files)
@@ -155,10 +946,11 @@ class TagsGenerator:
     def _filetype_data(self, filetype):
         """To return filetype-specific data."""
         if filetype == "*":
-            prg = settings.get("ctags_prg")
-            args = settings.get("ctags_args")
+            opts = settings.get_many("ctags_prg", "ctags_args", "exclude_kinds")
+            prg = opts["ctags_prg"]
+            args = opts["ctags_args"]
             kinds_map = {}
-            exclude_kinds = settings.get("exclude_kinds")
+            exclude_kinds = opts["exclude_kinds"]
         else:
             user_langs = settings.get("custom_languages")
             prg = user_langs[filetype].get("ctags_prg", "")
@@ -187,19 +979,93 @@ class TagsGenerator:
 
         return groups
 
+    def _write_tagfile(self, tags):
+        """To write `tags` to a new temporary tagfile, as if they were
+        generated by ctags (see `_parse_ctags_output`).
+
+        Lines are sorted by tag name: vim binary-searches tagfiles that
+        don't say they're unsorted, and would miss tags otherwise. The name
+        of the tagfile is returned.
+        """
+        lines = sorted(self._format_tag_line(t).encode("utf-8") for t in tags)
+        tagfile = self._generate_tagfile()
+        with tagfile:
+            tagfile.writelines(lines)
+        return tagfile.name
+
     def _generate_tagfile(self):
         """To generate a new temporary tagfile and update the vim
-        `tags` option."""
+        `tags` option. The caller is responsible for keeping track of the
+        tagfile, so that it can be deleted along with its tags (see
+        `tagfiles`)."""
         tagfile = tempfile.NamedTemporaryFile(delete=False)
         v.exe(u"set tags+={}".format(tagfile.name))
-        self.old_tagfiles.append(tagfile.name)
         return tagfile
 
-    def _remove_tagfiles(self):
-        """To delete all previously created tagfiles."""
-        for tagfile in self.old_tagfiles:
-            v.exe(u"set tags-={}".format(tagfile))
+    def write_jump_tagfile(self, tag):
+        """To write `tag` to the tagfile used for jumping to tags that are in
+        no other tagfile, e.g. tags found by the tags daemon. A single
+        tagfile is rewritten for every jump, so that they don't pile up."""
+        if self.jump_tagfile is None:
+            tagfile = tempfile.NamedTemporaryFile(delete=False)
+            tagfile.close()
+            v.exe(u"set tags+={}".format(tagfile.name))
+            self.jump_tagfile = tagfile.name
+        with open(self.jump_tagfile, "wb") as f:
+            f.write(self._format_tag_line(tag).encode("utf-8"))
+
+    def _drop_tagfile_lines(self, files):
+        """To remove the lines of the tags for `files` from all the tagfiles
+        but the ones written for single buffers (see `_retag_buffers`)."""
+        if not files:
+            return
+        files = set(f.encode("utf-8") for f in files)
+        buffer_tagfiles = set(t for tagfiles in self.buffer_tagfiles.values()
+                              for t in tagfiles)
+        for tagfile in self.tagfiles():
+            if tagfile in buffer_tagfiles:
+                continue
             try:
-                os.remove(tagfile)
-            except OSError:
+                with open(tagfile, "rb") as f:
+                    lines = f.readlines()
+                kept = []
+                for ln in lines:
+                    fields = ln.split("\t", 2)
+                    if len(fields) < 2 or fields[1] not in files:
+                        kept.append(ln)
+                if len(kept) < len(lines):
+                    with open(tagfile, "wb") as f:
+                        f.writelines(kept)
+            except IOError:
                 pass
+
+    def tagfiles(self):
+        """To return the names of all the tagfiles written so far and not
+        deleted yet."""
+        tagfiles = (self.old_tagfiles + self.remote_tagfiles +
+                    self.mapped_tagfiles)
+        for buffer_tagfiles in self.buffer_tagfiles.values():
+            tagfiles.extend(buffer_tagfiles)
+        return tagfiles
+
+    def _reset_tagfiles(self):
+        """To delete the tagfiles written for the tags in `tags_cache` and
+        for single buffers, when the tags cache is about to be replaced."""
+        self._remove_tagfiles(self.old_tagfiles)
+        for tagfiles in self.buffer_tagfiles.values():
+            self._remove_tagfiles(tagfiles)
+        self.old_tagfiles = []
+        self.buffer_tagfiles = {}
+
+    def _remove_tagfiles(self, tagfiles):
+        """To delete all the given tagfiles."""
+        for tagfile in tagfiles:
+            self._remove_tagfile(tagfile)
+
+    def _remove_tagfile(self, tagfile):
+        """To delete a single tagfile."""
+        v.exe(u"set tags-={}".format(tagfile))
+        try:
+            os.remove(tagfile)
+        except OSError:
+            pass
@@ -0,0 +1,540 @@
+# -*- coding: utf-8 -*-
+"""
+surfer.index
+~~~~~~~~~~~~
+
+This module defines the TagIndex class. This class is an inverted index
+over tag names used to quickly narrow down the tags that can possibly match
+a query, so that only those are scored by the fuzzy matcher.
+
+It also defines the NameIndex class, used to find the tags whose name
+starts with a query without scoring all of them, the PathTrie class and
+the `filter_tags` function, used to restrict a search to some kinds or
+directories (see `surfer.finder.TagsFinder._split_filters`), and the
+ShortPaths class, used to display files with the shortest path that tells
+them apart.
+"""
+
+import os
+import threading
+
+from bisect import bisect_left
+from operator import itemgetter
+from itertools import combinations
+from collections import defaultdict
+
+from surfer.utils.profiler import timed
+from surfer.search.ranking import prefix_match
+
+try:
+    from surfer.ext.search import prepare
+except ImportError:
+    from surfer.search.search import prepare
+
+
+def kind_matches(kind, kinds):
+    """To check whether `kind` matches any of the case-folded kind
+    filters `kinds`. A filter matches all the kinds it's a prefix of."""
+    kind = kind.lower()
+    return any(kind.startswith(k) for k in kinds)
+
+
+def filter_tags(tags, kinds, paths):
+    """To return the tags matching all filters, scanning all of them.
+
+    `kinds` is a list of kind filters (see `kind_matches`) and `paths` a
+    list of path prefixes. Empty lists don't filter anything.
+    """
+    if kinds:
+        tags = [t for t in tags if kind_matches(t["exts"].get("kind", u""), kinds)]
+    if paths:
+        trie = PathTrie(set(t["file"] for t in tags))
+        files = set(trie.find_many(paths))
+        tags = [t for t in tags if t["file"] in files]
+    return tags
+
+
+def tag_memory(tag):
+    """To return an estimate of the memory taken by `tag` in bytes,
+    including the data computed by `prepare_tags`."""
+    size = 700 + 9 * len(tag["name"]) + 4 * (len(tag["file"]) + len(tag["cmd"]))
+    for value in tag["exts"].itervalues():
+        size += 60 + 4 * len(value)
+    return size
+
+
+def prepare_tags(tags):
+    """To compute the data needed by the matching function for the name of
+    each tag in `tags`. The data is stored in the `meta` key of each tag."""
+    for tag in tags:
+        tag["meta"] = prepare(tag["name"])
+
+
+class TagIndex:
+    """To map grams of case-folded tag names to the ids of the tags that
+    contain them.
+
+    Grams are single characters and ordered pairs of characters, not
+    necessarily adjacent: the name `user_name` contains, among others, the
+    pairs ('u', 's'), ('s', 'n') and ('u', 'm'). Since a query matches a name
+    only if its characters appear in the name in the same order, every gram
+    of the query must be a gram of the name as well. Intersecting the posting
+    lists of the query grams thus gives a superset of the matching tags,
+    without missing any of them.
+
+    Tag ids are positions in `self.tags`. When the tags for a file are
+    replaced, old ids are marked as dead rather than removed from the posting
+    lists; the whole index is rebuilt once dead ids are the majority.
+
+    Building the posting lists takes seconds for hundreds of thousands of
+    tags, as each name of n characters has up to n * (n - 1) / 2 pairs. With
+    `background` they are built in a thread, so that the user doesn't wait
+    for them: until they are ready, `candidates` returns None as when the
+    index is disabled, and tags of files replaced in the meantime are
+    indexed again once they are.
+
+    Tags entering the index also get the data needed by the matching
+    function (see `prepare_tags`), even when the posting lists are not
+    built. Tags are also always partitioned by file, with files arranged by
+    directory, so that searches restricted to a directory only look at the
+    tags below it (see `scoped`).
+    """
+
+    # indexing small sets of tags is not worth the effort
+    min_tags = 5000
+
+    # posting lists much longer than the current candidates set are not
+    # intersected, they would cost more than scoring the extra candidates
+    max_ratio = 16
+
+    def __init__(self, budget=0, background=False):
+        # `budget` is the maximum (estimated) memory in bytes the index can
+        # take. When exceeded the index is disabled.
+        self.budget = budget
+        self.background = background
+        # names are indexed whatever the budget
+        self.names = NameIndex()
+        # Incremented each time the index is emptied, so that posting lists
+        # built in the background for tags no longer indexed are discarded
+        self.generation = 0
+        # Held while handing over posting lists built in the background
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """To empty the index."""
+        self.tags_by_file = {}
+        self.paths = PathTrie()
+        with self.lock:
+            self.generation += 1
+            # thread building the posting lists, see `_build_in_background`
+            self.builder = None
+            # index with the posting lists built by `builder`, once ready
+            self.built = None
+        # (file, tags) for the files replaced while `builder` is running
+        self.missed = []
+        self._clear_postings()
+
+    def _clear_postings(self):
+        """To empty the posting lists, disabling the index."""
+        self.tags = []
+        self.postings = defaultdict(list)
+        self.ids_by_file = defaultdict(list)
+        self.ids_by_kind = defaultdict(list)
+        self.entries = 0
+        self.dead = 0
+        self.enabled = False
+
+    @timed("index")
+    def build(self, tags):
+        """To index the given list of tags from scratch."""
+        self.clear()
+        prepare_tags(tags)
+        self.names.build(tags)
+        tags_by_file = self.tags_by_file
+        for tag in tags:
+            file_tags = tags_by_file.get(tag["file"])
+            if file_tags is None:
+                file_tags = tags_by_file[tag["file"]] = []
+                self.paths.add(tag["file"])
+            file_tags.append(tag)
+        if self.budget <= 0 or len(tags) < self.min_tags:
+            return
+        if not self.background:
+            self._build_postings(tags)
+            return
+        self.builder = threading.Thread(target=self._build_in_background,
+            args=(TagIndex(self.budget), tags, self.generation))
+        self.builder.daemon = True
+        self.builder.start()
+
+    def _build_postings(self, tags):
+        """To build the posting lists for `tags` from scratch."""
+        self.enabled = True
+        for i, tag in enumerate(tags):
+            self._add(tag)
+            if i % 1000 == 0 and self.memory() > self.budget:
+                self._clear_postings()
+                return
+
+    def _build_in_background(self, index, tags, generation):
+        """To build the posting lists for `tags` in `index`, a new empty
+        index, and hand them over to this one (see `_install`)."""
+        index._build_postings(tags)
+        with self.lock:
+            if generation == self.generation:
+                self.built = index
+
+    def _install(self):
+        """To start using the posting lists built in the background, if they
+        are ready, and index again the tags replaced in the meantime."""
+        if self.built is None:
+            return
+        with self.lock:
+            index, self.built = self.built, None
+            self.builder = None
+        if index is None:
+            return
+        self.tags = index.tags
+        self.postings = index.postings
+        self.ids_by_file = index.ids_by_file
+        self.ids_by_kind = index.ids_by_kind
+        self.entries = index.entries
+        self.enabled = index.enabled
+        missed, self.missed = self.missed, []
+        for file, tags in missed:
+            self._replace_postings(file, tags)
+
+    def wait(self):
+        """To wait for the posting lists being built in the background, if
+        any, and start using them."""
+        builder = self.builder
+        if builder is not None:
+            builder.join()
+            self._install()
+
+    def replace_file(self, file, tags):
+        """To replace all the tags for `file` with `tags`."""
+        self._install()
+        prepare_tags(tags)
+        self.names.replace_file(file, tags)
+        if file not in self.tags_by_file:
+            self.paths.add(file)
+        self.tags_by_file[file] = list(tags)
+        self._replace_postings(file, tags)
+
+    def _replace_postings(self, file, tags):
+        """To replace the ids of the tags for `file` in the posting lists."""
+        if self.builder is not None:
+            self.missed.append((file, list(tags)))
+            return
+        if not self.enabled:
+            return
+        for i in self.ids_by_file[file]:
+            self.tags[i] = None
+            self.dead += 1
+        self.ids_by_file[file] = []
+        for tag in tags:
+            self._add(tag)
+        if self.dead > len(self.tags) // 2:
+            self.build([t for t in self.tags if t is not None])
+        elif self.memory() > self.budget:
+            self._clear_postings()
+
+    def candidates(self, query, kinds=(), paths=()):
+        """To return the list of tags that can possibly match `query`, in the
+        same order they have been indexed.
+
+        Only tags matching the kind filters `kinds` and the path prefixes
+        `paths` are returned (see `filter_tags`). None is returned when the
+        index is not available: in that case all tags must be taken into
+        account.
+        """
+        self._install()
+        if not self.enabled or not query:
+            return None
+        filters = []
+        if kinds:
+            filters.append(self._kind_ids(kinds))
+        if paths:
+            filters.append(self._path_ids(paths))
+        lists = sorted([self.postings.get(gram, ()) for gram in
+                        self._grams(query.lower())] + filters, key=len)
+        ids = set(lists[0])
+        for posting in lists[1:]:
+            if not ids or len(posting) > self.max_ratio * len(ids):
+                break
+            ids.intersection_update(posting)
+        # unlike grams, filters must always be applied
+        for posting in filters:
+            if ids:
+                ids.intersection_update(posting)
+        tags = self.tags
+        return [tags[i] for i in sorted(ids) if tags[i] is not None]
+
+    def scoped(self, paths):
+        """To return the tags of the files below the path prefixes `paths`,
+        without looking at the tags of any other file."""
+        tags_by_file = self.tags_by_file
+        return [t for f in sorted(self.paths.find_many(paths))
+                for t in tags_by_file[f]]
+
+    def prefixed(self, query, smart_case, kinds=(), paths=()):
+        """To return the tags whose name starts with `query` (see
+        `surfer.search.ranking.prefix_match`), matching the kind filters
+        `kinds` and the path prefixes `paths`.
+
+        Since these tags come before all others in search results, they
+        are all that needs to be ranked when there are at least as many of
+        them as the results needed.
+        """
+        return filter_tags(self.names.find(query, smart_case), kinds, paths)
+
+    def memory(self):
+        """To return an estimate of the memory taken by the index in bytes.
+        Tags themselves are not taken into account."""
+        return 8 * (self.entries + len(self.tags)) + 100 * len(self.postings)
+
+    def _kind_ids(self, kinds):
+        """To return the ids of the tags matching the kind filters `kinds`."""
+        ids = []
+        for kind, kind_ids in self.ids_by_kind.iteritems():
+            if kind_matches(kind, kinds):
+                ids.extend(kind_ids)
+        return ids
+
+    def _path_ids(self, paths):
+        """To return the ids of the tags of files below the path prefixes
+        `paths`."""
+        ids = []
+        for file in self.paths.find_many(paths):
+            ids.extend(self.ids_by_file.get(file, ()))
+        return ids
+
+    def _add(self, tag):
+        """To add a single tag to the index."""
+        i = len(self.tags)
+        self.tags.append(tag)
+        self.ids_by_file[tag["file"]].append(i)
+        self.ids_by_kind[tag["exts"].get("kind", u"")].append(i)
+        postings = self.postings
+        grams = self._grams(tag["name"].lower())
+        for gram in grams:
+            postings[gram].append(i)
+        self.entries += len(grams)
+
+    def _grams(self, name):
+        """To return all grams of the (case-folded) `name`."""
+        grams = set(combinations(name, 2))
+        grams.update(name)
+        return grams
+
+
+class NameIndex:
+    """To find the tags whose name starts with a prefix with a binary search
+    over the sorted case-folded tag names.
+
+    When the tags for a file are replaced, old tags are not removed from the
+    sorted names, which would take linear time: they are skipped instead,
+    while new tags are kept apart and scanned linearly. The index is rebuilt
+    once there are `max_pending` new tags.
+    """
+
+    max_pending = 2000
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        """To empty the index."""
+        self.keys = []
+        self.tags = []
+        self.replaced = set()
+        self.pending = []
+
+    def build(self, tags):
+        """To index the given list of tags from scratch."""
+        self.clear()
+        keyed = sorted(((t["name"].lower(), t) for t in tags), key=itemgetter(0))
+        self.keys = [k for k, _ in keyed]
+        self.tags = [t for _, t in keyed]
+
+    def replace_file(self, file, tags):
+        """To replace all the tags for `file` with `tags`."""
+        self.replaced.add(file)
+        self.pending = [t for t in self.pending if t["file"] != file]
+        self.pending.extend(tags)
+        if len(self.pending) > self.max_pending:
+            self.build([t for t in self.tags if t["file"] not in self.replaced]
+                       + self.pending)
+
+    def find(self, query, smart_case):
+        """To return the tags whose name starts with `query` (see
+        `surfer.search.ranking.prefix_match`)."""
+        if not query:
+            return []
+        key = query.lower()
+        # names with characters beyond the Basic Multilingual Plane right
+        # after `key` sort above the upper bound and are missed: they are
+        # still found by the fuzzy search
+        lo = bisect_left(self.keys, key)
+        hi = bisect_left(self.keys, key + u"\uffff", lo)
+        replaced = self.replaced
+        tags = [t for t in self.tags[lo:hi] if t["file"] not in replaced]
+        tags.extend(t for t in self.pending if t["name"].lower().startswith(key))
+        if smart_case and not query.islower():
+            tags = [t for t in tags if prefix_match(query, t["name"], True)]
+        return tags
+
+    def memory(self):
+        """To return an estimate of the memory taken by the index in bytes.
+        Tags themselves are not taken into account."""
+        return 16 * len(self.tags) + sum(40 + 4 * len(k) for k in self.keys)
+
+
+class PathTrie:
+    """To find the files below a path prefix without looking at all of them.
+
+    Each node is a dictionary that maps path components to child nodes,
+    with the None key mapping to the list of files ending there. The last
+    component of a prefix can be partial: `/src/ut` is a prefix of both
+    `/src/utils/misc.py` and `/src/ut.py`.
+    """
+
+    def __init__(self, files=()):
+        self.root = {}
+        for file in files:
+            self.add(file)
+
+    def add(self, file):
+        """To add `file` to the trie."""
+        node = self.root
+        for part in self._split(file):
+            node = node.setdefault(part, {})
+        node.setdefault(None, []).append(file)
+
+    def find(self, prefix):
+        """To return all the files whose path starts with `prefix`."""
+        parts = self._split(prefix)
+        node = self.root
+        for part in parts[:-1]:
+            node = node.get(part)
+            if node is None:
+                return []
+        last = parts[-1]
+        stack = [child for part, child in node.iteritems()
+                 if part is not None and part.startswith(last)]
+        files = []
+        while stack:
+            node = stack.pop()
+            for part, child in node.iteritems():
+                if part is None:
+                    files.extend(child)
+                else:
+                    stack.append(child)
+        return files
+
+    def find_many(self, prefixes):
+        """To return all the files whose path starts with any of
+        `prefixes`, without duplicates."""
+        files = set()
+        for prefix in prefixes:
+            files.update(self.find(prefix))
+        return files
+
+    def _split(self, path):
+        """To split `path` into its components."""
+        if os.name == "nt":
+            path = path.replace(u"\\", u"/")
+        return path.split(u"/")
+
+
+class ShortPaths:
+    """To map files to the shortest suffix of their path that no other file
+    has, e.g. `utils/misc.py` when there is also a `core/misc.py`.
+
+    Files are grouped by name: adding or removing a file only updates the
+    suffixes of the files with the same name, and files whose name is unique
+    are displayed with the name alone without storing anything for them.
+    """
+
+    def __init__(self, files=()):
+        # {file name: file path, or set of file paths if many}
+        self.groups = {}
+        # {file: shortest unique suffix}, for files whose name is not unique
+        self.suffixes = {}
+        self.add(files)
+
+    def __len__(self):
+        return sum(len(g) if isinstance(g, set) else 1
+                   for g in self.groups.itervalues())
+
+    def add(self, files):
+        """To add `files` to the table. Files already there are ignored."""
+        changed = set()
+        groups = self.groups
+        for file in files:
+            name = os.path.basename(file)
+            group = groups.get(name)
+            if group is None:
+                groups[name] = file
+            elif isinstance(group, set):
+                if file not in group:
+                    group.add(file)
+                    changed.add(name)
+            elif group != file:
+                groups[name] = set((group, file))
+                changed.add(name)
+        for name in changed:
+            self._update(name)
+
+    def remove(self, files):
+        """To remove `files` from the table."""
+        changed = set()
+        groups = self.groups
+        for file in files:
+            name = os.path.basename(file)
+            group = groups.get(name)
+            if group == file:
+                del groups[name]
+            elif isinstance(group, set) and file in group:
+                group.discard(file)
+                self.suffixes.pop(file, None)
+                changed.add(name)
+        for name in changed:
+            group = groups[name]
+            if not group:
+                del groups[name]
+            elif len(group) == 1:
+                self.suffixes.pop(next(iter(group)), None)
+                groups[name] = group.pop()
+            else:
+                self._update(name)
+
+    def get(self, file):
+        """To return the shortest suffix of the path of `file` that no other
+        file has. Files that are not in the table are displayed with their
+        name."""
+        return self.suffixes.get(file) or os.path.basename(file)
+
+    def memory(self):
+        """To return an estimate of the memory taken by the table in bytes.
+        File paths themselves are not taken into account."""
+        return 100 * len(self.groups) + sum(
+            160 + 4 * len(s) for s in self.suffixes.itervalues())
+
+    def _update(self, name):
+        """To compute the suffixes of all the files named `name`."""
+        sep = os.path.sep
+        parts = [(f, f.split(sep)) for f in self.groups[name]]
+        counts = defaultdict(int)
+        for _, p in parts:
+            for k in xrange(2, len(p) + 1):
+                counts[tuple(p[-k:])] += 1
+        for file, p in parts:
+            for k in xrange(2, len(p) + 1):
+                if counts[tuple(p[-k:])] == 1:
+                    self.suffixes[file] = sep.join(p[-k:])
+                    break
+            else:
+                self.suffixes[file] = file
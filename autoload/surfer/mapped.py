@@ -0,0 +1,431 @@
+# -*- coding: utf-8 -*-
+"""
+surfer.mapped
+~~~~~~~~~~~~~
+
+This module defines the MappedIndex class. This class gives access to the
+tags stored in a read-only index file, which is memory-mapped rather than
+loaded. With the C extension, names are scanned directly in the mapped
+memory and Python objects are created only for the best matches, so that
+even projects with millions of tags cost little memory. Vim instances
+mapping the same file share its pages.
+
+File layout (all integers are little-endian):
+
+    header   magic, version, tags count, files count and the offsets of
+             the sections below (see HEADER)
+    tags     a record for each tag (see TAG), grouped by file
+    files    a record for each file: path, modification time and the range
+             of the ids of its tags (see FILE)
+    names    for each tag, the name (UTF-8) followed by its word boundaries
+             mask (one byte per character, see `surfer.search.search.prepare`)
+    data     file paths and, for each tag, a JSON array [cmd, exts]
+    kinds    the number of kinds, a record for each kind (see KIND), the
+             kind names and, for each kind, the ids of its tags as an array
+             of 32-bit integers
+    sorted   the ids of all tags as an array of 32-bit integers, sorted by
+             case-folded name, to find the names starting with a query with
+             a binary search
+
+This module doesn't depend on vim.
+"""
+
+import os
+import sys
+import json
+import mmap
+import struct
+import tempfile
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+
+from surfer.utils import fs
+from surfer.utils.profiler import timed
+from surfer.search.ranking import rank, prepare, prefix_match
+from surfer.index import PathTrie, filter_tags, kind_matches
+
+try:
+    from surfer.ext.search import search_mapped
+except ImportError:
+    search_mapped = None
+
+
+MAGIC = "SRFIDX\0\0"
+VERSION = 4
+
+# magic, version, tags, files, tags offset, files offset, names offset,
+# data offset, kinds offset, sorted offset
+HEADER = struct.Struct("<8sIIIIIIIII")
+# name offset, name length (bytes), name length (characters), file id,
+# line, data offset, data length
+TAG = struct.Struct("<IHHIIII")
+# path offset, path length, modification time, first tag id, tags count
+FILE = struct.Struct("<IIdII")
+# name offset, name length, ids offset, ids count
+KIND = struct.Struct("<IIII")
+COUNT = struct.Struct("<I")
+
+
+def _ids_array(ids=()):
+    """To return an array of 32-bit integers as stored in index files."""
+    a = array("I", ids)
+    if a.itemsize != 4:
+        a = array("L", ids)
+    return a
+
+
+def _ids_bytes(a):
+    """To convert an array of ids to little-endian bytes."""
+    if sys.byteorder != "little":
+        a = array(a.typecode, a)
+        a.byteswap()
+    return a.tostring()
+
+
+def _ids_from_bytes(data):
+    """To convert little-endian bytes to an array of ids."""
+    a = _ids_array()
+    a.fromstring(data)
+    if sys.byteorder != "little":
+        a.byteswap()
+    return a
+
+
+def write(path, tags, mtimes):
+    """To write an index file for `tags` at `path`.
+
+    `mtimes` is a dictionary {file: modification time} for all the files
+    the index is about, including those without tags. The file is replaced
+    atomically (except on MS Windows, see `surfer.utils.fs.replace`), so that
+    processes that have mapped the previous version can keep using it.
+    """
+    files = list(mtimes)
+    file_ids = dict((f, i) for i, f in enumerate(files))
+    # tags are grouped by file so that the tags of a file, or of a
+    # directory, can be searched without looking at the others
+    tags = sorted((t for t in tags if t["file"] in file_ids),
+                  key=lambda t: file_ids[t["file"]])
+
+    names, data, records, keys = [], [], [], []
+    names_size = data_size = 0
+    ids_by_kind = defaultdict(list)
+    ranges = [[0, 0] for f in files]
+    for tag in tags:
+        name = tag["name"].encode("utf-8")
+        if len(name) > 0xFFFF:
+            continue
+        file_range = ranges[file_ids[tag["file"]]]
+        if not file_range[1]:
+            file_range[0] = len(records)
+        file_range[1] += 1
+        mask = prepare(tag["name"])[1]
+        line = tag["exts"].get("line", u"")
+        line = int(line) if line.isdigit() else 0
+        cmd = None if tag["cmd"] == unicode(line) else tag["cmd"]
+        blob = json.dumps([cmd, tag["exts"]], separators=(",", ":"))
+        ids_by_kind[tag["exts"].get("kind", u"")].append(len(records))
+        keys.append(tag["name"].lower())
+        records.append((names_size, len(name), len(tag["name"]),
+                        file_ids[tag["file"]], line, data_size, len(blob)))
+        names.append(name + mask)
+        names_size += len(name) + len(mask)
+        data.append(blob)
+        data_size += len(blob)
+
+    paths = []
+    for f, (first, count) in zip(files, ranges):
+        p = f.encode("utf-8")
+        paths.append((data_size, len(p), mtimes[f], first, count))
+        data.append(p)
+        data_size += len(p)
+
+    tags_off = HEADER.size
+    files_off = tags_off + TAG.size * len(records)
+    names_off = files_off + FILE.size * len(files)
+    data_off = names_off + names_size
+    kinds_off = data_off + data_size
+
+    kinds = sorted(ids_by_kind)
+    kind_names = [k.encode("utf-8") for k in kinds]
+    kind_records = []
+    off = kinds_off + COUNT.size + KIND.size * len(kinds)
+    for name in kind_names:
+        kind_records.append([off, len(name)])
+        off += len(name)
+    for record, kind in zip(kind_records, kinds):
+        record.extend([off, len(ids_by_kind[kind])])
+        off += 4 * len(ids_by_kind[kind])
+    sorted_off = off
+
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd, tmp = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(records), len(files),
+            tags_off, files_off, names_off, data_off, kinds_off, sorted_off))
+        for name_off, name_len, nchars, file_id, line, off, size in records:
+            f.write(TAG.pack(names_off + name_off, name_len, nchars, file_id,
+                             line, data_off + off, size))
+        for off, size, mtime, first, count in paths:
+            f.write(FILE.pack(data_off + off, size, mtime, first, count))
+        f.write("".join(names))
+        f.write("".join(data))
+        f.write(COUNT.pack(len(kinds)))
+        for record in kind_records:
+            f.write(KIND.pack(*record))
+        f.write("".join(kind_names))
+        for kind in kinds:
+            f.write(_ids_bytes(_ids_array(ids_by_kind[kind])))
+        f.write(_ids_bytes(_ids_array(
+            sorted(xrange(len(keys)), key=keys.__getitem__))))
+    fs.replace(tmp, path)
+
+
+def _may_match(query, name):
+    """To check whether all the characters of `query` appear in `name`, in
+    the same order and ignoring case, as required for `name` to match
+    `query`."""
+    name = name.lower()
+    i = 0
+    for c in query.lower():
+        i = name.find(c, i) + 1
+        if not i:
+            return False
+    return True
+
+
+class MappedIndex:
+
+    def __init__(self, path):
+        # `IOError` is raised if `path` can't be read, `ValueError` if it's
+        # not a valid index file
+        self.path = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < HEADER.size:
+            self.close()
+            raise ValueError("invalid index: {}".format(path))
+        header = HEADER.unpack_from(self.map, 0)
+        if header[0] != MAGIC or header[1] != VERSION:
+            self.close()
+            raise ValueError("invalid index: {}".format(path))
+        self.ntags, self.nfiles, self.tags_off, self.files_off = header[2:6]
+        kinds_off, self.sorted_off = header[8:10]
+        # The file table is small compared to the tags, so it's loaded
+        self.files = []
+        self.mtimes = {}
+        # {file: (first tag id, tags count)}
+        self.ranges = {}
+        for i in xrange(self.nfiles):
+            off, size, mtime, first, count = FILE.unpack_from(
+                self.map, self.files_off + i * FILE.size)
+            f = self.map[off:off+size].decode("utf-8")
+            self.files.append(f)
+            self.mtimes[f] = mtime
+            self.ranges[f] = (first, count)
+        self.file_ids = dict((f, i) for i, f in enumerate(self.files))
+        self.paths = PathTrie(self.files)
+        # {kind: (ids offset, ids count)}
+        self.kinds = {}
+        nkinds = COUNT.unpack_from(self.map, kinds_off)[0]
+        for i in xrange(nkinds):
+            name_off, name_len, ids_off, count = KIND.unpack_from(
+                self.map, kinds_off + COUNT.size + i * KIND.size)
+            kind = self.map[name_off:name_off+name_len].decode("utf-8")
+            self.kinds[kind] = (ids_off, count)
+
+    def __len__(self):
+        return self.ntags
+
+    def close(self):
+        """To unmap the index file."""
+        self.map.close()
+
+    def name(self, i):
+        """To return the name of the i-th tag."""
+        name_off, name_len = TAG.unpack_from(
+            self.map, self.tags_off + i * TAG.size)[:2]
+        return self.map[name_off:name_off+name_len].decode("utf-8")
+
+    def tag(self, i):
+        """To return the i-th tag."""
+        name_off, name_len, nchars, file_id, line, off, size = \
+            TAG.unpack_from(self.map, self.tags_off + i * TAG.size)
+        cmd, exts = json.loads(self.map[off:off+size])
+        return {"name": self.map[name_off:name_off+name_len].decode("utf-8"),
+                "file": self.files[file_id],
+                "cmd": cmd if cmd is not None else unicode(line),
+                "exts": exts}
+
+    def search(self, query, max_results, smart_case, exclude=(), kinds=(),
+               paths=()):
+        """To find the tags matching `query`, sorted by similarity.
+
+        Tags for the files in `exclude` are not taken into account, nor tags
+        not matching the kind filters `kinds` or the path prefixes `paths`
+        (see `surfer.index.filter_tags`). Results have the same form of the
+        ones returned by `surfer.search.ranking.rank`.
+        """
+        if search_mapped is None:
+            # Without the C extension, tags whose name may match are loaded
+            # for each search. They are not kept: the index file would no
+            # longer save any memory.
+            ids = self._scope_ids(paths, exclude) if paths else xrange(self.ntags)
+            tags = [self.tag(i) for i in ids
+                    if _may_match(query, self.name(i))]
+            tags = filter_tags(tags, kinds, ())
+            if exclude:
+                tags = [t for t in tags if t["file"] not in exclude]
+            return rank(query, tags, max_results, smart_case)
+
+        # With path filters, only the tags of the matching files are looked
+        # at. Otherwise, tags of excluded files are skipped with a mask.
+        mask = None
+        if exclude and not paths:
+            mask = bytearray(self.nfiles)
+            for f in exclude:
+                if f in self.file_ids:
+                    mask[self.file_ids[f]] = 1
+            mask = str(mask)
+
+        scope_ids = None
+        if paths:
+            scope_ids = self._scope_ids(paths, exclude, kinds)
+            if not scope_ids:
+                return []
+            scope_ids = _ids_bytes(scope_ids)
+        elif kinds:
+            scope_ids = self._kind_ids(kinds)
+            if not scope_ids:
+                return []
+
+        # Tags whose name is the query come first, followed by those whose
+        # name starts with it (see `surfer.search.ranking.rank`): they are
+        # searched first, and all other tags only when they are not enough
+        exact, prefixed = self._prefixed(query, smart_case)
+        if scope_ids is not None:
+            allowed = set(_ids_from_bytes(str(scope_ids)))
+            exact = [i for i in exact if i in allowed]
+            prefixed = [i for i in prefixed if i in allowed]
+        tiers = [(2, exact), (1, prefixed), (0, None)]
+
+        results = []
+        found = set()
+        for prefix, ids in tiers:
+            if 0 <= max_results <= len(results):
+                break
+            if ids is not None:
+                if not ids:
+                    continue
+                ids = _ids_bytes(_ids_array(sorted(ids)))
+            else:
+                ids = scope_ids
+            with timed("search"):
+                best = search_mapped(self.map, query, smart_case, max_results,
+                                     mask, ids)
+            for similarity, i, positions in best:
+                if i in found:
+                    continue
+                found.add(i)
+                tag = self.tag(i)
+                tag["similarity"] = similarity
+                tag["prefix"] = prefix
+                tag["match_positions"] = positions
+                results.append(tag)
+        if max_results >= 0:
+            results = results[:max_results]
+        return results
+
+    def _prefixed(self, query, smart_case):
+        """To return the ids of the tags whose name is `query` and of those
+        whose name just starts with it (see
+        `surfer.search.ranking.prefix_match`), as two lists."""
+        if not query:
+            return [], []
+        key = query.lower()
+        names = _SortedNames(self)
+        # see `surfer.index.NameIndex.find` about the upper bound
+        lo = bisect_left(names, key)
+        mid = bisect_right(names, key, lo)
+        hi = bisect_left(names, key + u"\uffff", mid)
+        ids = _ids_from_bytes(self.map[self.sorted_off+4*lo:self.sorted_off+4*hi])
+        exact, prefixed = list(ids[:mid-lo]), list(ids[mid-lo:])
+        if smart_case and not query.islower():
+            exact = [i for i in exact if prefix_match(query, self.name(i), True)]
+            prefixed = [i for i in prefixed
+                        if prefix_match(query, self.name(i), True)]
+        return exact, prefixed
+
+    def _scope_ids(self, paths, exclude=(), kinds=()):
+        """To return the ids of the tags of the files matching the path
+        prefixes `paths` and not in `exclude`, as a sorted array. Only the
+        ids of the tags matching the kind filters `kinds`, if any, are
+        returned."""
+        ranges = sorted(self.ranges[f] for f in self.paths.find_many(paths)
+                        if f not in exclude)
+        ids = _ids_array()
+        if not kinds:
+            for first, count in ranges:
+                ids.extend(xrange(first, first + count))
+            return ids
+        matching = [_Ids(self.map, off, count)
+                    for kind, (off, count) in self.kinds.items()
+                    if kind_matches(kind, kinds)]
+        # ids of each kind are sorted, so the ones within the range of
+        # a file are found with a binary search
+        for first, count in ranges:
+            if not count:
+                continue
+            found = []
+            for kind_ids in matching:
+                lo = bisect_left(kind_ids, first)
+                hi = bisect_left(kind_ids, first + count, lo)
+                found.extend(kind_ids[i] for i in xrange(lo, hi))
+            ids.extend(sorted(found))
+        return ids
+
+    def _kind_ids(self, kinds):
+        """To return the ids of the tags matching the kind filters `kinds`,
+        in the form expected by `search_mapped`."""
+        matching = [(off, count) for kind, (off, count) in self.kinds.items()
+                    if kind_matches(kind, kinds)]
+        if len(matching) == 1:
+            # ids are used where they are, without copying them
+            off, count = matching[0]
+            return buffer(self.map, off, 4 * count)
+        ids = set()
+        for off, count in matching:
+            ids.update(_ids_from_bytes(self.map[off:off+4*count]))
+        return _ids_bytes(_ids_array(sorted(ids)))
+
+
+class _Ids:
+    """To view an array of ids in the mapped index file as a sequence."""
+
+    def __init__(self, map, off, count):
+        self.map = map
+        self.off = off
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        return COUNT.unpack_from(self.map, self.off + 4 * i)[0]
+
+
+class _SortedNames:
+    """To view the case-folded tag names of an index file, sorted, as a
+    sequence that can be searched with `bisect`."""
+
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return self.index.ntags
+
+    def __getitem__(self, i):
+        off = self.index.sorted_off + 4 * i
+        return self.index.name(COUNT.unpack_from(self.index.map, off)[0]).lower()
@@ -4,17 +4,19 @@ surfer.project
 ~~~~~~~~~~~~~~
 
 This module defines the Project class. This class represents the
-current project, from the user perspective.
+current project, from the user perspective, and the workspace: the current
+project along with the other projects the user is working on.
 """
 
 from fnmatch import fnmatch
-from os import walk, listdir
-from unicodedata import normalize
+from os import walk, listdir, sep
 from itertools import ifilter, imap
-from os.path import isfile, dirname
+from os.path import isfile, isdir, dirname, expanduser, abspath
 
 from surfer.utils import v
 from surfer.utils import settings
+from surfer.utils.profiler import timed
+from surfer.index import ShortPaths
 
 
 class Project:
@@ -23,41 +25,150 @@ class Project:
         self.plug = plug
         self.root_cache = ""
         self.files_cache = []
+        # {root: files} for the current project and the projects recently
+        # visited, most recent last (see `workspace_roots`)
+        self.files_by_root = {}
+        # {root: set of files}, to tell quickly whether a file is known
+        self.file_sets = {}
+        # roots whose files must be listed again, see `get_root`
+        self.stale_roots = set()
+        # the last project root found
+        self.last_root = u""
+        self.visited = []
+        # shortest paths that tell apart the files of all those projects,
+        # used to display them (see `surfer.ui.Formatter`)
+        self.short_paths = ShortPaths()
+        # files whose tags are in memory but that belong to none of those
+        # projects, e.g. buffers (see `set_tagged_files`)
+        self.extra_files = set()
 
-    def get_files(self):
-        """To get all files in the current project.
+    def get_files(self, root=None):
+        """To get all files in the project `root`, by default the current
+        project.
 
         The current working directory is derived from the path of
         the current open buffer.
         """
-        root = self.get_root()
+        current = root is None
+        if current:
+            root = self.get_root()
         if not root:
             return []
 
-        if not self.files_cache:
-            # Get all files of the current project.
+        files = self.files_by_root.get(root)
+        if files is None or root in self.stale_roots:
+            # Get all files of the project.
             # XXX On OS X, if there is a directory whose name contains unicode
             # characters, glob("{root}/**") skips all files in that directory
             # except the first. (using os.walk in not a solution since it does
             # not filter files according to the `wildignore` vim option)
-            files = v.call(u"glob('{}/**')".format(root)).split(u"\n")
-            files = imap(lambda f: normalize("NFC", f), files)
-            self.files_cache = filter(isfile, files)
+            with timed("files"):
+                files = v.eval(u"glob('{}/**')".format(root)).split("\n")
+                files = filter(isfile, imap(v.path, files))
+            self._set_files(root, files)
 
-        return self.files_cache
+        if current:
+            self.files_cache = files
+        return files
+
+    def workspace_roots(self):
+        """To return the roots of all the projects in the workspace: the
+        ones listed in `g:surfer_workspace_roots` and the last
+        `g:surfer_workspace_max_roots` visited, current project included."""
+        opts = settings.get_many("workspace_roots", "workspace_max_roots",
+                                 workspace_max_roots=int)
+        self.get_root()
+        roots = []
+        for root in opts["workspace_roots"]:
+            root = abspath(expanduser(v.decode(root)))
+            if isdir(root) and root not in roots:
+                roots.append(root)
+        recent = self.visited[-opts["workspace_max_roots"]:]
+        roots.extend(r for r in reversed(recent) if r not in roots)
+        return roots
 
     def get_root(self):
-        """To return the current project root."""
+        """To return the current project root.
+
+        When the user comes back to a project after working on another one,
+        its files are listed again: files may have been added or removed in
+        the meantime, e.g. by switching git branches.
+        """
         if not self.root_cache:
             self.root_cache = self._find_root(v.cwd(), settings.get("root_markers"))
+            if self.root_cache:
+                if self.root_cache != self.last_root:
+                    if self.root_cache in self.files_by_root:
+                        self.stale_roots.add(self.root_cache)
+                    self.last_root = self.root_cache
+                self._visit(self.root_cache)
         return self.root_cache
 
     def update_root(self):
-        """To keep updated the project root whenever the user edits a buffer."""
+        """To keep updated the project root whenever the user edits a buffer.
+
+        Files of the projects visited are not forgotten when the user moves
+        to another project, so that they don't need to be listed again when
+        the user comes back or searches the workspace.
+        """
         bufname = v.bufname()
         if bufname is None or not bufname.startswith(self.root_cache):
             self.files_cache = []
             self.root_cache = u""
+        if bufname:
+            # files created since the project files have been listed
+            for root, files in self.files_by_root.iteritems():
+                known = self.file_sets[root]
+                if (bufname.startswith(root + sep) and bufname not in known
+                        and isfile(bufname)):
+                    files.append(bufname)
+                    known.add(bufname)
+                    self.short_paths.add([bufname])
+
+    def set_tagged_files(self, files):
+        """To be notified that the tags in memory are now the tags of
+        `files`. Files outside the projects known so far are added to the
+        shortest paths table, so that they are told apart from the others
+        as well, and removed once their tags are no longer in memory."""
+        extra = set(f for f in files if not self._known(f))
+        self.short_paths.add(extra.difference(self.extra_files))
+        self.short_paths.remove(f for f in self.extra_files.difference(extra)
+                                if not self._known(f))
+        self.extra_files = extra
+
+    def _known(self, file):
+        """To check whether `file` belongs to any of the projects whose
+        files have been listed."""
+        return any(file in s for s in self.file_sets.itervalues())
+
+    def _visit(self, root):
+        """To record that the user is working on the project `root`. Files
+        of projects no longer in the workspace are forgotten."""
+        if root in self.visited:
+            self.visited.remove(root)
+        self.visited.append(root)
+        keep = set(self.workspace_roots())
+        self.visited = [r for r in self.visited if r in keep]
+        for r in list(self.files_by_root):
+            if r not in keep:
+                del self.file_sets[r]
+                self.stale_roots.discard(r)
+                # files of nested projects still in the workspace are kept,
+                # as well as files whose tags are still in memory
+                self.short_paths.remove(f for f in self.files_by_root.pop(r)
+                    if not any(f.startswith(k + sep) for k in keep)
+                    and f not in self.extra_files)
+
+    def _set_files(self, root, files):
+        """To set the files of the project `root`. Files no longer there are
+        forgotten, unless they belong to another project too."""
+        gone = self.file_sets.get(root, set()).difference(files)
+        self.files_by_root[root] = files
+        self.file_sets[root] = set(files)
+        self.stale_roots.discard(root)
+        self.short_paths.add(files)
+        self.short_paths.remove(f for f in gone if not self._known(f)
+                                and f not in self.extra_files)
 
     def _find_root(self, path, root_markers):
         """To find the the root of the current project.
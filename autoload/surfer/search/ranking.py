@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+surfer.search.ranking
+~~~~~~~~~~~~~~~~~~~~~
+
+This module defines the function used to rank tags against a query. The
+fastest available matching function is used: the C extension when it has
+been compiled, or the pure Python one.
+
+This module doesn't depend on vim, so that it can be used by the tags
+daemon as well (see `surfer.daemon`).
+"""
+
+import time
+
+from surfer.utils.profiler import timed
+from surfer import exceptions as ex
+
+# `prepare` is imported as well so that an outdated extension, which
+# doesn't know about precomputed data, is never used
+try:
+    from surfer.ext.search import match, prepare
+except ImportError:
+    from surfer.search.search import match, prepare
+
+
+def prefix_match(query, name, smart_case, lower=None):
+    """To check whether `name` starts with `query`.
+
+    Case is ignored, except for the uppercase characters of `query` when
+    `smart_case` is set, as with `match`. `lower` is `name` in lowercase,
+    computed on the fly when not given. Returns 2 when `name` is `query`,
+    1 when it just starts with it and 0 otherwise.
+    """
+    if lower is None:
+        lower = name.lower()
+    if not lower.startswith(query.lower()):
+        return 0
+    if smart_case and not query.islower():
+        for i, c in enumerate(query):
+            if c.isupper() and name[i] != c:
+                return 0
+    return 2 if len(name) == len(query) else 1
+
+
+def result_key(result):
+    """To return the key search results are sorted by.
+
+    Results whose name is the query come first, followed by results whose
+    name starts with it and then by all the other matches (the `prefix` key
+    of results, see `prefix_match`). Each group is sorted by similarity.
+    """
+    return -result["prefix"], result["similarity"]
+
+
+def rank(query, tags, max_results, smart_case, budget=0, interrupt=None,
+         chunk_size=2000):
+    """To find all tags matching `query` and sort them by similarity.
+
+    Tags whose name is `query` come first, followed by tags whose name
+    starts with `query` and then by all the other matches (see
+    `result_key`).
+
+    Tags are scanned in chunks of `chunk_size` tags. If the search takes
+    longer than `budget` milliseconds, only the tags scanned so far are
+    taken into account. `interrupt` is an optional function called between
+    chunks: when it returns True the exception `SearchInterrupted` is
+    raised.
+    """
+    return rank_within(query, tags, max_results, smart_case, budget,
+                       interrupt, chunk_size)[0]
+
+
+def rank_within(query, tags, max_results, smart_case, budget=0,
+                interrupt=None, chunk_size=2000):
+    """To rank tags as `rank` does. A tuple is returned with the results
+    and a flag set when the search has been cut short by `budget`, that is,
+    when the results are partial."""
+    matches = []
+    partial = False
+    start = time.time()
+
+    with timed("search"):
+        for offset in xrange(0, len(tags), chunk_size):
+
+            if offset > 0:
+                if interrupt and interrupt():
+                    raise ex.SearchInterrupted("Search interrupted")
+                if budget > 0 and (time.time() - start) * 1000 > budget:
+                    partial = True
+                    break
+
+            for tag in tags[offset:offset+chunk_size]:
+                # `meta` is computed when tags enter the index,
+                # see `surfer.index.prepare_tags`
+                meta = tag.get("meta")
+                similarity, positions = match(query, tag["name"], smart_case,
+                                              meta)
+                if positions:
+                    matches.append({
+                        "match_positions": positions,
+                        "similarity": similarity,
+                        "prefix": prefix_match(query, tag["name"], smart_case,
+                                               meta[0] if meta else None),
+                        "name": tag["name"],
+                        "file": tag["file"],
+                        "cmd": tag["cmd"],
+                        "exts": tag["exts"]
+                    })
+
+    l = len(matches)
+    if max_results < 0 or max_results > l:
+        max_results = l
+
+    with timed("sort"):
+        return sorted(matches, key=result_key)[:max_results], partial
@@ -9,7 +9,29 @@ This module defines the matching function used for searching tags.
 from __future__ import division
 
 
-def match(needle, haystack, smart_case):
+def prepare(haystack):
+    """To compute once the data about `haystack` needed by `match`.
+
+    Returns a tuple of three elements: `haystack` in lowercase, a byte string
+    with the same length of `haystack` where the i-th byte is "\\x01" if the
+    i-th character of `haystack` is at a word boundary ("\\x00" otherwise),
+    and whether `haystack` has only uppercase characters.
+    """
+    isupper = haystack.isupper()
+    # If `haystack` has only uppercase characters then it makes no sense
+    # to treat an uppercase letter as a word-boundary character
+    mask = []
+    prev = u"_"
+    for c in haystack:
+        if prev == u"_" or prev == u"-" or (not isupper and c.isupper()):
+            mask.append("\x01")
+        else:
+            mask.append("\x00")
+        prev = c
+    return haystack.lower(), "".join(mask), isupper
+
+
+def match(needle, haystack, smart_case, meta=None):
     """To search for `needle` in `haystack`.
 
     Returns a tuple of two elements: a number and another tuple.
@@ -19,13 +41,36 @@ def match(needle, haystack, smart_case):
 
     If there are multiple matches, the one with the best similarity value
     (the lowest value) is returned.
+
+    `meta` is the value returned by `prepare(haystack)`. It's computed on the
+    fly when not given.
     """
     if not needle:
         return -1, tuple()
 
-    # If `haystack` has only uppercase characters then it makes no sense
-    # to treat an uppercase letter as a word-boundary character
-    uppercase_is_word_boundary = not haystack.isupper()
+    best_positions = tuple()
+    best_similarity = -1
+
+    haystack_len = len(haystack)
+    for positions, boundaries_count in alignments(
+            needle, haystack, smart_case, meta):
+        s = similarity(haystack_len, positions, boundaries_count)
+        # NOTE: similarity values can be negative
+        if not best_positions or s < best_similarity:
+            best_similarity = s
+            best_positions = positions
+
+    return best_similarity, best_positions
+
+
+def alignments(needle, haystack, smart_case, meta=None):
+    """To generate all the possible matches of `needle` in `haystack`.
+
+    Each match is yielded as soon as it's found as a tuple of two elements:
+    the tuple of positions where the match occurs in `haystack` and the
+    number of these positions that are at word boundaries.
+    """
+    lower, mask, _ = meta or prepare(haystack)
 
     # `matchers` keep track of all possible matches of `needle`
     # along `haystack`
@@ -37,17 +82,15 @@ def match(needle, haystack, smart_case):
         "boundaries": [],  # e.g. [True,False,False,True,...]
     }]
 
-    best_positions = tuple()
-    best_similarity = -1
-
     needle_len = len(needle)
     haystack_len = len(haystack)
 
     for i, c in enumerate(haystack):
 
+        lc = lower[i]
         forks = []
         for matcher in matchers:
-            idx = matcher["consumed"].find(c.lower())
+            idx = matcher["consumed"].find(lc)
             if idx >= 0 and len(needle[idx:]) <= haystack_len - i:
                 forks.append({
                     "needle_idx": idx,
@@ -66,30 +109,19 @@ def match(needle, haystack, smart_case):
             if smart_case and needle[matcher["needle_idx"]].isupper():
                 cond = c == needle[matcher["needle_idx"]]
             else:
-                cond = c.lower() == needle[matcher["needle_idx"]].lower()
+                cond = lc == needle[matcher["needle_idx"]].lower()
 
             if cond:
 
-                if (i == 0 or (uppercase_is_word_boundary and c.isupper()) or
-                    (i > 0 and haystack[i-1] in ('-', '_'))):
-                    matcher["boundaries"].append(True)
-                else:
-                    matcher["boundaries"].append(False)
+                matcher["boundaries"].append(mask[i] == "\x01")
 
                 matcher["consumed"] += needle[matcher["needle_idx"]].lower()
                 matcher["positions"].append(i)
                 matcher["needle_idx"] += 1
 
                 if matcher["needle_idx"] == needle_len:
-
-                    s = similarity(haystack_len, matcher["positions"],
-                            len(filter(None, matcher["boundaries"])))
-
-                    if best_similarity < 0 or s < best_similarity:
-                        best_similarity = s
-                        best_positions = tuple(matcher["positions"])
-
-    return best_similarity, best_positions
+                    yield (tuple(matcher["positions"]),
+                           len(filter(None, matcher["boundaries"])))
 
 
 def similarity(haystack_len, positions, boundaries_count):
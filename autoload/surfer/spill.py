@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+surfer.spill
+~~~~~~~~~~~~
+
+This module defines the TagSpill class. This class keeps on disk the tags
+of the files evicted from memory when the tags take more memory than
+allowed (see `surfer.generator.TagsGenerator._enforce_budget`), and
+searches them without loading them back.
+
+Evicted tags are written in segments, one for each eviction, each of them
+an index file (see `surfer.mapped`). Tags of a file are searched in the
+spill until they are loaded back in memory (see `load`) or the file is no
+longer part of the search scope (see `drop`).
+
+This module doesn't depend on vim.
+"""
+
+import os
+import shutil
+import tempfile
+
+from surfer import mapped
+from surfer.search.ranking import result_key
+
+
+def _mtime(file):
+    """To return the modification time of `file`, or 0 if unknown."""
+    try:
+        return os.path.getmtime(file)
+    except OSError:
+        return 0
+
+
+class TagSpill:
+
+    def __init__(self):
+        self.directory = None
+        self.segments = []
+        # {file: segment holding the tags of the file}
+        self.files = {}
+
+    def __len__(self):
+        return len(self.files)
+
+    def __contains__(self, file):
+        return file in self.files
+
+    def add(self, tags):
+        """To write the given list of tags to a new segment. All the tags of
+        each file in `tags` must be given."""
+        if not tags:
+            return
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix="surfer")
+        fd, path = tempfile.mkstemp(dir=self.directory)
+        os.close(fd)
+        files = set(tag["file"] for tag in tags)
+        mapped.write(path, tags, dict((f, _mtime(f)) for f in files))
+        segment = mapped.MappedIndex(path)
+        self.segments.append(segment)
+        for file in files:
+            self.files[file] = segment
+
+    def load(self, file):
+        """To return the tags of `file` kept in the spill, without running
+        ctags again. None is returned when they are not in the spill or when
+        the file has been modified since they have been spilled. Tags stay
+        in the spill until `drop` is called."""
+        segment = self.files.get(file)
+        if segment is None or segment.mtimes[file] != _mtime(file):
+            return None
+        first, count = segment.ranges[file]
+        return [segment.tag(i) for i in xrange(first, first + count)]
+
+    def drop(self, file):
+        """To stop searching the tags of `file` in the spill. Segments are
+        deleted as soon as none of their files is searched."""
+        segment = self.files.pop(file, None)
+        if segment is not None and segment not in self.files.itervalues():
+            self._remove(segment)
+
+    def clear(self):
+        """To delete all segments."""
+        for segment in list(self.segments):
+            self._remove(segment)
+        self.files = {}
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+    def search(self, query, max_results, smart_case, kinds=(), paths=()):
+        """To find the spilled tags matching `query`, sorted by similarity.
+        See `surfer.mapped.MappedIndex.search` for the arguments."""
+        results = []
+        for segment in self.segments:
+            exclude = set(f for f in segment.files
+                          if self.files.get(f) is not segment)
+            results.extend(segment.search(query, max_results, smart_case,
+                                          exclude, kinds, paths))
+        results.sort(key=result_key)
+        if max_results >= 0:
+            results = results[:max_results]
+        return results
+
+    def memory(self):
+        """To return the number of spilled tags and the size of the spill on
+        disk in bytes."""
+        tags = sum(len(s) for s in self.segments)
+        size = sum(len(s.map) for s in self.segments)
+        return tags, size
+
+    def _remove(self, segment):
+        """To close and delete a single segment."""
+        self.segments.remove(segment)
+        segment.close()
+        try:
+            os.remove(segment.path)
+        except OSError:
+            pass
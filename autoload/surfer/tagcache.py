@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+surfer.tagcache
+~~~~~~~~~~~~~~~
+
+This module defines the TagCache class. This class stores on disk the tags
+generated for the content of files, so that ctags needs to run only for
+content it has never seen before: files that come back to an earlier state
+(e.g. when switching git branches) or copies of the same file in different
+places (e.g. vendored libraries) are tagged once.
+
+Entries are keyed by a hash of the content of a file and of the parameters
+ctags ran with (including the extension of the file, which determines its
+language), and don't depend on the rest of the file path. When the cache grows
+beyond its maximum size, least recently used entries are removed.
+
+A state file remembers the size of the cache and, for each file, its size,
+modification time and key, so that files that didn't change are not read
+and hashed again (see `file_key`).
+
+This module doesn't depend on vim.
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+
+from surfer.utils import fs
+
+
+class TagCache:
+
+    # when the maximum size is exceeded, entries are removed until the
+    # cache is this fraction of the maximum size, so that eviction doesn't
+    # happen at every new entry
+    low_watermark = 0.8
+
+    def __init__(self, directory, max_size):
+        # `max_size` is the maximum size of the cache in bytes
+        self.directory = directory
+        self.max_size = max_size
+        # read from the state file on first use, see `_load_state`
+        self.size = None
+        # {file: [size, modification time, params digest, key]}
+        self.files = None
+        self.dirty = False
+        # keys of the entries used since the cache has been opened
+        self.touched = set()
+
+    def key(self, content, params):
+        """To return the key for tags generated for `content` (a byte string)
+        with the given `params` (a byte string, e.g. the ctags program and
+        arguments)."""
+        h = hashlib.sha1(params)
+        h.update("\0")
+        h.update(content)
+        return h.hexdigest()
+
+    def file_key(self, file, params):
+        """To return the key for tags generated for the content of `file` on
+        disk with the given `params`, or None if the file can't be read.
+
+        The file is read only when its size or modification time changed
+        since the last time its key has been computed."""
+        self._load_state()
+        try:
+            st = os.stat(file)
+        except OSError:
+            return None
+        digest = hashlib.sha1(params).hexdigest()
+        known = self.files.get(file)
+        if known is not None and known[:3] == [st.st_size, st.st_mtime, digest]:
+            return known[3]
+        try:
+            with open(file, "rb") as f:
+                key = self.key(f.read(), params)
+        except IOError:
+            return None
+        self.files[file] = [st.st_size, st.st_mtime, digest, key]
+        self.dirty = True
+        return key
+
+    def get(self, key, file):
+        """To return the tags stored with `key`, as tags of `file`, or None
+        if there are none."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                entries = json.loads(f.read())
+        except (IOError, ValueError):
+            return None
+        # the modification time of an entry is its last use, updated once
+        # for each session
+        if key not in self.touched:
+            self.touched.add(key)
+            try:
+                os.utime(path, None)
+            except OSError:
+                pass
+        return [{"name": name, "file": file, "cmd": cmd, "exts": exts}
+                for name, cmd, exts in entries]
+
+    def put(self, key, tags):
+        """To store `tags` with `key`."""
+        data = json.dumps([(t["name"], t["cmd"], t["exts"]) for t in tags],
+                          separators=(",", ":"))
+        path = self._path(key)
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            fs.replace(tmp, path)
+        except (IOError, OSError):
+            return
+        self._load_state()
+        if self.size is None:
+            self.size = self._disk_usage()
+        else:
+            self.size += len(data) - replaced
+        self.dirty = True
+        if self.size > self.max_size:
+            self.evict()
+
+    def save(self):
+        """To write the state file, if the state changed."""
+        if not self.dirty:
+            return
+        data = json.dumps({"size": self.size, "files": self.files},
+                          separators=(",", ":"))
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            fd, tmp = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            fs.replace(tmp, self._state_path())
+        except (IOError, OSError):
+            return
+        self.dirty = False
+
+    def evict(self):
+        """To remove least recently used entries until the cache is below
+        its maximum size."""
+        entries = sorted(self._entries())
+        self.size = sum(size for _, size, _ in entries)
+        target = self.max_size * self.low_watermark
+        removed = set()
+        for _, size, path in entries:
+            if self.size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.size -= size
+            removed.add(os.path.basename(path))
+        self._load_state()
+        for file, known in self.files.items():
+            if known[3] in removed:
+                del self.files[file]
+        self.dirty = True
+
+    def _path(self, key):
+        """To return the path of the entry with `key`."""
+        return os.path.join(self.directory, key[:2], key)
+
+    def _load_state(self):
+        """To read the state file, the first time the state is needed."""
+        if self.files is not None:
+            return
+        self.files = {}
+        try:
+            with open(self._state_path(), "rb") as f:
+                state = json.loads(f.read())
+            self.size = int(state["size"])
+            self.files = dict(state["files"])
+        except (IOError, ValueError, KeyError, TypeError):
+            pass
+
+    def _state_path(self):
+        """To return the path of the state file."""
+        return os.path.join(self.directory, "state")
+
+    def _entries(self):
+        """To return a list of tuples (last use, size, path) for all the
+        entries of the cache."""
+        entries = []
+        for root, _, names in os.walk(self.directory):
+            if root == self.directory:
+                # the state file and temporary files, not entries
+                continue
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _disk_usage(self):
+        """To return the size of the cache in bytes."""
+        return sum(size for _, size, _ in self._entries())
@@ -17,6 +17,8 @@ from surfer.utils import v
 from surfer.utils import misc
 from surfer.utils import input
 from surfer.utils import settings
+from surfer.utils.trace import Trace
+from surfer.utils.profiler import timed
 from surfer import exceptions as ex
 
 
@@ -27,7 +29,9 @@ class UserInterface:
         self.name = '__surfer__'
         self.renderer = Renderer(plug)
         self.BufInfo = namedtuple("BufInfo", "name nr winnr")
-        self.setup_colors()
+        # highlight groups are (re)defined only when the user interface
+        # is opened (see `setup_colors`)
+        self.colors_outdated = True
         self._reset()
 
     def setup_colors(self):
@@ -50,6 +54,8 @@ class UserInterface:
                 link = "" if "=" in color else "link"
                 v.exe(u"hi {} SurferVisualKind_{} {}".format(link, kind, color))
 
+        self.colors_outdated = False
+
     def open(self):
         """To open the Surfer user interface."""
         # The Fugitive plugin seems to interfere with Surfer since it adds
@@ -60,9 +66,10 @@ class UserInterface:
         # seems to fix the issue.
         v.exe("exe 'set tags='.&tags")
 
+        if self.colors_outdated:
+            self.setup_colors()
+
         self.user_buf = self.BufInfo(v.bufname(), v.bufnr(), v.winnr())
-        pmod = settings.get("project_search_modifier")
-        bmod = settings.get("buffer_search_modifier")
 
         prompt = u"echohl SurferPrompt | echon \"{}\" | echohl None".format(
             settings.get("prompt"))
@@ -72,78 +79,163 @@ class UserInterface:
         v.redraw()
 
         # Start the input loop
-        key = input.Input()
+        trace = self._start_trace()
+        key = input.Input(trace)
+        try:
+            self._loop(key, prompt)
+        finally:
+            if trace is not None:
+                trace.close(**self._trace_meta())
+
+    def _loop(self, key, prompt):
+        """To handle keys pressed by the user until the Surfer window is
+        closed."""
         while True:
 
-            self.perform_new_search = True
-
             # Display the prompt and the current query
             v.exe(prompt)
             query = self.query.replace("\\", "\\\\").replace('"', '\\"')
             v.exe(u"echon \"{}\"".format(query))
+            if self.search_partial:
+                msg = settings.get("partial_results_msg")
+                msg = msg.replace("\\", "\\\\").replace('"', '\\"')
+                v.exe(u"echohl SurferShade | echon \"{}\" | echohl None"
+                      .format(msg))
 
             # Wait for the next pressed key
             key.get()
 
-            # Go to the tag on the current line
-            if (key.RETURN or key.CTRL and key.CHAR in ('g', 'o', 'p', 's')):
-                mode = key.CHAR if key.CHAR in ('s', 'p') else ''
-                tag = self.mapper.get(self.cursor_pos)
-                if tag:
-                    self._jump_to(tag, mode)
+            with timed("keystroke"):
+
+                done = self._handle_key(key)
+
+                # Coalesce typeahead: when the user types or pastes quickly,
+                # consume all the keys already available before searching so
+                # that stale intermediate queries are never processed.
+                while not done and key.get(wait=False):
+                    done = self._handle_key(key)
+
+                if done:
                     break
 
-            # Close the Surfer window
-            elif key.ESC or key.INTERRUPT:
-                self._close()
-                break
-
-            # Delete a character backward
-            elif key.BS:
-                query = self.query.strip()
-                if query and query in (bmod, pmod):
-                    self.plug.generator.rebuild_tags = True
-                self.query = u"{}".format(self.query)[:-1]
-                self.cursor_pos = -1  # move the cursor to the bottom
-
-            # Move the cursor up
-            elif key.UP or key.TAB or key.CTRL and key.CHAR == 'k':
-                self.perform_new_search = False
-                if self.cursor_pos == 0:
-                    self.cursor_pos = len(v.buffer()) - 1
-                else:
-                    self.cursor_pos -= 1
-
-            # Move the cursor down
-            elif key.DOWN or key.CTRL and key.CHAR == 'j':
-                self.perform_new_search = False
-                if self.cursor_pos == len(v.buffer()) - 1:
-                    self.cursor_pos = 0
-                else:
-                    self.cursor_pos += 1
-
-            # Clear the current search
-            elif key.CTRL and key.CHAR == 'u':
-                query = self.query.lstrip()
-                if query and query[0] in (bmod, pmod):
-                        self.query = query[0]
-                else:
-                    self.query = u""
-                self.cursor_pos = -1  # move the cursor to the bottom
-
-            # A character has been pressed.
-            elif key.CHAR:
-                self.query += key.CHAR
-                self.cursor_pos = -1  # move the cursor to the bottom
-                if key.CHAR in (pmod, bmod) and len(self.query.strip()) == 1:
-                    self.plug.generator.rebuild_tags = True
+                if self.perform_new_search:
+                    self._search(interrupt=key.pending)
+
+                # When other keys arrived while searching, the results are
+                # already stale and there is no point in rendering them.
+                if not key.pending():
+                    if self.perform_render:
+                        self._render()
+                    v.redraw()
+
+    def _start_trace(self):
+        """To start recording the keys pressed by the user in the file
+        `g:surfer_trace_file`, if set (see `surfer.utils.trace`)."""
+        path = settings.get("trace_file")
+        if not path:
+            return None
+        try:
+            return Trace(os.path.expanduser(path),
+                         root=self.plug.project.get_root(),
+                         buffer=self.user_buf.name, **self._trace_meta())
+        except IOError as e:
+            v.echo(u"cannot record the trace: {}".format(e), "WarningMsg")
+            return None
+
+    def _trace_meta(self):
+        """To return the size of the current search scope, as recorded in
+        traces."""
+        return {"tags": len(self.plug.generator.all_tags()),
+                "files": len(self.plug.generator.cached_files)}
+
+    def _handle_key(self, key):
+        """To update the user interface state according to the pressed key.
+
+        Returns True when the Surfer window has been closed.
+        """
+        mods = settings.get_many("project_search_modifier",
+            "buffer_search_modifier", "workspace_search_modifier",
+            "directory_search_modifier")
+        pmod = mods["project_search_modifier"]
+        bmod = mods["buffer_search_modifier"]
+        wmod = mods["workspace_search_modifier"]
+        dmod = mods["directory_search_modifier"]
+
+        # Go to the tag on the current line
+        if (key.RETURN or key.CTRL and key.CHAR in ('g', 'o', 'p', 's')):
+            self._update()
+            mode = key.CHAR if key.CHAR in ('s', 'p') else ''
+            tag = self.mapper.get(self.cursor_pos)
+            if tag:
+                self._jump_to(tag, mode)
+                return True
+
+        # Close the Surfer window
+        elif key.ESC or key.INTERRUPT:
+            self._close()
+            return True
+
+        # Delete a character backward
+        elif key.BS:
+            query = self.query.strip()
+            if query and query in (bmod, pmod, wmod, dmod):
+                self.plug.generator.invalidate()
+            self.query = u"{}".format(self.query)[:-1]
+            self.cursor_pos = -1  # move the cursor to the bottom
+            self.perform_new_search = self.perform_render = True
+
+        # Move the cursor up, scrolling when on the first line
+        elif key.UP or key.TAB or key.CTRL and key.CHAR == 'k':
+            self._update()
+            if self.cursor_pos == 0:
+                if not self._scroll(1):
+                    self.offset = 0
+                    self.cursor_pos = -1  # move the cursor to the bottom
+            else:
+                self.cursor_pos -= 1
+            self.perform_render = True
 
+        # Move the cursor down, scrolling when on the last line
+        elif key.DOWN or key.CTRL and key.CHAR == 'j':
+            self._update()
+            if self.cursor_pos == len(v.buffer()) - 1:
+                if not self._scroll(-1):
+                    self.cursor_pos = 0
             else:
-                v.redraw()
-                continue
+                self.cursor_pos += 1
+            self.perform_render = True
+
+        # Scroll up or down a whole page
+        elif key.PAGEUP or key.CTRL and key.CHAR == 'b':
+            self._update()
+            self._scroll(self._height())
+            self.perform_render = True
 
+        elif key.PAGEDOWN or key.CTRL and key.CHAR == 'f':
             self._update()
-            v.redraw()
+            self._scroll(-self._height())
+            self.perform_render = True
+
+        # Clear the current search
+        elif key.CTRL and key.CHAR == 'u':
+            query = self.query.lstrip()
+            if query and query[0] in (bmod, pmod, wmod, dmod):
+                    self.query = query[0]
+            else:
+                self.query = u""
+            self.cursor_pos = -1  # move the cursor to the bottom
+            self.perform_new_search = self.perform_render = True
+
+        # A character has been pressed.
+        elif key.CHAR:
+            self.query += key.CHAR
+            self.cursor_pos = -1  # move the cursor to the bottom
+            if (key.CHAR in (pmod, bmod, wmod, dmod) and
+                    len(self.query.strip()) == 1):
+                self.plug.generator.invalidate()
+            self.perform_new_search = self.perform_render = True
+
+        return False
 
     def _open_window(self):
         """To open the Surfer window if not already visible."""
@@ -173,13 +265,21 @@ class UserInterface:
         self.cursor_pos = -1  # line index in the finder window
         self.exit_cmds = []
         self.search_results_cache = []
-        self.perform_new_search = True
+        self.search_error = ""
+        # whether the search has been cut short by the search time budget
+        self.search_partial = False
+        # maximum number of results asked to the finder for the current query
+        # and index of the result on the last line of the window
+        self.search_limit = 0
+        self.offset = 0
+        self.perform_new_search = False
+        self.perform_render = False
 
     def _setup_buffer(self):
         """To set sane options for the search results buffer."""
         last_search = ""
         if v.eval("@/"):
-            last_search = v.eval("@/").decode(v.encoding()).replace(u'"', u'\\"')
+            last_search = v.decode(v.eval("@/")).replace(u'"', u'\\"')
         self.exit_cmds.extend([
             u"let @/=\"{}\"".format(last_search),
             u"set laststatus={}".format(v.opt("ls")),
@@ -211,24 +311,93 @@ class UserInterface:
             v.exe(cmd)
 
     def _update(self):
-        """To update search results."""
-        tags = []
-        error = ""
+        """To bring search results and the Surfer window up to date with
+        the current query."""
         if self.perform_new_search:
+            self._search()
+        if self.perform_render:
+            self._render()
+
+    def _search(self, interrupt=None):
+        """To search tags for the current query.
+
+        See `TagsFinder.find_tags` for the meaning of `interrupt`.
+        """
+        self.search_results_cache = []
+        self.search_error = ""
+        self.search_partial = False
+        self.offset = 0
+        self.search_limit = settings.get('max_results', int)
+        try:
+            self.search_results_cache = self.plug.finder.find_tags(
+                self.query, self.search_limit, self.user_buf.name, interrupt)
+            self.search_partial = self.plug.finder.partial
+        except ex.SearchInterrupted:
+            # The user typed another key: the search will be performed
+            # again with the updated query.
+            return
+        except ex.SurferException as e:
+            self.search_error = e.message
+        self.perform_new_search = False
+        self.perform_render = True
+
+    def _fetch(self, count):
+        """To make sure that at least `count` search results are available,
+        if there are that many.
+
+        Only `g:surfer_max_results` results are searched at first. Further
+        results are asked to the finder only when the user scrolls past
+        them, doubling the limit each time so that browsing many results
+        takes just a few searches. When the results have been cut short by
+        `g:surfer_search_time_budget` there may be more of them: they are
+        asked again, this time scanning all tags.
+        """
+        while (self.search_limit > 0 and
+               len(self.search_results_cache) < count and
+               (self.search_partial or
+                len(self.search_results_cache) == self.search_limit)):
+            if len(self.search_results_cache) == self.search_limit:
+                self.search_limit = max(count, 2 * self.search_limit)
             try:
-                max_results = settings.get('max_results', int)
-                tags = self.plug.finder.find_tags(
-                    self.query, max_results, self.user_buf.name)
-                self.search_results_cache = tags
+                self.search_results_cache = self.plug.finder.find_tags(
+                    self.query, self.search_limit, self.user_buf.name,
+                    complete=True)
             except ex.SurferException as e:
-                error = e.message
-        else:
-            tags = self.search_results_cache
-
+                self.search_error = e.message
+                return
+            self.search_partial = False
+
+    def _scroll(self, lines):
+        """To scroll search results by `lines` lines, towards worse results
+        when `lines` is positive. Returns False when there is nothing to
+        scroll."""
+        height = self._height()
+        offset = max(0, self.offset + lines)
+        self._fetch(offset + height)
+        offset = max(0, min(offset, len(self.search_results_cache) - height))
+        scrolled = offset != self.offset
+        self.offset = offset
+        return scrolled
+
+    def _height(self):
+        """To return the number of search results shown at once."""
+        max_results = settings.get('max_results', int)
+        if max_results > 0:
+            return max_results
+        return len(self.search_results_cache)
+
+    def _render(self):
+        """To render the latest search results. Only the results visible in
+        the Surfer window are rendered, however many have been found."""
+        error = self.search_error
+        visible = self.search_results_cache[
+            self.offset:self.offset+self._height()]
         self.mapper, self.cursor_pos = self.renderer.render(
-                self.winnr, self.cursor_pos, self.query, tags,
-                msg=error, iserror=bool(error))
+                self.winnr, self.cursor_pos, self.query,
+                visible, msg=error, iserror=bool(error))
+        self.perform_render = False
 
+    @timed("jump")
     def _jump_to(self, tag, mode=""):
         """To jump to the tag on the current line."""
         hidden = v.opt("hidden")
@@ -249,10 +418,14 @@ class UserInterface:
         The number retruned is meant to be used in conjunction with the :tag
         vim command (see :h :tag)
         """
-        enc = v.encoding()
         candidates = v.call(u'taglist("{}")'.format(tag["name"]))
+        if not any(v.path(c["filename"]) == tag["file"] for c in candidates):
+            # tags found by the tags daemon or in an index file are not in
+            # any tagfile known to vim
+            self.plug.generator.write_jump_tagfile(tag)
+            candidates = v.call(u'taglist("{}")'.format(tag["name"]))
         if len(candidates) == 1:
-            return 1, candidates[0]["filename"].decode(enc)
+            return 1, v.path(candidates[0]["filename"])
 
         #  group tags by file name
         groups = []
@@ -266,25 +439,25 @@ class UserInterface:
         ordered_candidates = []
         for fname, tags in groups:
             sorted_tags = sorted(tags, key=itemgetter("line"))
-            if fname.decode(enc) == v.bufname():
+            if v.path(fname) == v.bufname():
                 ordered_candidates = sorted_tags + ordered_candidates
             else:
                 ordered_candidates.extend(sorted_tags)
 
-        files = [c["filename"].decode(enc) for c in ordered_candidates]
+        files = [v.path(c["filename"]) for c in ordered_candidates]
         scores = [0]*len(ordered_candidates)
         for i, candidate in enumerate(ordered_candidates):
-            if candidate["cmd"].decode(enc) == tag["cmd"]:
+            if v.decode(candidate["cmd"]) == tag["cmd"]:
                 scores[i] += 1
-            if candidate["name"].decode(enc) == tag["name"]:
+            if v.decode(candidate["name"]) == tag["name"]:
                 scores[i] += 1
-            if candidate["filename"].decode(enc) == tag["file"]:
+            if v.path(candidate["filename"]) == tag["file"]:
                 scores[i] += 1
-            if candidate["line"].decode(enc) == tag["exts"].get("line"):
+            if v.decode(candidate["line"]) == tag["exts"].get("line"):
                 scores[i] += 1
-            if candidate["kind"].decode(enc) == tag["exts"].get("kind"):
+            if v.decode(candidate["kind"]) == tag["exts"].get("kind"):
                 scores[i] += 1
-            if candidate["language"].decode(enc) == tag["exts"].get("language"):
+            if v.decode(candidate["language"]) == tag["exts"].get("language"):
                 scores[i] += 1
 
         idx = scores.index(max(scores))
@@ -296,15 +469,25 @@ class Renderer:
     def __init__(self, plug):
         self.plug = plug
         self.formatter = Formatter(plug)
+        self.opts = {}
 
+    @timed("render")
     def render(self, target_win, cursor_pos, query, tags, msg="", iserror=False):
-        """To render all search results."""
+        """To render the given search results, one per line. The best
+        result goes on the last line."""
         v.exe('syntax clear')
         v.focus_win(target_win)
         mapper = {}
 
+        # Options are read all at once, not for every rendered line
+        self.opts = settings.get_many("no_results_msg", "visual_kinds",
+            "visual_kinds_shape", "visual_kinds_colors", "debug",
+            "line_format", "current_line_indicator",
+            visual_kinds=bool, debug=int)
+        self.formatter.setup()
+
         if not tags and not msg:
-            msg = settings.get("no_results_msg")
+            msg = self.opts["no_results_msg"]
 
         if msg:
 
@@ -317,17 +500,9 @@ class Renderer:
 
         else:
 
-            # Find duplicates file names
-            dups = {}
-            for _, g in groupby(tags, key=lambda t: os.path.basename(t["file"])):
-                # s is a set of unique paths but with the same basename
-                s = set(t["file"] for t in g)
-                if len(s) > 1:
-                    dups.update((file, True) for file in s)
-
             tags = tags[::-1]
             mapper = dict(enumerate(t for t in tags))
-            v.setbuffer([self._render_line(t, query, dups) for t in tags])
+            v.setbuffer([self._render_line(t, query) for t in tags])
             cursor_pos = self._render_curr_line(cursor_pos)
             self._highlight_tags(tags, cursor_pos)
             v.setwinh(len(tags))
@@ -337,18 +512,17 @@ class Renderer:
 
         return mapper, cursor_pos
 
-    def _render_line(self, tag, query, dups_fnames):
+    def _render_line(self, tag, query):
         """To format a single line with the tag information."""
         visual_kind = u""
-        if settings.get("visual_kinds", bool):
-            visual_kind = settings.get("visual_kinds_shape")
-        debug = settings.get("debug", int)
-        line_format = settings.get("line_format")
+        if self.opts["visual_kinds"]:
+            visual_kind = self.opts["visual_kinds_shape"]
+        line_format = self.opts["line_format"]
         return u"{}{}{}{}{}".format(
-            u" "*len(settings.get("current_line_indicator")),
+            u" "*len(self.opts["current_line_indicator"]),
             visual_kind, tag["name"],
-            u"".join(self.formatter.fmt(fmtstr, tag, dups_fnames) for fmtstr in line_format),
-            u" [{}]".format(tag["similarity"]) if debug else "")
+            u"".join(self.formatter.fmt(fmtstr, tag) for fmtstr in line_format),
+            u" [{}]".format(tag["similarity"]) if self.opts["debug"] else "")
 
     def _render_curr_line(self, cursor_pos):
         """To add an indicator in front of the current line."""
@@ -356,7 +530,7 @@ class Renderer:
             cursor_pos = len(v.buffer()) - 1
 
         line = v.getline(cursor_pos)
-        indicator = settings.get("current_line_indicator")
+        indicator = self.opts["current_line_indicator"]
         v.setline(cursor_pos, indicator + line[len(indicator):])
 
         return cursor_pos
@@ -365,11 +539,13 @@ class Renderer:
         """To highlight the content of the Surfer window as error."""
         v.highlight("SurferError", ".*")
 
+    @timed("highlight")
     def _highlight_tags(self, tags, curr_line):
         """To highlight search results."""
-        vk_colors = settings.get("visual_kinds_colors")
-        vk_shape = settings.get("visual_kinds_shape")
-        indicator = settings.get("current_line_indicator")
+        vk_colors = self.opts["visual_kinds_colors"]
+        vk_shape = self.opts["visual_kinds_shape"]
+        indicator = self.opts["current_line_indicator"]
+        highlights = []
 
         for i, tag in enumerate(tags):
 
@@ -378,35 +554,51 @@ class Renderer:
             else:
                 offset = len(indicator)
 
-            if settings.get("visual_kinds", bool):
+            if self.opts["visual_kinds"]:
                 offset += len(vk_shape.encode(v.encoding()))
                 kind = tag["exts"].get("kind")
                 if kind in vk_colors:
                     patt = u"\c\%{}l{}".format(i+1, vk_shape.replace(u"u",u"%u"))
-                    v.highlight("SurferVisualKind_" + kind, patt)
+                    highlights.append(("SurferVisualKind_" + kind, patt))
 
             patt = u"\c\%{}l\%{}c.*".format(i+1, offset+len(tag["name"])+1)
-            v.highlight("SurferShade", patt)
+            highlights.append(("SurferShade", patt))
 
             for pos in misc.as_byte_indexes(tag["match_positions"], tag["name"]):
 
                 patt = u"\c\%{}l\%{}c.".format(i+1, offset+pos+1)
-                v.highlight("SurferMatches", patt)
+                highlights.append(("SurferMatches", patt))
+
+        v.highlight_many(highlights)
 
 
 class Formatter:
 
     def __init__(self, plug):
         self.plug = plug
-
-    def fmt(self, fmtstr, tag, dups_fnames):
+        self.opts = {}
+        self.root = u""
+        self.roots = []
+        self.paths = None
+
+    def setup(self):
+        """To read the options used for formatting. This needs to be done
+        once before formatting a batch of tags."""
+        self.opts = settings.get_many("tag_file_relative_to_project_root",
+            "tag_file_custom_depth",
+            tag_file_relative_to_project_root=bool, tag_file_custom_depth=int)
+        self.root = self.plug.project.get_root()
+        self.roots = self.plug.project.workspace_roots()
+        self.paths = self.plug.project.short_paths
+
+    def fmt(self, fmtstr, tag):
         """Replace the attribute in `fmtdtr` with its value."""
         if u"{name}" in fmtstr:
             return fmtstr.replace(u"{name}", tag["name"])
         if u"{cmd}" in fmtstr:
             return fmtstr.replace(u"{cmd}", tag["cmd"])
         if u"{file}" in fmtstr:
-            return fmtstr.replace(u"{file}", self._fmt_file(tag, dups_fnames))
+            return fmtstr.replace(u"{file}", self._fmt_file(tag))
         if u"{line}" in fmtstr:
             ln = self._get_linenr(tag)
             if ln:
@@ -418,36 +610,36 @@ class Formatter:
         except KeyError:
             return u""
 
-    def _fmt_file(self, tag, dups_fnames):
+    def _fmt_file(self, tag):
         """Format tag file."""
-        pmod = settings.get("project_search_modifier")
-        bmod = settings.get("buffer_search_modifier")
-
         file = tag["file"]
-        root = self.plug.project.get_root()
+        root = self.root
 
         # The user always wants the tag file displayed relative to the
         # current project root if it exists. Replacing the home with
         # '~' may be needed for files outside the current project that
         # are printed with the absolute path.
-        if settings.get("tag_file_relative_to_project_root", bool):
+        if self.opts["tag_file_relative_to_project_root"]:
+            if root and not file.startswith(root + os.path.sep):
+                # files of other projects of the workspace are displayed
+                # along with the name of their project
+                for r in self.roots:
+                    if file.startswith(r + os.path.sep):
+                        return file[len(os.path.dirname(r)):].lstrip(os.path.sep)
             if root:
                 f = file.replace(root, u"").replace(os.path.expanduser("~"), u"~")
                 return f[1:] if f.startswith(os.path.sep) else f
 
         # If the `g:surfer_tag_file_custom_depth` is set,
         # cut the path according its value
-        depth = settings.get("tag_file_custom_depth", int)
+        depth = self.opts["tag_file_custom_depth"]
         if depth > 0:
             return os.path.join(*file.split(os.path.sep)[-depth:])
 
-        # If th file name is duplicate in among search results
-        # then display also the container directory
-        if file in dups_fnames and len(file.split(os.path.sep)) > 1:
-            return os.path.join(*file.split(os.path.sep)[-2:])
-
-        # By default display only the file name
-        return os.path.basename(file)
+        # By default display only the file name, along with as many parent
+        # directories as needed to tell it apart from other files with the
+        # same name (see `surfer.index.ShortPaths`)
+        return self.paths.get(file)
 
     def _get_linenr(self, tag):
         """Get line number if available."""
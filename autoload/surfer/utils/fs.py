@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+"""
+surfer.utils.fs
+~~~~~~~~~~~~~~~
+
+This module defines file system utilities.
+
+This module doesn't depend on vim.
+"""
+
+import os
+
+
+def replace(src, dst):
+    """To rename the file `src` to `dst`, replacing `dst` if it exists.
+
+    On MS Windows renaming fails when `dst` exists, so it's removed first:
+    the replacement is not atomic there.
+    """
+    if os.name == "nt" and os.path.exists(dst):
+        os.remove(dst)
+    os.rename(src, dst)
@@ -12,7 +12,9 @@ from surfer.utils import v
 
 class Input:
 
-    def __init__(self):
+    def __init__(self, trace=None):
+        # keys read are recorded in `trace`, if given (see `surfer.utils.trace`)
+        self.trace = trace
         self._reset()
 
     def _reset(self):
@@ -20,28 +22,46 @@ class Input:
         self.LEFT = self.RIGHT = self.UP = self.DOWN = None
         self.RETURN = self.ESC = self.TAB = self.CTRL = self.BS = None
         self.INTERRUPT = self.MOUSE = self.MAC_CMD = None
+        self.PAGEUP = self.PAGEDOWN = None
         self.CHAR = ""
         self.F1 = self.F2 = self.F3 = self.F4 = self.F5 = self.F6 = None
         self.F7 = self.F8 = self.F9 = self.F10 = self.F11 = self.F12 = None
 
-    def _nr2char(self, nr):
-        return v.call("nr2char({})".format(nr))
+    def pending(self):
+        """To check whether the user has already typed other keys that
+        haven't been read yet. No key is consumed."""
+        return v.eval("getchar(1)") != "0"
 
-    def get(self):
-        """To read a key pressed by the user."""
+    def get(self, wait=True):
+        """To read a key pressed by the user.
+
+        When `wait` is False, only keys already in the typeahead buffer are
+        read. Returns False if no key is available, True otherwise.
+        """
         self._reset()
 
         try:
-            raw_char = v.call('strtrans(getchar())')
+            # A single round-trip to Vim: `getchar()` returns a number for
+            # ordinary characters and a string for special keys.
+            raw_char = v.eval('getchar({})'.format("" if wait else 0))
         except KeyboardInterrupt:
             # This exception is triggered only on Windows when the user
             # press CTRL+C
             self.CHAR = 'c'
             self.CTRL = True
             self.INTERRUPT = True
-            return
+            if self.trace is not None:
+                self.trace.key("3", not wait)
+            return True
+
+        if not wait and raw_char == "0":
+            # `getchar(0)` returns 0 when there is no key to read
+            return False
+
+        if self.trace is not None:
+            self.trace.key(raw_char, not wait)
 
-        nr = v.call(u"str2nr('{}')".format(raw_char))
+        nr = int(raw_char) if raw_char.isdigit() else 0
         # `nr` == 0 when the user press backspace, an arrow key, F*, etc
 
         if nr != 0:
@@ -54,11 +74,11 @@ class Input:
                 self.TAB = True
             elif 1 <= nr <= 26:
                 self.CTRL = True
-                self.CHAR = self._nr2char(nr+96)
+                self.CHAR = self._char(nr+96)
                 if self.CHAR == 'c':
                     self.INTERRUPT = True
             else:
-                self.CHAR = self._nr2char(nr)
+                self.CHAR = self._char(nr)
 
         else:
 
@@ -72,6 +92,10 @@ class Input:
                 self.DOWN = True
             elif 'kb' in raw_char:
                 self.BS = True
+            elif 'kP' in raw_char:
+                self.PAGEUP = True
+            elif 'kN' in raw_char:
+                self.PAGEDOWN = True
             elif 'k1' in raw_char:
                 self.F1 = True
             elif 'k2' in raw_char:
@@ -100,3 +124,21 @@ class Input:
                 # mouse clicks or scrolls
                 self.MOUSE = True
 
+        return True
+
+    def _char(self, nr):
+        """To return the character whose number is `nr`, as returned by
+        `getchar()`.
+
+        The number is a code point only when 'encoding' is utf-8 or latin1,
+        and the character can be built without asking Vim. With any other
+        encoding, `nr` is the character value in that encoding.
+        """
+        if v.encoding() in ("utf-8", "latin1"):
+            try:
+                return unichr(nr)
+            except ValueError:
+                # narrow Python builds can't represent characters above
+                # U+FFFF with `unichr`, but vim can
+                pass
+        return v.decode(v.eval(u"nr2char({})".format(nr)))
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+surfer.utils.memprof
+~~~~~~~~~~~~~~~~~~~~
+
+This module defines utilities for measuring the memory taken by Surfer data
+structures and the memory allocated while generating tags and searching.
+
+Allocations are measured with `tracemalloc` when it's available (e.g. with
+a Python patched for pytracemalloc), otherwise through the resident set size
+of the process, which also accounts for memory allocated by Vim and is less
+precise. Measuring allocations slows Surfer down, so it's disabled unless
+`enabled` is set.
+
+This module doesn't depend on vim.
+"""
+
+import os
+import sys
+from functools import wraps
+from collections import defaultdict, deque
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+# Whether allocations are measured (see `measured`)
+enabled = False
+
+# Only the most recent samples are kept for each stage
+MAX_SAMPLES = 100
+
+# Number of allocation sites reported for each sample, with tracemalloc
+TOP_SITES = 5
+
+_samples = defaultdict(lambda: deque(maxlen=MAX_SAMPLES))
+_counts = defaultdict(int)
+
+
+class measured:
+    """To measure the memory allocated in a stage, when `enabled`.
+
+    As `surfer.utils.profiler.timed`, this class can be used either as a
+    context manager or as a decorator:
+
+        with measured("find"):
+            ...
+
+        @measured("build_tags")
+        def _build_tags(...):
+            ...
+    """
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.before = None
+
+    def __enter__(self):
+        if not enabled:
+            self.before = None
+        elif tracemalloc is not None:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            self.before = tracemalloc.take_snapshot()
+        else:
+            self.before = rss()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.before is None:
+            return
+        if tracemalloc is not None:
+            diff = tracemalloc.take_snapshot().compare_to(self.before, "lineno")
+            delta = sum(stat.size_diff for stat in diff)
+            sites = [str(stat) for stat in diff[:TOP_SITES]]
+        else:
+            delta, sites = rss() - self.before, []
+        record(self.stage, delta, sites)
+
+    def __call__(self, fn):
+        stage = self.stage
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with measured(stage):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+
+def record(stage, delta, sites=()):
+    """To record that the stage `stage` allocated `delta` bytes. `sites`
+    is a list of descriptions of the main allocation sites."""
+    _samples[stage].append((delta, list(sites)))
+    _counts[stage] += 1
+
+
+def reset():
+    """To discard all the collected samples."""
+    _samples.clear()
+    _counts.clear()
+
+
+def stats():
+    """To return allocation statistics for each stage.
+
+    Returns a list of tuples of the form:
+
+        (stage, count, last, max, sites)
+
+    where `count` is the number of times the stage has been measured,
+    `last` and `max` are the bytes allocated by the last and by the largest
+    of the most recent `MAX_SAMPLES` executions, and `sites` the allocation
+    sites of the last execution.
+    """
+    rows = []
+    for stage in sorted(_samples):
+        samples = _samples[stage]
+        rows.append((stage, _counts[stage], samples[-1][0],
+                     max(delta for delta, _ in samples), samples[-1][1]))
+    return rows
+
+
+def rss():
+    """To return the resident set size of the process in bytes, or 0 if
+    unknown."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    # peak, rather than current, resident set size: kilobytes on Linux,
+    # bytes on OS X
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage if sys.platform == "darwin" else usage * 1024
+
+
+def deep_size(obj, seen=None):
+    """To return the memory taken by `obj` and by all the containers and
+    strings it references, in bytes. Objects whose id is in `seen` are not
+    counted; ids of counted objects are added to `seen`."""
+    if seen is None:
+        seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.iterkeys())
+            stack.extend(obj.itervalues())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+    return size
+
+
+def sample_size(items, sample=2000):
+    """To estimate the memory taken by the items of the list `items`
+    (see `deep_size`) by measuring at most `sample` of them. Objects shared
+    among items are counted once. Returns the total size in bytes."""
+    if not items:
+        return 0
+    step = max(1, len(items) // sample)
+    picked = items[::step]
+    seen = set()
+    size = sum(deep_size(item, seen) for item in picked)
+    return size * len(items) // len(picked)
+
+
+def interning_savings(strings):
+    """To return an estimate of the memory, in bytes, that would be saved
+    by sharing a single object among all equal strings in `strings`."""
+    first = {}
+    savings = 0
+    for s in strings:
+        obj = first.setdefault(s, s)
+        if obj is not s:
+            savings += sys.getsizeof(s)
+    return savings
+
+
+def report(structures):
+    """To return a human readable report as a list of lines.
+
+    `structures` is a list of tuples (name, count, bytes) describing the
+    memory taken by data structures. Allocations statistics (see `stats`)
+    follow, when collected.
+    """
+    fmt = u"{:<20} {:>10} {:>10} {:>12}"
+    lines = [fmt.format(u"structure", u"count", u"MB", u"bytes/item")]
+    for name, count, size in structures:
+        lines.append(fmt.format(name, count, u"{:.2f}".format(size / 1048576.0),
+            u"{:.0f}".format(float(size) / count) if count else u"-"))
+
+    rows = stats()
+    if rows:
+        method = u"tracemalloc" if tracemalloc is not None else u"rss"
+        fmt = u"{:<20} {:>10} {:>10} {:>12}"
+        lines.extend([u"", fmt.format(u"allocations ({})".format(method),
+                                      u"count", u"last MB", u"max MB")])
+        for stage, count, last, max_, sites in rows:
+            lines.append(fmt.format(stage, count,
+                u"{:.2f}".format(last / 1048576.0),
+                u"{:.2f}".format(max_ / 1048576.0)))
+            lines.extend(u"    {}".format(site) for site in sites)
+    return lines
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+surfer.utils.profiler
+~~~~~~~~~~~~~~~~~~~~~
+
+This module defines utilities for measuring the time spent by Surfer in
+each stage of its work (files enumeration, ctags run, search, rendering,
+etc). Timings are collected for the whole session.
+
+This module doesn't depend on vim, so that it can be used by the tags
+daemon as well (see `surfer.daemon`).
+"""
+
+import time
+from functools import wraps
+from collections import defaultdict, deque
+
+
+# Stages in the order they are usually executed. Timings for stages not
+# listed here are reported after these ones.
+STAGES = ("files", "cache", "ctags", "parse", "index", "candidates", "search",
+          "sort", "render", "highlight", "jump", "keystroke")
+
+# Only the most recent samples are kept for each stage
+MAX_SAMPLES = 10000
+
+_samples = defaultdict(lambda: deque(maxlen=MAX_SAMPLES))
+_counts = defaultdict(int)
+
+
+class timed:
+    """To measure the time spent in a stage.
+
+    This class can be used either as a context manager or as a decorator:
+
+        with timed("search"):
+            ...
+
+        @timed("render")
+        def render(...):
+            ...
+    """
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.stage, (time.time() - self.start) * 1000)
+
+    def __call__(self, fn):
+        stage = self.stage
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed(stage):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+
+def record(stage, ms):
+    """To record that the stage `stage` took `ms` milliseconds."""
+    _samples[stage].append(ms)
+    _counts[stage] += 1
+
+
+def reset():
+    """To discard all the collected timings."""
+    _samples.clear()
+    _counts.clear()
+
+
+def percentile(values, p):
+    """To return the `p`-th percentile of the sorted list `values`."""
+    if not values:
+        return 0
+    idx = int(round((p / 100.0) * (len(values) - 1)))
+    return values[idx]
+
+
+def stats():
+    """To return timing statistics for each stage.
+
+    Returns a list of tuples of the form:
+
+        (stage, count, p50, p95, max, total)
+
+    where `count` is the number of times the stage has been executed in the
+    current session and the other values are in milliseconds and refer to
+    the most recent `MAX_SAMPLES` executions.
+    """
+    stages = [s for s in STAGES if s in _samples]
+    stages.extend(sorted(s for s in _samples if s not in STAGES))
+    rows = []
+    for stage in stages:
+        values = sorted(_samples[stage])
+        rows.append((stage, _counts[stage], percentile(values, 50),
+                     percentile(values, 95), values[-1], sum(values)))
+    return rows
+
+
+def report():
+    """To return a human readable report of the collected timings as a
+    list of lines."""
+    rows = stats()
+    if not rows:
+        return [u"No timings collected yet."]
+    fmt = u"{:<10} {:>8} {:>10} {:>10} {:>10} {:>12}"
+    lines = [fmt.format(u"stage", u"count", u"p50 ms", u"p95 ms", u"max ms",
+                        u"total ms")]
+    for stage, count, p50, p95, max_, total in rows:
+        lines.append(fmt.format(stage, count, u"{:.2f}".format(p50),
+            u"{:.2f}".format(p95), u"{:.2f}".format(max_),
+            u"{:.2f}".format(total)))
+    return lines
@@ -14,7 +14,24 @@ prefix = 'g:surfer_'
 
 def get(name, type=None):
     """To get the value of a vim variable."""
-    rawval = v.eval(prefix + name)
+    return _convert(v.eval(prefix + name), type)
+
+
+def get_many(*names, **types):
+    """To get the values of many vim variables at once.
+
+    A dictionary of the form {name: value} is returned. Keyword arguments
+    can be used to set the type of the value of a variable, as in `get`.
+
+        get_many("prompt", "max_results", max_results=int)
+    """
+    rawvals = v.eval_many([prefix + name for name in names])
+    return dict((name, _convert(rawval, types.get(name)))
+                for name, rawval in zip(names, rawvals))
+
+
+def _convert(rawval, type=None):
+    """To convert the value of a vim variable to the given type."""
     if type is bool:
         return False if rawval == '0' else True
     elif type is int:
@@ -22,6 +39,6 @@ def get(name, type=None):
     elif type is float:
         return float(rawval)
     elif isinstance(rawval, basestring):
-        return rawval.decode(v.encoding())
+        return v.decode(rawval)
     else:
         return rawval
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+surfer.utils.trace
+~~~~~~~~~~~~~~~~~~
+
+This module defines the Trace class. This class records the keys pressed in
+the Surfer user interface, so that real sessions can be replayed without Vim
+to measure keystroke latency (see `bench/replay.py`).
+
+A trace file is made of JSON lines and can hold many sessions. Each session
+starts with an `open` record, with the search scope and the number of tags
+and files searched, followed by a `key` record for each key read, and ends
+with a `close` record:
+
+    {"event": "open", "time": 1500000000.0, "root": "/project",
+     "buffer": "/project/main.py", "tags": 120000, "files": 3000}
+    {"event": "key", "t": 0.412, "key": "103", "typeahead": false}
+    {"event": "key", "t": 0.415, "key": "101", "typeahead": true}
+    {"event": "close", "t": 2.730, "tags": 120000, "files": 3000}
+
+Keys are the raw values returned by `getchar()`, with `t` the seconds since
+the session started. Keys marked as `typeahead` were typed while Surfer was
+busy (see `surfer.utils.input.Input.get`). Special keys are byte strings
+that aren't valid UTF-8, hence they are stored decoded as latin-1.
+
+This module doesn't depend on vim.
+"""
+
+import json
+import time
+
+
+class Trace:
+
+    def __init__(self, path, **meta):
+        # `IOError` is raised if `path` can't be written
+        self.start = time.time()
+        self.file = open(path, "a")
+        meta["event"] = "open"
+        meta["time"] = self.start
+        self._write(meta)
+
+    def key(self, raw_char, typeahead=False):
+        """To record the key `raw_char`, as returned by `getchar()`."""
+        self._write({"event": "key", "t": time.time() - self.start,
+                     "key": raw_char.decode("latin-1"), "typeahead": typeahead})
+
+    def close(self, **meta):
+        """To end the session."""
+        meta["event"] = "close"
+        meta["t"] = time.time() - self.start
+        self._write(meta)
+        self.file.close()
+
+    def _write(self, record):
+        """To append a single record to the trace file."""
+        try:
+            self.file.write(json.dumps(record, sort_keys=True) + "\n")
+            self.file.flush()
+        except (IOError, ValueError):
+            pass
+
+
+def load(path):
+    """To load all the sessions recorded in the trace file `path`.
+
+    Returns a list of tuples (open, keys, close) where `open` and `close` are
+    the dictionaries recorded when the session started and ended (`close` is
+    None when Vim quit in the middle of the session) and `keys` a list of
+    tuples (raw key, typeahead). Raises `IOError` if `path` can't be read and
+    `ValueError` if it isn't a trace file.
+    """
+    sessions = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            event = record.get("event")
+            if event == "open":
+                sessions.append((record, [], None))
+            elif not sessions:
+                raise ValueError("invalid trace: {}".format(path))
+            elif event == "key":
+                sessions[-1][1].append((record["key"].encode("latin-1"),
+                                        record.get("typeahead", False)))
+            elif event == "close":
+                sessions[-1] = sessions[-1][:2] + (record,)
+    return sessions
@@ -4,6 +4,14 @@ surfer.utils.v
 ~~~~~~~~~~~~~~
 
 This module defines thin wrappers around vim commands and functions.
+
+Each call to `vim.eval` or `vim.command` is a round-trip to Vim, so
+functions that evaluate many expressions or execute many commands at once
+are provided as well (see `eval_many` and `exe_many`).
+
+Strings cross the boundary with Vim encoded with 'encoding'. Values
+returned by vim are decoded with `decode`, and file paths with `path`, which
+decodes and normalizes each path only once.
 """
 
 import os
@@ -12,17 +20,73 @@ from unicodedata import normalize
 from itertools import ifilter, imap
 
 
+# Values that don't change during the session
+_session = {}
+
+# {path as returned by vim: decoded path in NFC form}, see `path`
+_paths = {}
+_max_paths = 100000
+
+
 def eval(expr):
     """To evaluate the given expression.
 
     The caller is responsible for calling `decode()`.
     """
-    return vim.eval(expr.encode(encoding()))
+    if isinstance(expr, unicode):
+        expr = expr.encode(encoding())
+    return vim.eval(expr)
+
+
+def eval_many(exprs):
+    """To evaluate many expressions at once. A list with the value of each
+    expression is returned.
+
+    The caller is responsible for calling `decode()`.
+    """
+    if not exprs:
+        return []
+    return eval(u"[{}]".format(u",".join(exprs)))
+
+
+def quote(s):
+    """To return `s` as a vim string literal."""
+    return u"'{}'".format(s.replace(u"'", u"''"))
+
+
+def exists(expr):
+    """To check if something exists, e.g. a vim function. See :h exists()
+    The result is cached for the whole session."""
+    key = "exists:" + expr
+    if key not in _session:
+        _session[key] = vim.eval("exists('{}')".format(expr)) != "0"
+    return _session[key]
+
+
+def decode(value):
+    """To decode a string returned by vim. Strings that vim already returns
+    as unicode are not transcoded."""
+    if isinstance(value, unicode):
+        return value
+    return value.decode(encoding())
+
+
+def path(name):
+    """To return the file path `name`, as returned by vim, decoded and in NFC
+    form. Paths are decoded and normalized only the first time they are
+    seen."""
+    try:
+        return _paths[name]
+    except KeyError:
+        if len(_paths) >= _max_paths:
+            _paths.clear()
+        normalized = _paths[name] = normalize("NFC", decode(name))
+        return normalized
 
 
 def opt(opt):
     """To return the value of a vim option."""
-    val = eval("&{}".format(opt)).decode(encoding())
+    val = decode(eval("&{}".format(opt)))
     if val.isdigit():
         return int(val)
     return val
@@ -32,7 +96,7 @@ def call(fun):
     """To return the value of a vim function."""
     val = eval(fun)
     if isinstance(val, basestring):
-        val = val.decode(encoding())
+        val = decode(val)
         if val.isdigit():
             return int(val)
     return val
@@ -40,7 +104,20 @@ def call(fun):
 
 def exe(cmd):
     """To execute a vim command."""
-    vim.command(cmd.encode(encoding()))
+    if isinstance(cmd, unicode):
+        cmd = cmd.encode(encoding())
+    vim.command(cmd)
+
+
+def exe_many(cmds):
+    """To execute many vim commands at once. See :h execute()"""
+    if not cmds:
+        return
+    if exists("*execute"):
+        eval(u"execute([{}])".format(u",".join(quote(c) for c in cmds)))
+    else:
+        for cmd in cmds:
+            exe(cmd)
 
 
 def echo(msg, hlgroup="", surfermsg=True):
@@ -53,8 +130,12 @@ def echo(msg, hlgroup="", surfermsg=True):
 
 
 def encoding():
-    """To get the current encoding."""
-    return vim.eval("&enc")
+    """To get the current encoding. The value is read only once per
+    session since changing 'encoding' is not supported once Vim has
+    started (see :h 'encoding')."""
+    if "enc" not in _session:
+        _session["enc"] = vim.eval("&enc")
+    return _session["enc"]
 
 
 def cwd():
@@ -67,6 +148,13 @@ def highlight(hlgroup, patt):
     exe(u"syn match {} /{}/".format(hlgroup, patt))
 
 
+def highlight_many(highlights):
+    """To apply many highlightings at once. `highlights` is a list of
+    tuples (hlgroup, patt), see `highlight`."""
+    exe_many([u"syn match {} /{}/".format(hlgroup, patt)
+              for hlgroup, patt in highlights])
+
+
 def redraw():
     """Little wrapper around the redraw command. See :h :redraw"""
     exe('redraw')
@@ -111,11 +199,11 @@ def bufname(nr=None):
     the name of the current buffer is returned."""
     current = vim.current.buffer
     if nr is None and current.name:
-        return normalize("NFC", current.name.decode(encoding()))
+        return path(current.name)
     elif nr is not None:
         for buf in vim.buffers:
             if buf.number == nr and buf.name:
-                return normalize("NFC", buf.name.decode(encoding()))
+                return path(buf.name)
 
 
 def bufnr(expr=None):
@@ -166,7 +254,24 @@ def buflisted(expr):
 
 def buffers():
     """To return a list of all listed buffers."""
-    enc = encoding()
+    if exists("*getbufinfo"):
+        # a single round-trip for all buffers
+        names = eval("map(getbufinfo({'buflisted': 1}), 'v:val.name')")
+        return [path(n) for n in names if n]
     named = ifilter(lambda b: b.name, vim.buffers)
-    decoded = imap(lambda b: normalize("NFC", b.name.decode(enc)), named)
+    decoded = imap(lambda b: path(b.name), named)
     return ifilter(lambda b: buflisted(b), decoded)
+
+
+def modified_buffers():
+    """To return a list of all listed buffers with unsaved changes."""
+    return [path(b.name) for b in vim.buffers
+            if b.name and b.options["modified"]]
+
+
+def bufcontent(name):
+    """To return the content of the buffer `name` as a byte string, in the
+    encoding of the buffer. None is returned if there is no such buffer."""
+    for buf in vim.buffers:
+        if buf.name and path(buf.name) == name:
+            return "\n".join(buf[:]) + "\n"
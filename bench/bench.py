@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+"""
+bench.bench
+~~~~~~~~~~~
+
+Headless benchmarks for the search and generator layers. Vim is not needed:
+`surfer.utils.v` is replaced with the stub defined in `bench.vstub`.
+
+Usage:
+
+    $ python bench/bench.py                      # synthetic corpora
+    $ python bench/bench.py --sizes 10000,2000000
+    $ python bench/bench.py --tags /path/to/tags  # real-world corpus
+    $ python bench/bench.py --src /path/to/project  # also time _build_tags,
+                                                    # with the tags cache too
+
+When the C extension has been compiled (see install.sh), both matchers are
+benchmarked and a parity check makes sure they produce identical results.
+The same goes for the memory-mapped index, which needs the C extension.
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+from distutils.spawn import find_executable
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import vstub
+vstub.install()
+
+from surfer import finder
+from surfer import mapped
+from surfer import generator
+from surfer.index import TagIndex, prepare_tags
+from surfer.search import search
+
+try:
+    from surfer.ext import search as search_ext
+except ImportError:
+    search_ext = None
+
+
+QUERIES = [u"get", u"init", u"usrnm", u"Parse", u"hdlreq", u"x"]
+
+WORDS = [
+    "get", "set", "user", "name", "init", "parse", "line", "tag", "file",
+    "buffer", "window", "render", "handle", "request", "response", "config",
+    "load", "save", "update", "index", "search", "match", "cache", "node",
+    "tree", "list", "item", "value", "key", "error", "open", "close", "read",
+]
+
+KINDS = ["function", "class", "member", "variable", "constant", "method"]
+
+
+# Corpora
+# ----------------------------------------------------------------------------
+
+def synthetic_corpus(size, seed=0):
+    """To generate `size` ctags lines in the format produced with the
+    default `g:surfer_ctags_args`."""
+    rnd = random.Random(seed)
+    files = ["/project/src/module{}/file{}.py".format(i % 50, i)
+             for i in range(max(1, size // 100))]
+    lines = []
+    for i in range(size):
+        words = [rnd.choice(WORDS) for _ in range(rnd.randint(1, 4))]
+        style = rnd.randint(0, 2)
+        if style == 0:
+            name = "_".join(words)
+        elif style == 1:
+            name = words[0] + "".join(w.capitalize() for w in words[1:])
+        else:
+            name = "".join(w.capitalize() for w in words)
+        line = rnd.randint(1, 5000)
+        lines.append("{}\t{}\t{};\"\tkind:{}\tline:{}\tlanguage:Python".format(
+            name, rnd.choice(files), line, rnd.choice(KINDS), line))
+    return lines
+
+
+def load_corpus(path):
+    """To load ctags lines from the tag file `path`."""
+    with open(path) as f:
+        return [ln.rstrip("\n") for ln in f if not ln.startswith("!_TAG_")]
+
+
+# Utilities
+# ----------------------------------------------------------------------------
+
+def rss():
+    """To return the resident set size of the current process in bytes."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def timeit(fn, *args):
+    """To return the result of `fn(*args)` and the seconds it took."""
+    start = time.time()
+    result = fn(*args)
+    return result, time.time() - start
+
+
+def report(label, count, seconds, unit):
+    """To print a single benchmark result."""
+    rate = count / seconds if seconds > 0 else float("inf")
+    print(u"  {:<28} {:>10} {:<6} {:>10.3f} s {:>14,.0f} {}/s".format(
+        label, count, unit, seconds, rate, unit))
+
+
+def report_latency(label, seconds):
+    """To print the time taken by a single operation, for operations whose
+    cost doesn't grow with the number of tags they are given."""
+    print(u"  {:<28} {:>10.3f} ms".format(label, seconds * 1000))
+
+
+# Benchmarks
+# ----------------------------------------------------------------------------
+
+def bench_parse(lines):
+    """To time `TagsGenerator._parse_tags` on the ctags output made of
+    `lines`. Returns the parsed tags."""
+    gen = generator.TagsGenerator(None)
+    output = "\n".join(lines)
+    before = rss()
+    tags, secs = timeit(gen._parse_tags, output, {})
+    mem = rss() - before
+    report("_parse_tags", len(lines), secs, "lines")
+    print(u"  {:<28} {:>10.1f} MB ({:.0f} bytes/tag)".format(
+        "tags memory", mem / 1048576.0, mem / float(max(1, len(tags)))))
+    return tags
+
+
+def bench_match(names, queries, label, fn):
+    """To time a `match` implementation."""
+    smart_case = 1
+    calls = 0
+    start = time.time()
+    for query in queries:
+        for name in names:
+            fn(query, name, smart_case)
+        calls += len(names)
+    report(label, calls, time.time() - start, "calls")
+
+
+def bench_find(tags, queries, label=u"_find"):
+    """To time `TagsFinder._find`."""
+    tfinder = finder.TagsFinder(None, None)
+    for query in queries:
+        _, secs = timeit(tfinder._find, query, tags, 15)
+        report(u"{}({!r})".format(label, query), len(tags), secs, "tags")
+
+
+def bench_prepare(tags):
+    """To time the computation of the data needed by the matching function
+    (see `surfer.index.prepare_tags`)."""
+    _, secs = timeit(prepare_tags, tags)
+    report("prepare_tags", len(tags), secs, "tags")
+
+
+def bench_index(tags, queries):
+    """To time `TagIndex` and check that searching only the candidates it
+    returns gives the same results as searching all tags. Returns the
+    number of mismatches."""
+    index = TagIndex(budget=1 << 40)
+    index.min_tags = 0
+    _, secs = timeit(index.build, tags)
+    report("TagIndex.build", len(tags), secs, "tags")
+    print(u"  {:<28} {:>10.1f} MB".format(
+        "index memory", index.memory() / 1048576.0))
+    for query in queries:
+        hits, secs = timeit(index.prefixed, query, 1)
+        report(u"prefixed({!r})".format(query), len(hits), secs, "tags")
+    tfinder = finder.TagsFinder(None, None)
+    mismatches = 0
+    for query in queries:
+        candidates, secs = timeit(index.candidates, query)
+        results, secs2 = timeit(tfinder._find, query, candidates, 15)
+        report(u"indexed _find({!r})".format(query), len(candidates),
+               secs + secs2, "tags")
+        if results != tfinder._find(query, tags, 15):
+            mismatches += 1
+            print(u"  mismatch: indexed _find({!r})".format(query))
+    return mismatches
+
+
+def bench_mapped(tags, queries):
+    """To time `surfer.mapped.MappedIndex` and check that it gives the same
+    results as searching all tags. Returns the number of mismatches.
+
+    Searches are reported by latency: when enough names start with the
+    query, the other tags are not even scanned.
+    """
+    tmp = tempfile.mkdtemp(prefix="surfer")
+    path = os.path.join(tmp, "index")
+    mtimes = dict((t["file"], 0) for t in tags)
+    _, secs = timeit(mapped.write, path, tags, mtimes)
+    report("mapped.write", len(tags), secs, "tags")
+    print(u"  {:<28} {:>10.1f} MB".format(
+        "index file", os.path.getsize(path) / 1048576.0))
+    index = mapped.MappedIndex(path)
+    tfinder = finder.TagsFinder(None, None)
+    mismatches = 0
+    for query in queries:
+        results, secs = timeit(index.search, query, 15, 1)
+        report_latency(u"MappedIndex.search({!r})".format(query), secs)
+        if results != tfinder._find(query, tags, 15):
+            mismatches += 1
+            print(u"  mismatch: MappedIndex.search({!r})".format(query))
+    index.close()
+    shutil.rmtree(tmp)
+    return mismatches
+
+
+def source_files(src):
+    """To return all files in `src`."""
+    files = []
+    for root, _, names in os.walk(src):
+        files.extend(os.path.join(root, n).decode("utf-8") for n in names)
+    return files
+
+
+def bench_build_tags(src):
+    """To time `TagsGenerator._build_tags` on all files in `src`."""
+    prg = find_executable("ctags")
+    if not prg:
+        print(u"  _build_tags: skipped (ctags not found)")
+        return
+    vstub.set_option("ctags_prg", prg)
+    files = source_files(src)
+    gen = generator.TagsGenerator(None)
+    before = rss()
+    (tags, tagfiles), secs = timeit(gen._build_tags, files)
+    mem = rss() - before
+    gen._remove_tagfiles(tagfiles)
+    gen.close()
+    report("_build_tags (files)", len(files), secs, "files")
+    report("_build_tags (tags)", len(tags), secs, "tags")
+    print(u"  {:<28} {:>10.1f} MB".format("tags memory", mem / 1048576.0))
+
+
+def bench_tag_cache(src):
+    """To time `TagsGenerator._build_tags` on all files in `src` with the
+    tags cache (see `surfer.tagcache`): cold, when the cache is empty, and
+    warm, in a new session once all files are in the cache. Plain ctags
+    runs are timed as well, for comparison."""
+    prg = find_executable("ctags")
+    if not prg:
+        print(u"  tags cache: skipped (ctags not found)")
+        return
+    vstub.set_option("ctags_prg", prg)
+    files = source_files(src)
+    cache_dir = tempfile.mkdtemp(prefix="surfer")
+    vstub.set_option("cache_dir", cache_dir)
+    for label, size in [("no cache", 0), ("cold cache", 1024),
+                        ("warm cache", 1024)]:
+        vstub.set_option("tag_cache_size", size)
+        gen = generator.TagsGenerator(None)
+        (tags, tagfiles), secs = timeit(gen._build_tags, files)
+        gen._remove_tagfiles(tagfiles)
+        gen.close()
+        report(u"_build_tags ({})".format(label), len(files), secs, "files")
+    for name in ("cache_dir", "tag_cache_size"):
+        vstub.variables["g:surfer_" + name] = vstub.defaults["g:surfer_" + name]
+    shutil.rmtree(cache_dir)
+
+
+def parity(names, queries):
+    """To check that the Python and C matchers produce identical results.
+
+    Returns the number of mismatches. When the two implementations find
+    different positions with the same similarity (ties) the result is not
+    considered a mismatch, since both alignments are equally good.
+    """
+    mismatches = ties = 0
+    for name in names:
+        if search.prepare(name) != search_ext.prepare(name):
+            mismatches += 1
+            print(u"  mismatch: prepare({!r})".format(name))
+    for smart_case in (0, 1):
+        for query in queries:
+            for name in names:
+                py = search.match(query, name, smart_case)
+                c = search_ext.match(query, name, smart_case)
+                if py[1] == c[1] and abs(py[0] - c[0]) < 1e-3:
+                    continue
+                if py[1] and c[1] and abs(py[0] - c[0]) < 1e-3:
+                    ties += 1
+                    continue
+                mismatches += 1
+                if mismatches <= 10:
+                    print(u"  mismatch: match({!r}, {!r}, {}) -> {} (python) "
+                          u"{} (C)".format(query, name, smart_case, py, c))
+    print(u"  {} mismatches, {} ties".format(mismatches, ties))
+    return mismatches
+
+
+def run(lines, args, queries):
+    """To run all benchmarks on the ctags lines `lines`."""
+    tags = bench_parse(lines)
+    names = [t["name"] for t in tags]
+    sample = names[:args.match_sample]
+    bench_match(sample, queries, "match (python)", search.match)
+    if search_ext:
+        bench_match(sample, queries, "match (C)", search_ext.match)
+    bench_find(tags, queries)
+    bench_prepare(tags)
+    bench_find(tags, queries, u"_find prepared")
+    return tags
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--sizes", default="10000,100000",
+        help="comma-separated sizes of synthetic corpora (default: %(default)s)")
+    parser.add_argument("--tags", action="append", default=[],
+        help="tag file to use as a real-world corpus (can be repeated)")
+    parser.add_argument("--src", action="append", default=[],
+        help="directory of source files used to time _build_tags")
+    parser.add_argument("--queries", default=u",".join(QUERIES),
+        help="comma-separated queries (default: %(default)s)")
+    parser.add_argument("--match-sample", type=int, default=20000,
+        help="number of tag names used to time match (default: %(default)s)")
+    parser.add_argument("--no-parity", action="store_true",
+        help="skip the parity checks between the matchers")
+    args = parser.parse_args()
+
+    queries = args.queries.decode("utf-8").split(u",")
+    corpora = [(u"synthetic {:,}".format(int(n)), synthetic_corpus(int(n)))
+               for n in args.sizes.split(",") if n]
+    corpora.extend((path, load_corpus(path)) for path in args.tags)
+
+    print(u"C extension: {}".format(
+        "loaded" if search_ext else "not available (run ./install.sh)"))
+
+    failed = False
+    for label, lines in corpora:
+        print(u"\n{} ({:,} lines)".format(label, len(lines)))
+        tags = run(lines, args, queries)
+        names = [t["name"] for t in tags]
+        failed |= bool(bench_index(tags, queries))
+        if mapped.search_mapped:
+            failed |= bool(bench_mapped(tags, queries))
+        if search_ext and not args.no_parity:
+            failed |= bool(parity(names[:args.match_sample], queries))
+
+    for src in args.src:
+        print(u"\n{}".format(src))
+        bench_build_tags(src)
+        bench_tag_cache(src)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
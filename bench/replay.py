@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+bench.replay
+~~~~~~~~~~~~
+
+Headless replay of keystroke traces recorded with `g:surfer_trace_file`
+(see `surfer.utils.trace`). Vim is not needed: recorded keys are fed to the
+user interface loop through the stub defined in `bench.vstub`, and tags are
+a synthetic corpus as large as the one searched in the recorded session.
+
+Usage:
+
+    $ python bench/replay.py ~/surfer.trace
+    $ python bench/replay.py --tags /path/to/tags ~/surfer.trace
+    $ python bench/replay.py --max-p95 50 ~/surfer.trace
+
+For each session, the 50th percentile, 95th percentile and maximum
+keystroke latency are reported, in milliseconds. Keys typed while Surfer
+was busy are replayed as typeahead, so they are processed along with the
+previous key as in the recorded session. With --max-p95 the exit status is
+1 when the 95th percentile of any session is above the given latency, so
+that replays can be used to catch latency regressions.
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import vstub
+vstub.install(mapped_index=0)
+
+from bench import synthetic_corpus, load_corpus
+
+from surfer import core
+from surfer.utils import trace
+from surfer.utils import profiler
+
+
+def latency(plug, session, lines):
+    """To replay a single session on the tags in the ctags lines `lines`.
+    Returns a tuple (keystrokes, p50, p95, max)."""
+    meta, keys, _ = session
+    gen = plug.generator
+    tags = gen._parse_tags("\n".join(lines), {})
+    files = sorted(set(t["file"] for t in tags))
+
+    # Tags come from the corpus rather than from ctags, and jumping to a
+    # tag just closes the user interface since there are no files to open
+    gen._files = lambda modifier, curr_bufname: files
+    gen._build_tags = lambda files: (list(tags), [])
+    gen.rebuild_tags = True
+    plug.ui._jump_to = lambda tag, mode="": plug.ui._close()
+
+    vstub.bufname_path = meta.get("buffer")
+    if meta.get("tags"):
+        # tags were already in memory when the session started
+        gen.get_tags(u"", meta.get("buffer") or u"")
+
+    vstub.keys.clear()
+    vstub.keys.extend(keys)
+    del vstub.commands[:]
+    profiler.reset()
+    plug.ui.open()
+
+    for stage, count, p50, p95, max_, _ in profiler.stats():
+        if stage == "keystroke":
+            return count, p50, p95, max_
+    return 0, 0, 0, 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("traces", nargs="+",
+        help="trace file recorded with g:surfer_trace_file")
+    parser.add_argument("--tags",
+        help="tag file to use as corpus in place of a synthetic one")
+    parser.add_argument("--max-p95", type=float, default=0,
+        help="fail when the 95th percentile latency of a session is above "
+             "this value, in milliseconds")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.tags) if args.tags else None
+    plug = core.Surfer()
+
+    failed = False
+    fmt = u"  {:<34} {:>10} {:>10} {:>10} {:>10}"
+    for path in args.traces:
+        print(u"\n{}".format(path))
+        print(fmt.format(u"session", u"keystrokes", u"p50 ms", u"p95 ms",
+                         u"max ms"))
+        for session in trace.load(path):
+            meta, _, end = session
+            size = max(meta.get("tags", 0), (end or {}).get("tags", 0))
+            lines = corpus if corpus is not None else synthetic_corpus(size)
+            count, p50, p95, max_ = latency(plug, session, lines)
+            label = u"{} ({:,} tags)".format(time.strftime(
+                "%Y-%m-%d %H:%M", time.localtime(meta["time"])), len(lines))
+            print(fmt.format(label, count, u"{:.2f}".format(p50),
+                u"{:.2f}".format(p95), u"{:.2f}".format(max_)))
+            if args.max_p95 and p95 > args.max_p95:
+                print(u"  p95 above {:.2f} ms".format(args.max_p95))
+                failed = True
+
+    plug.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
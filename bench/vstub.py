@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""
+bench.vstub
+~~~~~~~~~~~
+
+This module defines a stand-in for `surfer.utils.v` that doesn't need Vim.
+It allows Surfer components to be imported and driven from a plain Python
+interpreter, e.g. for benchmarks.
+
+Vim variables are kept in the `variables` dictionary and the current
+buffer is a plain list of lines. Unsaved content of other buffers can be
+put in `contents`. Every executed command is recorded in `commands`. Keys
+returned by `getchar()` are taken from `keys`.
+"""
+
+import os
+import sys
+from collections import deque
+from unicodedata import normalize
+
+
+# Default values for all the Surfer options (see plugin/surfer.vim).
+# As with `vim.eval`, numbers are returned as strings.
+defaults = {
+    "g:surfer_debug": "0",
+    "g:surfer_ctags_prg": "ctags",
+    "g:_surfer_ctags_version": "",
+    "g:surfer_ctags_args": "-f - --format=2 --excmd=number --sort=yes "
+                           "--fields=nKzmafilmsSt",
+    "g:surfer_ctags_coprocess": "1",
+    "g:surfer_cache_dir": "/tmp/surfer-bench-cache",
+    "g:surfer_smart_case": "1",
+    "g:surfer_search_time_budget": "0",
+    "g:surfer_memory_budget": "320",
+    "g:surfer_memory_profiling": "0",
+    "g:surfer_trace_file": "",
+    "g:surfer_daemon_socket": "",
+    "g:surfer_mapped_index": "1",
+    "g:surfer_tag_cache_size": "0",
+    "g:surfer_buffer_search_modifier": "%",
+    "g:surfer_project_search_modifier": "#",
+    "g:surfer_workspace_search_modifier": "@",
+    "g:surfer_directory_search_modifier": "&",
+    "g:surfer_directory_search_depth": "0",
+    "g:surfer_workspace_roots": [],
+    "g:surfer_workspace_max_roots": "4",
+    "g:surfer_kind_filter_prefix": ":",
+    "g:surfer_path_filter_prefix": "/",
+    "g:surfer_root_markers": ['.git', '.svn', '.hg', '.bzr', '.travis.yml'],
+    "g:surfer_exclude": [],
+    "g:surfer_exclude_kinds": [],
+    "g:surfer_custom_languages": {},
+    "g:surfer_max_results": "15",
+    "g:surfer_prompt": " @ ",
+    "g:surfer_prompt_color": "",
+    "g:surfer_prompt_color_darkbg": "",
+    "g:surfer_cursorline": "1",
+    "g:surfer_current_line_indicator": " ",
+    "g:surfer_line_format": [" @ {file}"],
+    "g:surfer_tag_file_custom_depth": "-1",
+    "g:surfer_tag_file_relative_to_project_root": "1",
+    "g:surfer_no_results_msg": " nothing found...",
+    "g:surfer_partial_results_msg": "  (partial results)",
+    "g:surfer_shade_color": "Comment",
+    "g:surfer_shade_color_darkbg": "Comment",
+    "g:surfer_matches_color": "WarningMsg",
+    "g:surfer_matches_color_darkbg": "WarningMsg",
+    "g:surfer_visual_kinds": "1",
+    "g:surfer_visual_kinds_shape": "\xe2\x80\xa2 ",
+    "g:surfer_visual_kinds_colors": {},
+    "g:surfer_visual_kinds_colors_darkbg": {},
+}
+
+variables = dict(defaults)
+commands = []
+lines = [u""]
+contents = {}
+cwd_path = os.getcwd()
+bufname_path = None
+# Keys as tuples (raw key, typeahead). Only typeahead keys are seen by
+# `getchar(0)` and `getchar(1)`, as if typed while Surfer was busy. When
+# there are no more keys, `getchar()` returns <Esc>.
+keys = deque()
+
+
+def install(**options):
+    """To replace `surfer.utils.v` with this module.
+
+    This function must be called before any Surfer module is imported.
+    Keyword arguments are used to set Surfer options, e.g.
+    `install(smart_case=0)` sets `g:surfer_smart_case`.
+    """
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "autoload")
+    if root not in sys.path:
+        sys.path.insert(0, root)
+    for name, value in options.items():
+        set_option(name, value)
+    module = sys.modules[__name__]
+    sys.modules["surfer.utils.v"] = module
+    import surfer.utils
+    surfer.utils.v = module
+    return module
+
+
+def set_option(name, value):
+    """To set the value of the Surfer option `name`."""
+    if isinstance(value, (int, long)):
+        value = str(value)
+    variables["g:surfer_" + name] = value
+
+
+def eval(expr):
+    """To evaluate the given expression. Only variables and `getchar()`
+    are supported."""
+    if expr in variables:
+        return variables[expr]
+    if expr == "getchar()":
+        return keys.popleft()[0] if keys else "27"
+    if expr in ("getchar(0)", "getchar(1)"):
+        if not keys or not keys[0][1]:
+            return "0"
+        return keys.popleft()[0] if expr == "getchar(0)" else keys[0][0]
+    if expr.startswith("&"):
+        return opt(expr[1:])
+    return "0"
+
+
+def eval_many(exprs):
+    """To evaluate many expressions at once."""
+    return [eval(expr) for expr in exprs]
+
+
+def quote(s):
+    """To return `s` as a vim string literal."""
+    return u"'{}'".format(s.replace(u"'", u"''"))
+
+
+def exists(expr):
+    """To check if something exists."""
+    return False
+
+
+def decode(value):
+    """To decode a string returned by `eval`."""
+    if isinstance(value, unicode):
+        return value
+    return value.decode(encoding())
+
+
+def path(name):
+    """To return the file path `name` decoded and in NFC form."""
+    return normalize("NFC", decode(name))
+
+
+def opt(opt):
+    """To return the value of a vim option."""
+    return {"bg": u"dark", "background": u"dark"}.get(opt, u"")
+
+
+def call(fun):
+    """To return the value of a vim function."""
+    return 0
+
+
+def exe(cmd):
+    """To execute a vim command."""
+    commands.append(cmd)
+
+
+def exe_many(cmds):
+    """To execute many vim commands at once."""
+    commands.extend(cmds)
+
+
+def echo(msg, hlgroup="", surfermsg=True):
+    """To display a message to the user via the command line."""
+    commands.append(u"echom {}".format(msg))
+
+
+def encoding():
+    """To get the current encoding."""
+    return "utf-8"
+
+
+def cwd():
+    """To return the current working directory."""
+    return cwd_path
+
+
+def highlight(hlgroup, patt):
+    """To highlight with `hlgroup` every occurrence of `patt`."""
+    exe(u"syn match {} /{}/".format(hlgroup, patt))
+
+
+def highlight_many(highlights):
+    """To apply many highlightings at once."""
+    for hlgroup, patt in highlights:
+        highlight(hlgroup, patt)
+
+
+def redraw():
+    """To redraw the screen."""
+    exe("redraw")
+
+
+def focus_win(expr):
+    """To go to the window numbered `expr`."""
+    exe(u"{}wincmd w".format(expr))
+
+
+def cursor(target=None):
+    """To move the cursor or return the current cursor position."""
+    if not target:
+        return (1, 0)
+
+
+def bufwinnr(expr):
+    """To return the number of the window for the buffer `expr`."""
+    return 1
+
+
+def buffer(nr=None):
+    """To return the current buffer."""
+    return lines
+
+
+def bufname(nr=None):
+    """To return the name of the current buffer."""
+    if bufname_path:
+        return path(bufname_path)
+
+
+def bufnr(expr=None):
+    """To return the number of the current buffer."""
+    return 1
+
+
+def winnr(expr=None):
+    """To return the number of the current window."""
+    return 1
+
+
+def setbuffer(content):
+    """To set the whole content of the current buffer at once."""
+    if isinstance(content, list):
+        lines[:] = content
+    else:
+        lines[:] = content.split(u"\n")
+
+
+def getline(linenr):
+    """To return a specific line of the current buffer."""
+    return lines[linenr]
+
+
+def setline(linenr, line):
+    """To set a specific line of the current buffer."""
+    lines[linenr] = line
+
+
+def setwinh(height):
+    """To set the height of the current window."""
+    pass
+
+
+def buflisted(expr):
+    """To check if a buffer is listed."""
+    return 1
+
+
+def buffers():
+    """To return a list of all listed buffers."""
+    return [bufname_path] if bufname_path else []
+
+
+def modified_buffers():
+    """To return a list of all listed buffers with unsaved changes."""
+    return list(contents)
+
+
+def bufcontent(name):
+    """To return the content of the buffer `name` as a byte string."""
+    if name in contents:
+        return contents[name]
+    if name == bufname_path:
+        return u"\n".join(lines).encode("utf-8") + "\n"
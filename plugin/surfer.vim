@@ -54,19 +54,68 @@ let g:surfer_debug =
 let g:surfer_ctags_prg =
     \ get(g:, "surfer_ctags_prg", "")
 
+let g:surfer_cache_dir =
+    \ get(g:, "surfer_cache_dir",
+    \ (empty($XDG_CACHE_HOME) ? expand("~/.cache") : $XDG_CACHE_HOME) . "/surfer")
+
 let g:surfer_ctags_args =
     \ get(g:, "surfer_ctags_args",
     \ "-f - --format=2 --excmd=number --sort=yes --fields=nKzmafilmsSt")
 
+let g:surfer_ctags_coprocess =
+    \ get(g:, "surfer_ctags_coprocess", 1)
+
 let g:surfer_smart_case =
     \ get(g:, "surfer_smart_case", 1)
 
+let g:surfer_search_time_budget =
+    \ get(g:, "surfer_search_time_budget", 200)
+
+let g:surfer_daemon_socket =
+    \ get(g:, "surfer_daemon_socket", g:surfer_cache_dir . "/daemon.sock")
+
+let g:surfer_memory_budget =
+    \ get(g:, "surfer_memory_budget", 320)
+
+let g:surfer_trace_file =
+    \ get(g:, "surfer_trace_file", "")
+
+let g:surfer_memory_profiling =
+    \ get(g:, "surfer_memory_profiling", 0)
+
+let g:surfer_tag_cache_size =
+    \ get(g:, "surfer_tag_cache_size", 128)
+
+let g:surfer_mapped_index =
+    \ get(g:, "surfer_mapped_index", 1)
+
 let g:surfer_buffer_search_modifier =
     \ get(g:, "surfer_buffer_search_modifier", "%")
 
 let g:surfer_project_search_modifier =
     \ get(g:, "surfer_project_search_modifier", "#")
 
+let g:surfer_workspace_search_modifier =
+    \ get(g:, "surfer_workspace_search_modifier", "@")
+
+let g:surfer_directory_search_modifier =
+    \ get(g:, "surfer_directory_search_modifier", "&")
+
+let g:surfer_directory_search_depth =
+    \ get(g:, "surfer_directory_search_depth", 0)
+
+let g:surfer_workspace_roots =
+    \ get(g:, "surfer_workspace_roots", [])
+
+let g:surfer_workspace_max_roots =
+    \ get(g:, "surfer_workspace_max_roots", 4)
+
+let g:surfer_kind_filter_prefix =
+    \ get(g:, "surfer_kind_filter_prefix", ":")
+
+let g:surfer_path_filter_prefix =
+    \ get(g:, "surfer_path_filter_prefix", "/")
+
 let g:surfer_root_markers =
     \ extend(get(g:, 'surfer_root_markers', []),
     \ ['.git', '.svn', '.hg', '.bzr', '.travis.yml'])
@@ -114,6 +163,9 @@ let g:surfer_tag_file_relative_to_project_root =
 let g:surfer_no_results_msg =
     \ get(g:, "surfer_no_results_msg", " nothing found...")
 
+let g:surfer_partial_results_msg =
+    \ get(g:, "surfer_partial_results_msg", "  (partial results)")
+
 let g:surfer_shade_color =
     \ get(g:, 'surfer_shade_color', 'Comment')
 
@@ -156,3 +208,5 @@ let g:surfer_visual_kinds_colors_darkbg =
 " ----------------------------------------------------------------------------
 
 command! Surf call surfer#Open()
+command! -nargs=? -complete=file SurferProfile call surfer#Profile(<q-args>)
+command! -nargs=? -complete=file SurferMemory call surfer#Memory(<q-args>)
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+tests.test_daemon
+~~~~~~~~~~~~~~~~~
+
+Tests for the requests handled by `surfer.daemon.TagsDaemon`.
+"""
+
+import os
+import sys
+import shutil
+import socket
+import tempfile
+import unittest
+import threading
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "autoload"))
+
+from surfer import daemon
+
+
+def make_tag(name, file, kind=u"f", line=1):
+    return {"name": name, "file": file, "cmd": unicode(line),
+            "exts": {"kind": kind, "line": unicode(line)}}
+
+
+TAGS = [
+    make_tag(u"connect", u"/p/net/client.py", u"f"),
+    make_tag(u"Connection", u"/p/net/client.py", u"c"),
+    make_tag(u"reconnect", u"/p/retry.py", u"f"),
+]
+
+
+class TagsDaemonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.daemon = daemon.TagsDaemon()
+
+    def put(self, root=u"/p", tags=TAGS):
+        return self.daemon.handle({"op": "put", "root": root,
+                                   "tags": daemon.pack_tags(tags)})
+
+    def query(self, query, **kwargs):
+        request = {"op": "query", "root": u"/p", "query": query}
+        request.update(kwargs)
+        return self.daemon.handle(request)
+
+    def names(self, query, **kwargs):
+        return [r["name"] for r in self.query(query, **kwargs)["results"]]
+
+    def test_ping(self):
+        self.assertEqual(self.daemon.handle({"op": "ping"}),
+                         {"ok": True, "version": daemon.PROTOCOL_VERSION})
+
+    def test_status(self):
+        status = {"op": "status", "root": u"/p"}
+        self.assertEqual(self.daemon.handle(status),
+                         {"ok": True, "indexed": False})
+        self.assertEqual(self.put(), {"ok": True})
+        self.assertEqual(self.daemon.handle(status),
+                         {"ok": True, "indexed": True, "tags": 3})
+
+    def test_query(self):
+        self.assertEqual(self.query(u"conn"), {"ok": True, "indexed": False})
+        self.put()
+        self.assertEqual(self.names(u"connect"),
+                         [u"connect", u"Connection", u"reconnect"])
+        self.assertEqual(self.names(u"connect", k=1), [u"connect"])
+        self.assertEqual(self.names(u"Conn", smart_case=1), [u"Connection"])
+        self.assertEqual(self.names(u"conn", kinds=[u"c"]), [u"Connection"])
+        self.assertEqual(self.names(u"conn", paths=[u"/p/re"]), [u"reconnect"])
+        result = self.query(u"connect", k=1)["results"][0]
+        self.assertEqual(result["file"], u"/p/net/client.py")
+        self.assertEqual(result["prefix"], 2)
+        self.assertEqual(list(result["match_positions"]), range(7))
+        self.assertFalse(self.query(u"connect", budget=200)["partial"])
+
+    def test_query_indexed(self):
+        # same results when candidates come from the posting lists
+        self.put()
+        expected = [self.names(u"cnt"), self.names(u"cnt", k=2),
+                    self.names(u"cnt", kinds=[u"c"], paths=[u"/p/net"])]
+        index_min_tags = daemon.TagIndex.min_tags
+        daemon.TagIndex.min_tags = 0
+        try:
+            self.put()
+        finally:
+            daemon.TagIndex.min_tags = index_min_tags
+        self.assertTrue(self.daemon.projects[u"/p"][1].enabled)
+        self.assertEqual(sorted(expected[0]),
+                         [u"Connection", u"connect", u"reconnect"])
+        self.assertEqual([self.names(u"cnt"), self.names(u"cnt", k=2),
+                          self.names(u"cnt", kinds=[u"c"], paths=[u"/p/net"])],
+                         expected)
+
+    def test_update(self):
+        update = {"op": "update", "root": u"/p", "file": u"/p/retry.py",
+                  "tags": daemon.pack_tags([make_tag(u"retry", u"/p/retry.py")])}
+        self.assertEqual(self.daemon.handle(update),
+                         {"ok": True, "indexed": False})
+        self.put()
+        tags = self.daemon.projects[u"/p"][0]
+        self.assertEqual(self.daemon.handle(update),
+                         {"ok": True, "indexed": True})
+        self.assertEqual(self.names(u"conn"), [u"connect", u"Connection"])
+        self.assertEqual(self.names(u"retry"), [u"retry"])
+        self.assertEqual(self.names(u"retry", paths=[u"/p/retry"]), [u"retry"])
+        # tag lists in use by queries are never changed in place
+        self.assertEqual(len(tags), 3)
+        self.assertEqual(len(self.daemon.projects[u"/p"][0]), 3)
+
+    def test_drop(self):
+        self.put()
+        self.put(u"/q", [make_tag(u"other", u"/q/other.py")])
+        self.assertEqual(self.daemon.handle({"op": "drop", "root": u"/p"}),
+                         {"ok": True})
+        self.assertEqual(self.query(u"conn"), {"ok": True, "indexed": False})
+        self.assertIn(u"/q", self.daemon.projects)
+        # dropping an unknown project is not an error
+        self.assertEqual(self.daemon.handle({"op": "drop", "root": u"/p"}),
+                         {"ok": True})
+
+    def test_put_chunks(self):
+        put = {"op": "put", "root": u"/p", "upload": "u1", "more": True}
+        put["tags"] = daemon.pack_tags(TAGS[:1])
+        self.assertEqual(self.daemon.handle(put), {"ok": True})
+        put["tags"] = daemon.pack_tags(TAGS[1:2])
+        self.assertEqual(self.daemon.handle(put), {"ok": True})
+        # nothing is searchable until the last chunk arrives
+        self.assertEqual(self.query(u"conn"), {"ok": True, "indexed": False})
+        del put["more"]
+        put["tags"] = daemon.pack_tags(TAGS[2:])
+        self.assertEqual(self.daemon.handle(put), {"ok": True})
+        self.assertEqual(self.names(u"connect"),
+                         [u"connect", u"Connection", u"reconnect"])
+        self.assertEqual(self.daemon.uploads, {})
+
+    def test_put_abandoned(self):
+        put = {"op": "put", "root": u"/p", "upload": "u1", "more": True,
+               "tags": daemon.pack_tags(TAGS[:1])}
+        self.daemon.handle(put)
+        # the first upload never completes
+        self.put(tags=TAGS[2:])
+        self.assertEqual(self.names(u"connect"), [u"reconnect"])
+        self.daemon.handle(put)
+        self.daemon.handle({"op": "drop", "root": u"/p"})
+        self.assertEqual(self.daemon.uploads, {})
+
+    def test_protocol_errors(self):
+        for request in [{}, {"op": "unknown"}, {"op": "handle"},
+                        {"op": "status"}, {"op": "put", "root": u"/p"},
+                        {"op": "put", "root": u"/p", "tags": [[u"x"]]},
+                        {"op": "put", "root": u"/p", "tags": 42},
+                        {"op": "update", "root": u"/p"},
+                        {"op": "drop"}, {"op": "query"}]:
+            response = self.daemon.handle(request)
+            self.assertFalse(response["ok"], request)
+            self.assertIn("error", response)
+        self.assertEqual(self.daemon.handle({"op": "nope"})["error"],
+                         "unknown op: nope")
+        # failed requests leave the daemon state untouched
+        self.assertEqual(self.daemon.projects, {})
+
+    def test_query_errors(self):
+        self.put()
+        self.assertFalse(self.daemon.handle(
+            {"op": "query", "root": u"/p"})["ok"])
+        self.assertFalse(self.daemon.handle(
+            {"op": "query", "root": u"/p", "query": 42})["ok"])
+        self.assertFalse(self.daemon.handle(
+            {"op": "query", "root": u"/p", "query": u"c", "kinds": 42})["ok"])
+
+
+class DaemonClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "daemon.sock")
+        self.client = daemon.DaemonClient(self.path)
+
+    def tearDown(self):
+        self.client.close()
+        shutil.rmtree(self.dir)
+
+    def serve(self):
+        server = daemon._Server(self.path, daemon._Handler)
+        server.daemon = daemon.TagsDaemon()
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def test_put_in_chunks(self):
+        server = self.serve()
+        self.client.chunk_size = 2
+        self.assertEqual(self.client.put(u"/p", TAGS), {"ok": True})
+        self.assertEqual(len(server.daemon.projects[u"/p"][0]), 3)
+        self.assertEqual(server.daemon.uploads, {})
+        self.assertEqual(self.client.put(u"/q", []), {"ok": True})
+        self.assertEqual(server.daemon.projects[u"/q"][0], [])
+
+    def test_stale_socket(self):
+        # a socket nobody listens on, as left behind by a killed daemon
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.path)
+        sock.close()
+        self.assertTrue(self.client.available())
+        self.assertIsNone(self.client.status(u"/p"))
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(self.client.available())
+
+
+class PackTagsTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        self.assertEqual(daemon.unpack_tags(daemon.pack_tags(TAGS)), TAGS)
+
+
+if __name__ == "__main__":
+    unittest.main()
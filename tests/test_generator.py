@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+tests.test_generator
+~~~~~~~~~~~~~~~~~~~~
+
+Tests for `surfer.generator.TagsGenerator`, driven without Vim through the
+stub defined in `bench.vstub`. Tags are generated by a stand-in for ctags
+that makes a tag of every `def` line.
+"""
+
+import os
+import re
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "bench"))
+
+import vstub
+vstub.install()
+
+from surfer import daemon, mapped
+from surfer.finder import TagsFinder
+from surfer.generator import TagsGenerator
+from surfer.search import ranking
+
+
+def build_group(filetype, files, content=None):
+    """To generate tags for `files` the way `_build_group` does."""
+    tags = []
+    for file in files:
+        if content is None:
+            with open(file, "rb") as f:
+                content = f.read()
+        for i, line in enumerate(content.splitlines(), 1):
+            match = re.match(r"def (\w+)", line)
+            if match:
+                tags.append({"name": unicode(match.group(1)), "file": file,
+                             "cmd": unicode(i),
+                             "exts": {"kind": u"function", "line": unicode(i)}})
+        content = None
+    return tags, []
+
+
+class Project:
+
+    def __init__(self, root, files):
+        self.root = root
+        self.files = files
+
+    def get_root(self):
+        return self.root
+
+    def get_files(self, root=None):
+        return list(self.files)
+
+    def workspace_roots(self):
+        return [self.root]
+
+    def set_tagged_files(self, files):
+        pass
+
+
+class LocalDaemon(daemon.DaemonClient):
+    """To send requests straight to a `TagsDaemon`, without a socket."""
+
+    def __init__(self):
+        self.daemon = daemon.TagsDaemon()
+        self.requests = []
+
+    def available(self):
+        return True
+
+    def request(self, request, timeout=None, interrupt=None):
+        self.requests.append(request)
+        response = self.daemon.handle(request)
+        return response if response["ok"] else None
+
+
+class Plugin:
+    pass
+
+
+class ProjectSearchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="surfer-test")
+        vstub.set_option("cache_dir", os.path.join(self.root, "cache"))
+        self.files = [os.path.join(self.root, name) for name in "ab"]
+        self.writes = 0
+        self.write(self.files[0], "def alpha():\ndef beta():\n")
+        self.write(self.files[1], "def gamma():\n")
+        self.plug = Plugin()
+        self.plug.project = Project(self.root, self.files)
+        self.plug.daemon = LocalDaemon()
+        self.generator = TagsGenerator(self.plug)
+        self.generator._build_group = build_group
+
+    def tearDown(self):
+        self.generator.close()
+        vstub.variables.update(vstub.defaults)
+        shutil.rmtree(self.root)
+
+    def write(self, file, content):
+        with open(file, "wb") as f:
+            f.write(content)
+        # the modification time must change even on coarse file systems
+        self.writes += 1
+        mtime = time.time() + self.writes
+        os.utime(file, (mtime, mtime))
+
+    def search_mapped(self, query):
+        index, overlay = self.generator.get_mapped("#", self.files[0])
+        names = [r["name"] for r in index.search(query, -1, True,
+                                                 exclude=set(overlay))]
+        for tags in overlay.values():
+            names.extend(t["name"] for t in tags if query in t["name"])
+        return sorted(names)
+
+    def search_daemon(self, query):
+        root = self.generator.sync_daemon("#", self.files[0])
+        response = self.plug.daemon.query(root, query, -1, 1, 0)
+        return sorted(r["name"] for r in response["results"])
+
+    @unittest.skipIf(mapped.search_mapped is None,
+                     "the C extension is not compiled")
+    def test_mapped_file_changed(self):
+        self.assertEqual(self.search_mapped(u"a"), [u"alpha", u"beta",
+                                                    u"gamma"])
+        self.write(self.files[1], "def delta():\n")
+        # typing the project search modifier again
+        self.generator.invalidate()
+        self.assertEqual(self.search_mapped(u"a"), [u"alpha", u"beta",
+                                                    u"delta"])
+
+    def test_daemon_file_changed(self):
+        self.assertEqual(self.search_daemon(u"a"), [u"alpha", u"beta",
+                                                    u"gamma"])
+        self.write(self.files[1], "def delta():\n")
+        self.generator.invalidate()
+        del self.plug.daemon.requests[:]
+        self.assertEqual(self.search_daemon(u"a"), [u"alpha", u"beta",
+                                                    u"delta"])
+        # only the changed file is sent again
+        updates = [r["file"] for r in self.plug.daemon.requests
+                   if r["op"] == "update"]
+        self.assertEqual(updates, [self.files[1]])
+
+
+class MemoryBudgetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="surfer-test")
+        self.files = []
+        for name in "abcd":
+            self.files.append(os.path.join(self.root, name))
+            with open(self.files[-1], "wb") as f:
+                f.write("def {0}_one():\ndef {0}_two():\n".format(name))
+        self.built = []
+        self.plug = Plugin()
+        self.plug.project = Project(self.root, self.files)
+        self.generator = TagsGenerator(self.plug)
+        self.generator._build_group = self.build_group
+        vstub.set_option("memory_budget", 1)
+        # tags of a single file take more than that
+        self.generator.tags_share = 1e-4
+        # eviction doesn't depend on the C extension
+        self.search_mapped = mapped.search_mapped
+        mapped.search_mapped = None
+
+    def tearDown(self):
+        mapped.search_mapped = self.search_mapped
+        self.generator.close()
+        vstub.variables.update(vstub.defaults)
+        vstub.bufname_path = None
+        shutil.rmtree(self.root)
+
+    def build_group(self, filetype, files, content=None):
+        self.built.extend(files)
+        return build_group(filetype, files, content)
+
+    def names(self):
+        names = [t["name"] for t in self.generator.all_tags()]
+        for file in self.generator.spill.files:
+            names.extend(t["name"] for t in self.generator.spill.load(file))
+        return sorted(names)
+
+    def test_evicted_then_entered(self):
+        vstub.bufname_path = self.files[0]
+        self.generator.get_tags("@", self.files[0])
+        # the tags of the current buffer are never evicted
+        self.assertEqual(sorted(self.generator.spill.files), self.files[1:])
+        self.assertEqual(len(self.generator.all_tags()), 2)
+        self.assertEqual(self.generator.index.budget,
+                         1048576 - self.generator.tags_memory)
+        del self.built[:]
+        vstub.bufname_path = self.files[1]
+        self.generator.buffer_entered(2)
+        # tags are read back from the spill, without running ctags
+        self.assertEqual(self.built, [])
+        self.assertNotIn(self.files[1], self.generator.spill)
+        self.assertIn(self.files[1], self.generator.file_tags)
+        self.assertEqual([t["name"] for t in
+                          self.generator.file_tags[self.files[1]]],
+                         [u"b_one", u"b_two"])
+
+    def test_workspace_changed(self):
+        self.generator.get_tags("@", None)
+        self.assertEqual(len(self.generator.spill), 4)
+        del self.built[:]
+        with open(self.files[2], "wb") as f:
+            f.write("def c_three():\n")
+        mtime = time.time() + 1
+        os.utime(self.files[2], (mtime, mtime))
+        self.generator.invalidate()
+        self.generator.get_tags("@", None)
+        # only the file changed on disk is tagged again
+        self.assertEqual(self.built, [self.files[2]])
+        self.assertEqual(self.names(), [u"a_one", u"a_two", u"b_one",
+                                        u"b_two", u"c_three", u"d_one",
+                                        u"d_two"])
+
+    def test_no_budget(self):
+        vstub.set_option("memory_budget", 0)
+        self.generator.get_tags("@", None)
+        self.assertEqual(len(self.generator.spill), 0)
+        self.assertEqual(len(self.generator.all_tags()), 8)
+
+
+class Clock:
+    """To stand in for the `time` module: each call takes one second."""
+
+    def __init__(self):
+        self.now = 0
+
+    def time(self):
+        self.now += 1
+        return self.now
+
+
+class PartialResultsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="surfer-test")
+        self.files = []
+        for name in "abc":
+            self.files.append(os.path.join(self.root, name))
+            with open(self.files[-1], "wb") as f:
+                f.write("def {}_one():\n".format(name))
+        self.plug = Plugin()
+        self.plug.project = Project(self.root, self.files)
+        self.generator = TagsGenerator(self.plug)
+        self.generator._build_group = build_group
+        self.finder = TagsFinder(self.plug, self.generator)
+        self.finder.chunk_size = 1
+        vstub.set_option("search_time_budget", 1)
+        ranking.time = Clock()
+
+    def tearDown(self):
+        ranking.time = time
+        self.generator.close()
+        vstub.variables.update(vstub.defaults)
+        shutil.rmtree(self.root)
+
+    def test_partial(self):
+        # the budget is exceeded after the first chunk
+        self.assertEqual(len(self.finder.find_tags(u"@one")), 1)
+        self.assertTrue(self.finder.partial)
+        self.assertEqual(len(self.finder.find_tags(u"@one", complete=True)), 3)
+        self.assertFalse(self.finder.partial)
+
+    def test_no_budget(self):
+        vstub.set_option("search_time_budget", 0)
+        self.assertEqual(len(self.finder.find_tags(u"@one")), 3)
+        self.assertFalse(self.finder.partial)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+tests.test_index
+~~~~~~~~~~~~~~~~
+
+Tests for `surfer.index`.
+"""
+
+import os
+import sys
+import unittest
+import threading
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "autoload"))
+
+from surfer.index import (TagIndex, NameIndex, PathTrie, ShortPaths,
+                          filter_tags)
+
+
+def make_tag(name, file, kind=u"f", line=1):
+    return {"name": name, "file": file, "cmd": unicode(line),
+            "exts": {"kind": kind, "line": unicode(line)}}
+
+
+def names(tags):
+    return sorted(t["name"] for t in tags)
+
+
+class TagIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = TagIndex(budget=1 << 30)
+        self.index.min_tags = 0
+        self.tags = [
+            make_tag(u"user_name", u"/p/a/models.py", u"v"),
+            make_tag(u"UserManager", u"/p/a/models.py", u"c"),
+            make_tag(u"update", u"/p/b/views.py", u"f"),
+            make_tag(u"render", u"/p/b/views.py", u"f"),
+            make_tag(u"username", u"/q/users.py", u"f"),
+        ]
+        self.index.build(self.tags)
+
+    def test_candidates(self):
+        self.assertTrue(self.index.enabled)
+        self.assertEqual(names(self.index.candidates(u"usn")),
+                         [u"UserManager", u"user_name", u"username"])
+        self.assertEqual(names(self.index.candidates(u"ue")),
+                         [u"UserManager", u"update", u"user_name", u"username"])
+        self.assertEqual(self.index.candidates(u"xyz"), [])
+
+    def test_candidates_filters(self):
+        self.assertEqual(names(self.index.candidates(u"us", kinds=[u"f"])),
+                         [u"username"])
+        self.assertEqual(names(self.index.candidates(u"u", paths=[u"/p/b"])),
+                         [u"update"])
+        self.assertEqual(names(self.index.candidates(u"u", kinds=[u"c", u"v"],
+                                                     paths=[u"/p/a"])),
+                         [u"UserManager", u"user_name"])
+
+    def test_candidates_disabled(self):
+        index = TagIndex(budget=0)
+        index.build(self.tags)
+        self.assertFalse(index.enabled)
+        self.assertIsNone(index.candidates(u"u"))
+        self.assertEqual(names(index.scoped([u"/p/b"])), [u"render", u"update"])
+
+    def test_build_over_budget(self):
+        index = TagIndex(budget=1)
+        index.min_tags = 0
+        index.build(self.tags)
+        self.assertFalse(index.enabled)
+        self.assertEqual(index.tags, [])
+        # tags are still partitioned by file
+        self.assertEqual(names(index.scoped([u"/q"])), [u"username"])
+
+    def test_replace_file(self):
+        self.index.replace_file(u"/p/b/views.py",
+                                [make_tag(u"upsert", u"/p/b/views.py")])
+        self.assertEqual(names(self.index.candidates(u"up")), [u"upsert"])
+        self.assertEqual(self.index.candidates(u"render"), [])
+        self.assertEqual(self.index.dead, 2)
+        self.assertEqual(names(self.index.scoped([u"/p/b"])), [u"upsert"])
+        self.assertEqual(names(self.index.prefixed(u"up", True)), [u"upsert"])
+
+    def test_replace_new_file(self):
+        self.index.replace_file(u"/r/new.py", [make_tag(u"unused", u"/r/new.py")])
+        self.assertEqual(names(self.index.candidates(u"unu")), [u"unused"])
+        self.assertEqual(names(self.index.scoped([u"/r"])), [u"unused"])
+
+    def test_replace_file_rebuilds(self):
+        # once dead ids are the majority the index is rebuilt from scratch
+        self.index.replace_file(u"/p/a/models.py", [])
+        self.assertEqual(self.index.dead, 2)
+        self.index.replace_file(u"/p/b/views.py", [])
+        self.assertEqual(self.index.dead, 0)
+        self.assertEqual(names(self.index.tags), [u"username"])
+        self.assertEqual(names(self.index.candidates(u"u")), [u"username"])
+        self.assertTrue(self.index.enabled)
+
+    def test_replace_file_over_budget(self):
+        self.index.budget = self.index.memory()
+        self.index.replace_file(u"/q/users.py",
+                                [make_tag(u"u%d" % i, u"/q/users.py")
+                                 for i in range(10)])
+        self.assertFalse(self.index.enabled)
+        self.assertIsNone(self.index.candidates(u"u"))
+        self.assertEqual(len(self.index.scoped([u"/q"])), 10)
+
+    def test_replace_file_disabled(self):
+        index = TagIndex(budget=0)
+        index.build(self.tags)
+        index.replace_file(u"/q/users.py", [make_tag(u"login", u"/q/users.py")])
+        self.assertEqual(names(index.scoped([u"/q"])), [u"login"])
+        self.assertEqual(names(index.prefixed(u"log", True)), [u"login"])
+
+    def test_tags_prepared(self):
+        self.assertTrue(all("meta" in t for t in self.tags))
+        tag = make_tag(u"fresh", u"/q/users.py")
+        self.index.replace_file(u"/q/users.py", [tag])
+        self.assertIn("meta", tag)
+
+
+class BackgroundTagIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = TagIndex(budget=1 << 30, background=True)
+        self.index.min_tags = 0
+        self.tags = [
+            make_tag(u"update", u"/p/views.py"),
+            make_tag(u"render", u"/p/views.py"),
+            make_tag(u"username", u"/q/users.py"),
+        ]
+        # posting lists are handed over only once `release` is set
+        self.release = threading.Event()
+        build = self.index._build_in_background
+        def blocked(*args):
+            self.release.wait()
+            build(*args)
+        self.index._build_in_background = blocked
+
+    def tearDown(self):
+        self.release.set()
+        self.index.wait()
+
+    def test_build(self):
+        self.index.build(self.tags)
+        # until posting lists are ready all tags must be searched
+        self.assertIsNone(self.index.candidates(u"u"))
+        self.assertEqual(names(self.index.prefixed(u"up", True)), [u"update"])
+        self.release.set()
+        self.index.wait()
+        self.assertTrue(self.index.enabled)
+        self.assertEqual(names(self.index.candidates(u"u")),
+                         [u"update", u"username"])
+
+    def test_replace_file_while_building(self):
+        self.index.build(self.tags)
+        self.index.replace_file(u"/p/views.py",
+                                [make_tag(u"upsert", u"/p/views.py")])
+        self.release.set()
+        self.index.wait()
+        self.assertEqual(names(self.index.candidates(u"u")),
+                         [u"upsert", u"username"])
+        self.assertEqual(self.index.candidates(u"render"), [])
+
+    def test_built_for_old_tags(self):
+        self.index.build(self.tags)
+        builder = self.index.builder
+        self.index.build(self.tags[:1])
+        self.release.set()
+        builder.join()
+        self.index.wait()
+        self.assertEqual(names(self.index.candidates(u"u")), [u"update"])
+
+
+class NameIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = NameIndex()
+        self.index.build([
+            make_tag(u"get", u"/a.py"),
+            make_tag(u"getUser", u"/a.py"),
+            make_tag(u"GetAll", u"/b.py"),
+            make_tag(u"set", u"/b.py"),
+        ])
+
+    def test_find(self):
+        self.assertEqual(names(self.index.find(u"get", False)),
+                         [u"GetAll", u"get", u"getUser"])
+        self.assertEqual(names(self.index.find(u"Get", True)), [u"GetAll"])
+        self.assertEqual(self.index.find(u"x", False), [])
+        self.assertEqual(self.index.find(u"", False), [])
+
+    def test_replace_file(self):
+        self.index.replace_file(u"/a.py", [make_tag(u"getter", u"/a.py")])
+        self.assertEqual(names(self.index.find(u"get", False)),
+                         [u"GetAll", u"getter"])
+        self.index.replace_file(u"/a.py", [make_tag(u"sets", u"/a.py")])
+        self.assertEqual(names(self.index.find(u"get", False)), [u"GetAll"])
+        self.assertEqual(names(self.index.find(u"set", False)),
+                         [u"set", u"sets"])
+
+    def test_replace_file_rebuilds(self):
+        self.index.max_pending = 2
+        self.index.replace_file(u"/c.py", [make_tag(u"getC%d" % i, u"/c.py")
+                                           for i in range(3)])
+        self.assertEqual(self.index.pending, [])
+        self.assertEqual(len(self.index.tags), 7)
+        self.assertEqual(len(self.index.find(u"getc", False)), 3)
+
+
+class PathTrieTest(unittest.TestCase):
+
+    def test_find(self):
+        trie = PathTrie([u"/src/utils/misc.py", u"/src/ut.py", u"/src/core.py",
+                         u"/lib/utils.py"])
+        self.assertEqual(sorted(trie.find(u"/src/ut")),
+                         [u"/src/ut.py", u"/src/utils/misc.py"])
+        self.assertEqual(trie.find(u"/src/utils/"), [u"/src/utils/misc.py"])
+        self.assertEqual(trie.find(u"/nowhere/x"), [])
+        self.assertEqual(trie.find_many([u"/src/c", u"/lib", u"/src/core"]),
+                         set([u"/src/core.py", u"/lib/utils.py"]))
+
+
+class FilterTagsTest(unittest.TestCase):
+
+    def test_filter(self):
+        tags = [make_tag(u"a", u"/x/a.py", u"function"),
+                make_tag(u"b", u"/x/b.py", u"class"),
+                make_tag(u"c", u"/y/c.py", u"function")]
+        self.assertEqual(filter_tags(tags, [], []), tags)
+        self.assertEqual(names(filter_tags(tags, [u"fun"], [])), [u"a", u"c"])
+        self.assertEqual(names(filter_tags(tags, [u"f"], [u"/y"])), [u"c"])
+        self.assertEqual(filter_tags(tags, [u"v"], []), [])
+
+
+class ShortPathsTest(unittest.TestCase):
+
+    def test_suffixes(self):
+        paths = ShortPaths([u"/p/core/misc.py", u"/p/utils/misc.py",
+                            u"/p/main.py"])
+        self.assertEqual(paths.get(u"/p/core/misc.py"), u"core/misc.py")
+        self.assertEqual(paths.get(u"/p/main.py"), u"main.py")
+        self.assertEqual(paths.get(u"/elsewhere/other.py"), u"other.py")
+        paths.add([u"/q/core/misc.py"])
+        self.assertEqual(paths.get(u"/p/core/misc.py"), u"p/core/misc.py")
+        self.assertEqual(paths.get(u"/p/utils/misc.py"), u"utils/misc.py")
+        self.assertEqual(len(paths), 4)
+
+    def test_remove(self):
+        paths = ShortPaths([u"/p/core/misc.py", u"/p/utils/misc.py"])
+        paths.remove([u"/p/utils/misc.py"])
+        self.assertEqual(paths.get(u"/p/core/misc.py"), u"misc.py")
+        self.assertEqual(paths.suffixes, {})
+        paths.remove([u"/p/core/misc.py", u"/not/there.py"])
+        self.assertEqual(len(paths), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+tests.test_mapped
+~~~~~~~~~~~~~~~~~
+
+Tests for `surfer.mapped`. Searches are run both with the C extension, when
+it has been compiled, and without it.
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "autoload"))
+
+from surfer import mapped
+
+
+def make_tag(name, file, kind=u"f", line=1):
+    return {"name": name, "file": file, "cmd": unicode(line),
+            "exts": {"kind": kind, "line": unicode(line)}}
+
+
+TAGS = [
+    make_tag(u"get", u"/p/a.py", u"function", 1),
+    make_tag(u"getUser", u"/p/a.py", u"function", 2),
+    make_tag(u"GetAll", u"/p/sub/b.py", u"class", 3),
+    make_tag(u"target", u"/p/sub/b.py", u"variable", 4),
+    make_tag(u"gadget", u"/q/c.py", u"function", 5),
+    make_tag(u"unrelated", u"/q/c.py", u"function", 6),
+    {"name": u"héllo", "file": u"/q/c.py", "cmd": u"/^héllo$/",
+     "exts": {"kind": u"function", "line": u"7"}},
+]
+
+
+class MappedIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="surfer-test")
+        self.path = os.path.join(self.directory, "index")
+        mtimes = {u"/p/a.py": 1.0, u"/p/sub/b.py": 2.0, u"/q/c.py": 3.0,
+                  u"/q/empty.py": 4.0}
+        mapped.write(self.path, TAGS, mtimes)
+        self.index = mapped.MappedIndex(self.path)
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.directory)
+
+    def search(self, query, max_results=-1, smart_case=True, **kwargs):
+        results = self.index.search(query, max_results, smart_case, **kwargs)
+        return [r["name"] for r in results]
+
+    def test_read(self):
+        self.assertEqual(len(self.index), len(TAGS))
+        self.assertEqual(self.index.mtimes[u"/q/empty.py"], 4.0)
+        for i in xrange(len(self.index)):
+            tag = self.index.tag(i)
+            self.assertIn(tag, TAGS)
+            self.assertEqual(self.index.name(i), tag["name"])
+
+    def test_ranges(self):
+        # tags are grouped by file
+        self.assertEqual(self.index.ranges[u"/q/empty.py"][1], 0)
+        for file in (u"/p/a.py", u"/p/sub/b.py", u"/q/c.py"):
+            first, count = self.index.ranges[file]
+            self.assertEqual(
+                [self.index.tag(i) for i in xrange(first, first + count)],
+                [t for t in TAGS if t["file"] == file])
+        ids = self.index._scope_ids([u"/p"])
+        self.assertEqual(list(ids), sorted(ids))
+        self.assertEqual(sorted(self.index.tag(i)["file"] for i in ids),
+                         [u"/p/a.py"] * 2 + [u"/p/sub/b.py"] * 2)
+        self.assertEqual(
+            [self.index.name(i) for i in self.index._scope_ids(
+                [u"/p", u"/q"], exclude=set([u"/p/a.py"]), kinds=[u"c"])],
+            [u"GetAll"])
+
+    def test_invalid(self):
+        with open(self.path, "wb") as f:
+            f.write("not an index" * 10)
+        self.assertRaises(ValueError, mapped.MappedIndex, self.path)
+        with open(self.path, "wb") as f:
+            f.write("short")
+        self.assertRaises(ValueError, mapped.MappedIndex, self.path)
+        self.assertRaises(IOError, mapped.MappedIndex,
+                          os.path.join(self.directory, "missing"))
+
+    def test_tiers(self):
+        # the exact match comes first, then names starting with the query
+        # and then all other matches
+        results = self.index.search(u"get", -1, False)
+        self.assertEqual([r["name"] for r in results[:1]], [u"get"])
+        self.assertEqual(sorted(r["name"] for r in results[1:3]),
+                         [u"GetAll", u"getUser"])
+        self.assertEqual(sorted(r["name"] for r in results[3:]),
+                         [u"gadget", u"target"])
+        self.assertEqual([r["prefix"] for r in results], [2, 1, 1, 0, 0])
+        self.assertEqual(len(set(r["name"] for r in results)), len(results))
+
+    def test_max_results(self):
+        self.assertEqual(self.search(u"get", 1), [u"get"])
+        self.assertEqual(len(self.search(u"get", 3, False)), 3)
+        self.assertEqual(self.search(u"get", 0), [])
+
+    def test_smart_case(self):
+        self.assertEqual(self.search(u"Get")[:1], [u"GetAll"])
+        self.assertNotIn(u"get", self.search(u"Get"))
+        self.assertEqual(self.search(u"héllo"), [u"héllo"])
+
+    def test_kinds(self):
+        self.assertEqual(sorted(self.search(u"get", kinds=[u"fun"])),
+                         [u"gadget", u"get", u"getUser"])
+        self.assertEqual(self.search(u"get", kinds=[u"c"]), [u"GetAll"])
+        self.assertEqual(sorted(self.search(u"get", kinds=[u"c", u"v"])),
+                         [u"GetAll", u"target"])
+        self.assertEqual(self.search(u"get", kinds=[u"macro"]), [])
+
+    def test_paths(self):
+        self.assertEqual(sorted(self.search(u"get", paths=[u"/p/sub"])),
+                         [u"GetAll", u"target"])
+        self.assertEqual(sorted(self.search(u"get", paths=[u"/p/a", u"/q"])),
+                         [u"gadget", u"get", u"getUser"])
+        self.assertEqual(self.search(u"get", paths=[u"/nowhere"]), [])
+
+    def test_exclude(self):
+        self.assertEqual(sorted(self.search(u"get", exclude=set([u"/p/a.py"]))),
+                         [u"GetAll", u"gadget", u"target"])
+        self.assertEqual(self.search(u"get", exclude=set([u"/p/a.py"]),
+                                     paths=[u"/p"], kinds=[u"f"]), [])
+        self.assertEqual(self.search(u"get", exclude=set([u"/p/sub/b.py"]),
+                                     paths=[u"/p/sub", u"/q"]), [u"gadget"])
+        # unknown files are ignored
+        self.assertEqual(len(self.search(u"get", exclude=set([u"/x.py"]))), 5)
+
+    def test_results(self):
+        result = self.index.search(u"gadget", 1, True)[0]
+        self.assertEqual(result["file"], u"/q/c.py")
+        self.assertEqual(result["cmd"], u"5")
+        self.assertEqual(result["exts"]["kind"], u"function")
+        self.assertEqual(tuple(result["match_positions"]), tuple(range(6)))
+        self.assertEqual(result["prefix"], 2)
+        self.assertEqual(self.index.search(u"héllo", 1, True)[0]["cmd"],
+                         u"/^héllo$/")
+
+    def test_rewrite(self):
+        # the index file is replaced while still open
+        mapped.write(self.path, TAGS[:1], {u"/p/a.py": 5.0})
+        self.assertEqual(len(self.index), len(TAGS))
+        self.assertEqual(self.search(u"gadget"), [u"gadget"])
+        index = mapped.MappedIndex(self.path)
+        try:
+            self.assertEqual(len(index), 1)
+            self.assertEqual(index.mtimes, {u"/p/a.py": 5.0})
+        finally:
+            index.close()
+
+
+class PythonMappedIndexTest(MappedIndexTest):
+    """To run the same tests without the C extension."""
+
+    def setUp(self):
+        self.search_mapped = mapped.search_mapped
+        mapped.search_mapped = None
+        MappedIndexTest.setUp(self)
+
+    def tearDown(self):
+        mapped.search_mapped = self.search_mapped
+        MappedIndexTest.tearDown(self)
+
+
+if __name__ == "__main__":
+    unittest.main()
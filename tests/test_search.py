@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+tests.test_search
+~~~~~~~~~~~~~~~~~
+
+Tests for the matching function, both the pure Python one in
+`surfer.search.search` and the C extension, when it has been compiled.
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "autoload"))
+
+from surfer.search import search
+
+try:
+    from surfer.ext import search as ext
+except ImportError:
+    ext = None
+
+
+NAMES = [u"user_name", u"UserManager", u"getUser", u"GetAll", u"get",
+         u"ABX", u"config_file_get", u"a-b-c", u"parse_args", u"héllo_wörld"]
+QUERIES = [u"u", u"usn", u"um", u"get", u"gu", u"GA", u"x", u"cfg", u"abc",
+           u"pa", u"hw", u"a"]
+
+
+class MatchTest(unittest.TestCase):
+
+    match = staticmethod(search.match)
+    prepare = staticmethod(search.prepare)
+
+    def assertMatch(self, query, name, similarity, positions, smart_case=True):
+        s, p = self.match(query, name, smart_case)
+        self.assertEqual(p, positions)
+        self.assertAlmostEqual(s, similarity, places=4)
+        s, p = self.match(query, name, smart_case, self.prepare(name))
+        self.assertEqual(p, positions)
+        self.assertAlmostEqual(s, similarity, places=4)
+
+    def test_no_match(self):
+        self.assertEqual(self.match(u"z", u"abc", True)[1], ())
+        self.assertEqual(self.match(u"", u"abc", True)[1], ())
+        self.assertEqual(self.match(u"A", u"abc", True)[1], ())
+
+    def test_negative_similarity(self):
+        # the best match is kept even when its similarity is negative
+        self.assertMatch(u"a", u"aa", -1.5, (0,))
+        self.assertMatch(u"b", u"aB", -0.5, (1,))
+
+    def test_word_boundaries(self):
+        # word boundaries weigh 1.5
+        self.assertMatch(u"ab", u"a_b", 1.0, (0, 2))
+        self.assertMatch(u"gu", u"getUser", 2.5, (0, 3))
+        # an uppercase character is a word boundary, not the one after it
+        self.assertMatch(u"ge", u"getUser", 0.0, (0, 1))
+        self.assertMatch(u"us", u"getUser", 3.0, (3, 4))
+        # in names with only uppercase characters none is a boundary
+        self.assertMatch(u"x", u"ABX", 2.0, (2,))
+
+    def test_gravity(self):
+        # gravity is not rounded
+        self.assertMatch(u"usn", u"user_name", 10 / 3.0, (0, 1, 5))
+
+    def test_smart_case(self):
+        self.assertMatch(u"GA", u"GetAll", 2.5, (0, 3))
+        self.assertEqual(self.match(u"GA", u"getall", True)[1], ())
+        self.assertEqual(self.match(u"GA", u"getall", False)[1], (0, 3))
+
+
+@unittest.skipIf(ext is None, "the C extension is not compiled")
+class ExtMatchTest(MatchTest):
+
+    match = staticmethod(ext.match if ext else None)
+    prepare = staticmethod(ext.prepare if ext else None)
+
+    def test_same_as_python(self):
+        for query in QUERIES:
+            for name in NAMES:
+                for smart_case in (True, False):
+                    s, p = ext.match(query, name, smart_case)
+                    py_s, py_p = search.match(query, name, smart_case)
+                    self.assertEqual(p, py_p, (query, name))
+                    self.assertAlmostEqual(s, py_s, places=4)
+
+
+if __name__ == "__main__":
+    unittest.main()
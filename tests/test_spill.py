@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+tests.test_spill
+~~~~~~~~~~~~~~~~
+
+Tests for `surfer.spill`.
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "autoload"))
+
+from surfer import mapped
+from surfer.spill import TagSpill
+
+
+def make_tag(name, file, kind=u"f", line=1):
+    return {"name": name, "file": file, "cmd": unicode(line),
+            "exts": {"kind": kind, "line": unicode(line)}}
+
+
+class TagSpillTest(unittest.TestCase):
+
+    def setUp(self):
+        self.spill = TagSpill()
+
+    def tearDown(self):
+        self.spill.clear()
+
+    def search(self, query, max_results=-1, **kwargs):
+        return [(r["name"], r["file"]) for r in
+                self.spill.search(query, max_results, True, **kwargs)]
+
+    def test_empty(self):
+        self.spill.add([])
+        self.assertIsNone(self.spill.directory)
+        self.assertEqual(self.search(u"x"), [])
+        self.assertEqual(self.spill.memory(), (0, 0))
+
+    def test_search_segments(self):
+        self.spill.add([make_tag(u"parse", u"/a.py"),
+                        make_tag(u"parser", u"/a.py")])
+        self.spill.add([make_tag(u"sparse", u"/b.py", u"v"),
+                        make_tag(u"parse", u"/b.py")])
+        self.assertEqual(len(self.spill), 2)
+        self.assertIn(u"/a.py", self.spill)
+        self.assertEqual(self.spill.memory()[0], 4)
+        results = self.search(u"parse")
+        # exact matches of both segments come before the others
+        self.assertEqual(sorted(results[:2]),
+                         [(u"parse", u"/a.py"), (u"parse", u"/b.py")])
+        self.assertEqual(results[2:], [(u"parser", u"/a.py"),
+                                       (u"sparse", u"/b.py")])
+        self.assertEqual(len(self.search(u"parse", 3)), 3)
+        self.assertEqual(self.search(u"parse", kinds=[u"v"]),
+                         [(u"sparse", u"/b.py")])
+        self.assertEqual(self.search(u"parse", paths=[u"/a"]),
+                         [(u"parse", u"/a.py"), (u"parser", u"/a.py")])
+
+    def test_file_spilled_again(self):
+        # only the most recent tags of a file are searched
+        self.spill.add([make_tag(u"old", u"/a.py"), make_tag(u"keep", u"/b.py")])
+        self.spill.add([make_tag(u"new", u"/a.py")])
+        self.assertEqual(self.search(u"old"), [])
+        self.assertEqual(self.search(u"new"), [(u"new", u"/a.py")])
+        self.assertEqual(self.search(u"keep"), [(u"keep", u"/b.py")])
+
+    def test_drop(self):
+        self.spill.add([make_tag(u"one", u"/a.py"), make_tag(u"two", u"/b.py")])
+        path = self.spill.segments[0].path
+        self.spill.drop(u"/a.py")
+        self.assertEqual(self.search(u"one"), [])
+        self.assertEqual(self.search(u"two"), [(u"two", u"/b.py")])
+        self.assertTrue(os.path.exists(path))
+        # segments are deleted once none of their files is searched
+        self.spill.drop(u"/b.py")
+        self.spill.drop(u"/unknown.py")
+        self.assertEqual(self.spill.segments, [])
+        self.assertFalse(os.path.exists(path))
+
+    def test_load(self):
+        directory = tempfile.mkdtemp(prefix="surfer-test")
+        try:
+            path = os.path.join(directory, "a.py")
+            with open(path, "wb") as f:
+                f.write("")
+            tags = [make_tag(u"one", path, line=1), make_tag(u"other", u"/b.py"),
+                    make_tag(u"two", path, line=2)]
+            self.spill.add(tags)
+            self.assertEqual(self.spill.load(path), [tags[0], tags[2]])
+            self.assertIsNone(self.spill.load(u"/unknown.py"))
+            # tags are no longer valid once the file has been modified
+            os.utime(path, (0, 0))
+            self.assertIsNone(self.spill.load(path))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_clear(self):
+        self.spill.add([make_tag(u"one", u"/a.py")])
+        directory = self.spill.directory
+        self.spill.clear()
+        self.assertEqual(len(self.spill), 0)
+        self.assertFalse(os.path.exists(directory))
+        self.assertEqual(self.search(u"one"), [])
+
+
+class PythonTagSpillTest(TagSpillTest):
+    """To run the same tests without the C extension."""
+
+    def setUp(self):
+        self.search_mapped = mapped.search_mapped
+        mapped.search_mapped = None
+        TagSpillTest.setUp(self)
+
+    def tearDown(self):
+        mapped.search_mapped = self.search_mapped
+        TagSpillTest.tearDown(self)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+tests.test_tagcache
+~~~~~~~~~~~~~~~~~~~
+
+Tests for `surfer.tagcache`.
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "autoload"))
+
+from surfer.tagcache import TagCache
+
+
+def make_tag(name, file, kind=u"f", line=1):
+    return {"name": name, "file": file, "cmd": unicode(line),
+            "exts": {"kind": kind, "line": unicode(line)}}
+
+
+class TagCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="surfer-test")
+        self.cache = TagCache(self.directory, 1 << 20)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_key(self):
+        key = self.cache.key("content", "ctags -f - .py")
+        self.assertEqual(key, self.cache.key("content", "ctags -f - .py"))
+        self.assertNotEqual(key, self.cache.key("content", "ctags -f - .c"))
+        self.assertNotEqual(key, self.cache.key("content!", "ctags -f - .py"))
+        # parameters and content are kept apart
+        self.assertNotEqual(self.cache.key("b", "a"), self.cache.key("", "ab"))
+
+    def test_get_put(self):
+        key = self.cache.key("def f(): pass", "ctags")
+        self.assertIsNone(self.cache.get(key, u"/a.py"))
+        self.cache.put(key, [make_tag(u"f", u"/a.py"), make_tag(u"g", u"/a.py")])
+        # tags are returned as tags of the file asked for
+        self.assertEqual(self.cache.get(key, u"/copy/a.py"),
+                         [make_tag(u"f", u"/copy/a.py"),
+                          make_tag(u"g", u"/copy/a.py")])
+        self.cache.put(key, [])
+        self.assertEqual(self.cache.get(key, u"/a.py"), [])
+
+    def test_corrupted_entry(self):
+        key = self.cache.key("content", "ctags")
+        self.cache.put(key, [make_tag(u"f", u"/a.py")])
+        with open(self.cache._path(key), "wb") as f:
+            f.write("[not json")
+        self.assertIsNone(self.cache.get(key, u"/a.py"))
+
+    def test_size(self):
+        key = self.cache.key("content", "ctags")
+        self.cache.put(key, [make_tag(u"f", u"/a.py")])
+        size = os.path.getsize(self.cache._path(key))
+        self.assertEqual(self.cache.size, size)
+        # replacing an entry doesn't count it twice
+        self.cache.put(key, [make_tag(u"f", u"/a.py")])
+        self.assertEqual(self.cache.size, size)
+
+    def test_eviction(self):
+        keys = [self.cache.key(str(i), "ctags") for i in range(10)]
+        tags = [make_tag(u"tag%d" % j, u"/a.py") for j in range(10)]
+        for i, key in enumerate(keys):
+            self.cache.put(key, tags)
+            os.utime(self.cache._path(key), (1000 + i, 1000 + i))
+        size = self.cache.size
+        entry_size = size // len(keys)
+
+        # using an entry makes it the most recently used one
+        self.assertIsNotNone(self.cache.get(keys[0], u"/a.py"))
+
+        self.cache.max_size = size
+        self.cache.put(self.cache.key("new", "ctags"), tags)
+        target = self.cache.max_size * self.cache.low_watermark
+        self.assertTrue(self.cache.size <= target)
+        self.assertTrue(self.cache.size > target - entry_size)
+        self.assertEqual(self.cache.size, self.cache._disk_usage())
+        # the least recently used entries are gone
+        self.assertIsNone(self.cache.get(keys[1], u"/a.py"))
+        self.assertIsNone(self.cache.get(keys[2], u"/a.py"))
+        self.assertIsNotNone(self.cache.get(keys[0], u"/a.py"))
+        self.assertIsNotNone(self.cache.get(keys[9], u"/a.py"))
+
+    def test_size_on_first_use(self):
+        key = self.cache.key("content", "ctags")
+        self.cache.put(key, [make_tag(u"f", u"/a.py")])
+        # a new instance finds the entries written by the previous one
+        cache = TagCache(self.directory, 1 << 20)
+        cache.put(cache.key("other", "ctags"), [make_tag(u"g", u"/b.py")])
+        self.assertEqual(cache.size, cache._disk_usage())
+        self.assertEqual(len(cache._entries()), 2)
+
+    def test_file_key(self):
+        path = os.path.join(self.directory, "a.py")
+        with open(path, "wb") as f:
+            f.write("def f(): pass")
+        os.utime(path, (1000, 1000))
+        key = self.cache.file_key(path, "ctags")
+        self.assertEqual(key, self.cache.key("def f(): pass", "ctags"))
+        self.assertIsNone(self.cache.file_key(path + "x", "ctags"))
+        # files with the same size and modification time are not read again
+        with open(path, "wb") as f:
+            f.write("def g(): pass")
+        os.utime(path, (1000, 1000))
+        self.assertEqual(self.cache.file_key(path, "ctags"), key)
+        # unless the parameters changed
+        self.assertEqual(self.cache.file_key(path, "ctags -R"),
+                         self.cache.key("def g(): pass", "ctags -R"))
+        os.utime(path, (1000, 1001))
+        self.assertEqual(self.cache.file_key(path, "ctags"),
+                         self.cache.key("def g(): pass", "ctags"))
+
+    def test_state(self):
+        path = os.path.join(self.directory, "a.py")
+        with open(path, "wb") as f:
+            f.write("def f(): pass")
+        key = self.cache.file_key(path, "ctags")
+        self.cache.put(key, [make_tag(u"f", path)])
+        self.cache.save()
+        self.assertFalse(self.cache.dirty)
+        # a new instance neither reads unchanged files nor walks the cache
+        cache = TagCache(self.directory, 1 << 20)
+        cache.key = None
+        cache._disk_usage = None
+        self.assertEqual(cache.file_key(path, "ctags"), key)
+        cache.put(key, [make_tag(u"f", path)])
+        self.assertEqual(cache.size, self.cache.size)
+        # the state file is not an entry
+        self.assertEqual(len(cache._entries()), 1)
+
+    def test_touched_once(self):
+        key = self.cache.key("content", "ctags")
+        self.cache.put(key, [make_tag(u"f", u"/a.py")])
+        self.assertIsNotNone(self.cache.get(key, u"/a.py"))
+        os.utime(self.cache._path(key), (1000, 1000))
+        self.assertIsNotNone(self.cache.get(key, u"/a.py"))
+        self.assertEqual(os.path.getmtime(self.cache._path(key)), 1000)
+
+    def test_eviction_forgets_files(self):
+        path = os.path.join(self.directory, "a.py")
+        with open(path, "wb") as f:
+            f.write("def f(): pass")
+        key = self.cache.file_key(path, "ctags")
+        self.cache.put(key, [make_tag(u"f", path)])
+        self.cache.max_size = 0
+        self.cache.evict()
+        self.assertEqual(self.cache.files, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
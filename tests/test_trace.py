@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+tests.test_trace
+~~~~~~~~~~~~~~~~
+
+Tests for `surfer.utils.trace`.
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "autoload"))
+
+from surfer.utils import trace
+
+
+class TraceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="surfer-test")
+        self.path = os.path.join(self.directory, "surfer.trace")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, *lines):
+        with open(self.path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def test_round_trip(self):
+        t = trace.Trace(self.path, root=u"/p", tags=10, files=2)
+        t.key("a")
+        # special keys are not valid UTF-8
+        t.key("\x80kb", typeahead=True)
+        t.close(tags=12, files=3)
+        t = trace.Trace(self.path, root=u"/q")
+        t.key("\r")
+        t.file.close()
+
+        sessions = trace.load(self.path)
+        self.assertEqual(len(sessions), 2)
+        opened, keys, closed = sessions[0]
+        self.assertEqual(opened["event"], "open")
+        self.assertEqual((opened["root"], opened["tags"], opened["files"]),
+                         (u"/p", 10, 2))
+        self.assertEqual(keys, [("a", False), ("\x80kb", True)])
+        self.assertEqual(type(keys[1][0]), str)
+        self.assertEqual((closed["tags"], closed["files"]), (12, 3))
+        # Vim quit in the middle of the second session
+        opened, keys, closed = sessions[1]
+        self.assertEqual(opened["root"], u"/q")
+        self.assertEqual(keys, [("\r", False)])
+        self.assertIsNone(closed)
+
+    def test_blank_lines(self):
+        self.write('{"event": "open", "time": 1.0}', '',
+                   '{"event": "key", "t": 0.1, "key": "x"}', '   ',
+                   '{"event": "close", "t": 0.2}')
+        sessions = trace.load(self.path)
+        self.assertEqual(len(sessions), 1)
+        # `typeahead` defaults to False
+        self.assertEqual(sessions[0][1], [("x", False)])
+
+    def test_unknown_events(self):
+        self.write('{"event": "open", "time": 1.0}',
+                   '{"event": "resize", "t": 0.1}',
+                   '{"event": "key", "t": 0.2, "key": "x"}')
+        self.assertEqual(trace.load(self.path)[0][1], [("x", False)])
+
+    def test_empty(self):
+        self.write("")
+        self.assertEqual(trace.load(self.path), [])
+
+    def test_invalid(self):
+        self.write('{"event": "key", "t": 0.1, "key": "x"}')
+        self.assertRaises(ValueError, trace.load, self.path)
+        self.write("not json")
+        self.assertRaises(ValueError, trace.load, self.path)
+        self.assertRaises(IOError, trace.load,
+                          os.path.join(self.directory, "missing"))
+
+
+if __name__ == "__main__":
+    unittest.main()